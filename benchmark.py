@@ -0,0 +1,59 @@
+import logging
+import time
+import timeit
+from pathlib import Path
+from typing import Callable
+
+import frame_count
+import validation
+
+
+# run with "python benchmark.py", times the TAS parsing and validation functions over the test_tases corpus
+def benchmark(name: str, func: Callable, number: int):
+    start_time = time.perf_counter()
+    total_time = min(timeit.repeat(func, number=number, repeat=5))
+    print(f"{name}: {total_time / number * 1000:.3f} ms per corpus pass ({time.perf_counter() - start_time:.1f}s total)")
+
+
+def load_corpus() -> dict[str, bytes]:
+    return {tas_path.name: tas_path.read_bytes() for tas_path in sorted(Path('test_tases').glob('*.tas'))}
+
+
+def run_tokenizer_benchmarks():
+    corpus = load_corpus()
+    corpus_lines = [validation.as_lines(tas) for tas in corpus.values()]
+    corpus_tokens = [validation.tokenize_tas(tas_lines) for tas_lines in corpus_lines]
+    message = validation.MessageData("-1f draft (1:00.000)", 0, 0)
+    print(f"Corpus: {len(corpus)} files, {sum(len(tas_lines) for tas_lines in corpus_lines)} lines, {sum(len(tas) for tas in corpus.values()) / 1024:.1f} KB")
+
+    benchmark("as_lines", lambda: [validation.as_lines(tas) for tas in corpus.values()], 20)
+    benchmark("tokenize_tas", lambda: [validation.tokenize_tas(tas_lines) for tas_lines in corpus_lines], 20)
+    benchmark("parse_tas_file (from lines)", lambda: [validation.parse_tas_file(tas_lines, True) for tas_lines in corpus_lines], 20)
+    benchmark("parse_tas_file (from tokens)", lambda: [validation.parse_tas_file(tas_tokens, True) for tas_tokens in corpus_tokens], 20)
+    benchmark("parse_tas_cached", lambda: [validation.parse_tas_cached(tas, True) for tas in corpus.values()], 20)
+    benchmark("count_frames", lambda: [frame_count.count_frames(tas_tokens) for tas_tokens in corpus_tokens], 20)
+    benchmark("validate", lambda: [validation.validate(tas, filename, message, None, benchmark_project, path_cache={}) for filename, tas in corpus.items()], 5)
+
+
+def run_command_rules_benchmark():
+    corpus_tokens = [validation.parse_tas_cached(tas, True)[1] for tas in load_corpus().values()]
+    command_lines = [(tas_tokens, line_num) for tas_tokens in corpus_tokens for line_num in tas_tokens.commands]
+    compiled_command_rules = validation.compile_command_rules((('set', 'speedrunclock'), ('console', 'overworld')))
+
+    def validate_commands():
+        validation_result = validation.ValidationResult(True, [], [], finished=False)
+
+        for tas_tokens, line_num in command_lines:
+            validation.validate_command(validation_result, tas_tokens, line_num, True, compiled_command_rules, 'benchmark.tas')
+
+    command_time = min(timeit.repeat(validate_commands, number=20, repeat=5)) / 20
+    print(f"validate_command: {len(command_lines) / command_time:,.0f} command lines per second ({len(command_lines)} lines)")
+
+
+benchmark_project = {'project_id': 0, 'is_lobby': False, 'excluded_items': [], 'room_indexing_includes_reads': False, 'disallowed_command_exemptions': [], 'ensure_level': False}
+
+if __name__ == '__main__':
+    validation.log = logging.getLogger('benchmark')
+    validation.log.setLevel(logging.ERROR)
+    run_tokenizer_benchmarks()
+    run_command_rules_benchmark()
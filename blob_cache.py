@@ -0,0 +1,185 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+import urllib.parse
+from pathlib import Path
+from typing import Optional, Union
+
+import orjson
+
+import utils
+
+
+# on disk cache of attachments and repo files, stored by git blob SHA-1 so that the same content is only kept once
+# used from asyncio.to_thread threads, so everything that touches the index holds index_lock
+def get_attachment(url: str) -> Optional[bytes]:
+    with index_lock:
+        return get_blob(load_index()['attachments'].get(attachment_key(url)))
+
+
+def put_attachment(url: str, content: bytes):
+    with index_lock:
+        if sha := put_blob(content):
+            load_index()['attachments'][attachment_key(url)] = sha
+            save_index()
+
+
+# a zip's TAS files as (filename, path in zip, content), stored as their own blobs instead of the whole zip
+def get_zip_tases(url: str) -> Optional[list[tuple[str, str, bytes]]]:
+    with index_lock:
+        key = attachment_key(url)
+        zip_entries = load_index()['zip_tases'].get(key)
+
+        if zip_entries is None:
+            return
+
+        tases = []
+
+        for filename, zip_path, sha in zip_entries:
+            if (content := get_blob(sha)) is None:
+                del load_index()['zip_tases'][key]
+                return
+
+            tases.append((filename, zip_path, content))
+
+        return tases
+
+
+def put_zip_tases(url: str, tases: list[tuple[str, str, bytes]]):
+    with index_lock:
+        zip_entries = []
+
+        for filename, zip_path, content in tases:
+            if not (sha := put_blob(content)):
+                return
+
+            zip_entries.append([filename, zip_path, sha])
+
+        # in case putting later files evicted earlier ones
+        if all(entry[2] in load_index()['blobs'] for entry in zip_entries):
+            load_index()['zip_tases'][attachment_key(url)] = zip_entries
+            save_index()
+
+
+def get_blob(sha: Optional[str]) -> Optional[bytes]:
+    if not sha:
+        return
+
+    with index_lock:
+        index = load_index()
+        blob_path = cache_dir / sha
+
+        try:
+            content = blob_path.read_bytes()
+        except FileNotFoundError:
+            index['blobs'].pop(sha, None)
+            return
+
+        if blob_sha(content) != sha:
+            log.warning(f"Cached blob {sha} is corrupted, removing")
+            remove_blob(sha)
+            return
+
+        index['blobs'][sha] = [len(content), time.time()]
+
+    log.info(f"Using cached blob {sha} ({len(content)} bytes)")
+    return content
+
+
+def put_blob(content: bytes) -> Optional[str]:
+    if len(content) > max_blob_size:
+        return
+
+    sha = blob_sha(content)
+
+    with index_lock:
+        index = load_index()
+
+        if sha not in index['blobs']:
+            cache_dir.mkdir(exist_ok=True)
+            blob_path = cache_dir / sha
+            blob_path_temp = cache_dir / f'{sha}.tmp'
+            blob_path_temp.write_bytes(content)
+            os.replace(blob_path_temp, blob_path)
+
+        index['blobs'][sha] = [len(content), time.time()]
+        evict()
+
+    return sha
+
+
+def remove_blob(sha: str):
+    with index_lock:
+        index = load_index()
+        index['blobs'].pop(sha, None)
+
+        try:
+            (cache_dir / sha).unlink()
+        except FileNotFoundError:
+            pass
+
+
+# remove least recently used blobs until under the size cap, then anything pointing to them
+def evict():
+    with index_lock:
+        index = load_index()
+        total_size = sum(blob[0] for blob in index['blobs'].values())
+
+        if total_size <= max_size:
+            return
+
+        for sha in sorted(index['blobs'], key=lambda blob: index['blobs'][blob][1]):
+            total_size -= index['blobs'][sha][0]
+            remove_blob(sha)
+
+            if total_size <= max_size:
+                break
+
+        index['attachments'] = {url: sha for url, sha in index['attachments'].items() if sha in index['blobs']}
+        index['zip_tases'] = {url: entries for url, entries in index['zip_tases'].items() if all(entry[2] in index['blobs'] for entry in entries)}
+
+    log.info(f"Evicted blob cache down to {total_size} bytes")
+
+
+# same as what git uses, so it matches blob SHAs from the GitHub API
+def blob_sha(content: bytes) -> str:
+    return hashlib.sha1(b'blob %d\0' % len(content) + content).hexdigest()
+
+
+# discord attachment URLs have expiring signature parameters, so ignore those
+def attachment_key(url: str) -> str:
+    return urllib.parse.urlsplit(url)._replace(query='', fragment='').geturl()
+
+
+def load_index() -> dict:
+    global index_loaded
+
+    with index_lock:
+        if index_loaded is None:
+            try:
+                index_loaded = orjson.loads((cache_dir / 'index.json').read_bytes())
+            except (FileNotFoundError, orjson.JSONDecodeError):
+                index_loaded = {}
+
+            index_loaded.pop('repo_files', None)  # from when repo files were cached by path
+
+            for section in ('blobs', 'attachments', 'zip_tases'):
+                index_loaded.setdefault(section, {})
+
+        return index_loaded
+
+
+def save_index():
+    with index_lock:
+        cache_dir.mkdir(exist_ok=True)
+        (cache_dir / 'index.json').write_bytes(orjson.dumps(load_index()))
+
+
+log: Union[logging.Logger, utils.LogPlaceholder] = utils.LogPlaceholder()
+cache_dir = Path('blob_cache')
+index_loaded: Optional[dict] = None
+index_lock = threading.RLock()  # reentrant since the functions call each other
+max_size = 256 * 1048576
+max_blob_size = 32 * 1048576
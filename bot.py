@@ -93,6 +93,7 @@ def start():
 async def on_ready():
     log.info(f"Logged in as {client.user}")
     main.login_time = time.time()
+    main.get_validation_pool()
     await command_tree.sync()
     log.info(f"Servers: {[g.name for g in client.guilds]}")
     downtime_message_count = 0
@@ -1,4 +1,4 @@
-import base64
+import asyncio
 import logging
 import os
 import pprint
@@ -11,7 +11,6 @@ from operator import itemgetter
 from typing import Optional, Union
 
 import discord
-import niquests
 import orjson
 import strip_markdown
 
@@ -19,6 +18,7 @@ import constants
 import db
 import game_sync
 import gen_token
+import github
 import main
 import project_editor
 import spreadsheet
@@ -124,7 +124,7 @@ async def command_register_project(interaction: discord.Interaction, name: str,
         return
 
     # verify github account exists
-    r = niquests.get(f'https://api.github.com/users/{github_account}', headers={'Accept': 'application/vnd.github.v3+json'})
+    r = await asyncio.to_thread(github.get, f'https://api.github.com/users/{github_account}', headers={'Accept': 'application/vnd.github.v3+json'})
     if r.status_code != 200:
         await utils.report_error(client, f"GitHub account {github_account} doesn't seem to exist, status code is {r.status_code}")
         await respond(interaction, f"GitHub account \"{github_account}\" doesn't seem to exist.")
@@ -146,7 +146,7 @@ async def command_register_project(interaction: discord.Interaction, name: str,
     repo_fixed = repo_and_subdir.removeprefix('https://github.com/')
     repo_split = repo_fixed.rstrip('/').split('/')
     repo, subdir = '/'.join(repo_split[:2]), '/'.join(repo_split[2:])
-    r = niquests.get(f'https://api.github.com/repos/{repo}', headers={'Accept': 'application/vnd.github.v3+json'})
+    r = await asyncio.to_thread(github.get, f'https://api.github.com/repos/{repo}', headers={'Accept': 'application/vnd.github.v3+json'})
     if r.status_code != 200:
         await utils.report_error(client, f"Repo {repo} doesn't seem to publically exist, status code is {r.status_code}")
         await respond(interaction, f"Repo \"{repo}\" doesn't seem to publically exist.")
@@ -154,14 +154,14 @@ async def command_register_project(interaction: discord.Interaction, name: str,
 
     # verify subdir exists in repo
     if subdir:
-        r = niquests.get(f'https://api.github.com/repos/{repo}/contents/{subdir}', headers={'Accept': 'application/vnd.github.v3+json'})
+        r = await asyncio.to_thread(github.get, f'https://api.github.com/repos/{repo}/contents/{subdir}', headers={'Accept': 'application/vnd.github.v3+json'})
         if r.status_code != 200 or 'type' in orjson.loads(r.content):
             await utils.report_error(client, f"Directory {subdir} doesn't seem to exist in repo {repo}, status code is {r.status_code}")
             await respond(interaction, f"Directory \"{subdir}\" doesn't seem to exist in \"{repo}\".")
             return
 
     # verify installation can access repo
-    r = niquests.get(f'https://api.github.com/installation/repositories', headers=main.headers)
+    r = await asyncio.to_thread(github.get, f'https://api.github.com/installation/repositories', headers=main.headers)
     accessible_repos = [i['full_name'] for i in orjson.loads(r.content)['repositories']]
     if repo not in accessible_repos:
         await utils.report_error(client, f"Repo {repo} not in accessible to installation: {accessible_repos}")
@@ -216,9 +216,10 @@ async def command_register_project(interaction: discord.Interaction, name: str,
                           'room_suggestion_index': 0,
                           'validate_room_labels': False,
                           'commit_any_time_saved': False,
-                          'last_sync_check_elapsed_time': 0}
+                          'last_sync_check_elapsed_time': 0,
+                          'sync_verified_shas': {}}
 
-    main.generate_path_cache(improvements_channel.id, registered_project)
+    await asyncio.to_thread(main.generate_path_cache, improvements_channel.id, registered_project)
     pinned_message = await main.edit_pin(improvements_channel, create_from_project=registered_project)
     await pinned_message.pin()
     registered_project['pin'] = pinned_message.id
@@ -351,7 +352,7 @@ async def command_rename_file(interaction: discord.Interaction, project_name: st
         return
 
     main.generate_request_headers(project['installation_owner'])
-    path_cache = main.generate_path_cache(project['project_id'])
+    path_cache = await asyncio.to_thread(main.generate_path_cache, project['project_id'])
 
     if filename_before not in path_cache:
         not_found_text = f"{filename_before} not in project {project['name']}."
@@ -367,38 +368,36 @@ async def command_rename_file(interaction: discord.Interaction, project_name: st
     user_github_account = utils.get_user_github_account(interaction.user.id)
 
     log.info(f"Downloading {filename_before}")
-    r = niquests.get(f'https://api.github.com/repos/{repo}/contents/{file_path}', headers=main.headers)
-    utils.handle_potential_request_error(r, 200)
-    tas_downloaded = base64.b64decode(orjson.loads(r.content)['content'])
+    tas_downloaded = await asyncio.to_thread(main.download_old_file, project['project_id'], repo, filename_before, path_cache)
 
-    # commit 1: delete old file
-    log.info("Performing delete commit")
-    data = {'message': f"Renamed {filename_before} to {filename_after} (deleting)", 'sha': main.get_sha(repo, file_path)}
-    if user_github_account:
-        data['author'] = {'name': user_github_account[0], 'email': user_github_account[1]}
-        log.info(f"Setting commit author to {data['author']}")
-    r = niquests.delete(f'https://api.github.com/repos/{repo}/contents/{file_path}', headers=main.headers, data=orjson.dumps(data))
-    utils.handle_potential_request_error(r, 200)
-    time.sleep(1)  # just to be safe
-
-    # commit 2: create new file (or overwrite)
-    log.info("Performing recreate commit")
-    data = {'message': f"Renamed {filename_before} to {filename_after} (creating)", 'content': base64.b64encode(tas_downloaded).decode('UTF8')}
     if filename_after in path_cache:
         file_path_after = path_cache[filename_after]
         log.info(f"Overwriting, file should already exist at {file_path_after}")
-        data['sha'] = main.get_sha(repo, file_path_after)
-        expected_status = 200
     else:
         file_path_after = file_path.replace(filename_before, filename_after)
-        expected_status = 201
+
+    author = None
     if user_github_account:
-        data['author'] = {'name': user_github_account[0], 'email': user_github_account[1]}
-        log.info(f"Setting commit author to {data['author']}")
-    r = niquests.put(f'https://api.github.com/repos/{repo}/contents/{file_path_after}', headers=main.headers, data=orjson.dumps(data))
-    utils.handle_potential_request_error(r, expected_status)
+        author = {'name': user_github_account[0], 'email': user_github_account[1]}
+        log.info(f"Setting commit author to {author}")
 
-    if r.status_code == expected_status:
+    # delete and recreate in one commit
+    if tas_downloaded is None:
+        log.error(f"Couldn't download {file_path}")
+        rename_successful = False
+    else:
+        commit_builder = github.CommitBuilder(repo, main.headers)
+        commit_builder.delete_file(file_path)
+        commit_builder.add_file(file_path_after, tas_downloaded)
+
+        try:
+            await asyncio.to_thread(commit_builder.commit, f"Renamed {filename_before} to {filename_after}", author)
+            rename_successful = True
+        except (github.CommitError, github.RateLimitedError) as error:
+            log.error(error)
+            rename_successful = False
+
+    if rename_successful:
         db.path_caches.enable_cache()
         db.path_caches.remove_file(project['project_id'], filename_before)
         db.path_caches.add_file(project['project_id'], filename_after, file_path_after)
@@ -594,7 +593,7 @@ async def command_projects_admined(interaction: discord.Interaction):
 
 @command(report_usage=True)
 async def command_set_github(interaction: discord.Interaction, account_name: str, email: str):
-    r = niquests.get(f'https://api.github.com/users/{account_name}', headers={'Accept': 'application/vnd.github.v3+json'})
+    r = await asyncio.to_thread(github.get, f'https://api.github.com/users/{account_name}', headers={'Accept': 'application/vnd.github.v3+json'})
 
     if r.status_code != 200:
         await utils.report_error(client, f"GitHub account {account_name} doesn't seem to exist, status code is {r.status_code}")
@@ -619,7 +618,7 @@ async def command_check_github(interaction: discord.Interaction):
     except db.DBKeyError:
         await respond(interaction, "You do not have a Github account associated with your Discord account.")
     else:
-        r = niquests.get(f'https://api.github.com/users/{account_name}', headers={'Accept': 'application/vnd.github.v3+json'})
+        r = await asyncio.to_thread(github.get, f'https://api.github.com/users/{account_name}', headers={'Accept': 'application/vnd.github.v3+json'})
         account_exists = r.status_code == 200
         await respond(interaction, f"Username: {account_name}\n"
                                    f"Email: {email}\n"
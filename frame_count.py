@@ -0,0 +1,137 @@
+import dataclasses
+import re
+from typing import Callable, Optional
+
+import numpy as np
+
+import validation
+
+ReadFile = Callable[[str, str], Optional[tuple[str, validation.TokenizedTAS]]]
+
+
+@dataclasses.dataclass
+class FrameCount:
+    total: int
+    rooms: dict[str, int]  # room label (without #lvl_) -> frames, in file order. revisits without indexes are combined
+    unresolved_reads: list[str]
+
+    def seconds(self) -> float:
+        return self.total * 0.017
+
+
+# statically count how many frames a TAS's inputs add up to, without running it. read_file gets the reading file's path and a Read command's file argument,
+# and returns the read file's path and tokens (see read_resolver)
+def count_frames(tas_tokens: validation.TokenizedTAS, read_file: Optional[ReadFile] = None, path: str = '') -> FrameCount:
+    unresolved_reads = []
+    frames = line_frames(tas_tokens, path, read_file, unresolved_reads, ())
+    room_label_line_nums = tas_tokens.lines_of_type(validation.LineType.ROOM_LABEL)
+    rooms = {}
+
+    if room_label_line_nums:
+        # label each line with the index of the room it's in, then sum each room at once
+        room_starts = np.zeros(len(frames), dtype=np.int64)
+        room_starts[room_label_line_nums] = 1
+        line_rooms = np.cumsum(room_starts) - 1
+        in_room = line_rooms >= 0
+        room_frames = np.bincount(line_rooms[in_room], weights=frames[in_room], minlength=len(room_label_line_nums))
+
+        for room_label_line_num, frames_in_room in zip(room_label_line_nums, room_frames):
+            room = tas_tokens.stripped[room_label_line_num].removeprefix('#lvl_')
+            rooms[room] = rooms.get(room, 0) + int(frames_in_room)
+
+    return FrameCount(int(frames.sum()), rooms, unresolved_reads)
+
+
+# the frames each line adds, after expanding repeats and reads. with line_ranges (start, end) only the lines in them are counted, and the rest are 0
+def line_frames(tas_tokens: validation.TokenizedTAS, path: str, read_file: Optional[ReadFile], unresolved_reads: list[str], reading: tuple[str, ...],
+                line_ranges: Optional[list[tuple[int, int]]] = None) -> np.ndarray:
+    types = np.frombuffer(tas_tokens.types, dtype=np.uint8)
+    frames = np.zeros(len(types), dtype=np.int64)
+    is_input = types == validation.LineType.INPUT
+    in_ranges = None
+
+    if line_ranges is not None:
+        in_ranges = np.zeros(len(types), dtype=bool)
+
+        for start_line_num, end_line_num in line_ranges:
+            in_ranges[start_line_num:end_line_num] = True
+
+        is_input &= in_ranges
+
+    input_line_nums = np.flatnonzero(is_input)
+
+    if len(input_line_nums):
+        frames[input_line_nums] = input_frames(tas_tokens, input_line_nums)
+
+    repeat_starts = []
+
+    for line_num, command_split in tas_tokens.commands.items():
+        match command_split[0].lower():
+            case 'repeat':
+                repeat_count = command_split[1].strip() if len(command_split) > 1 else ''
+                repeat_starts.append((line_num, int(repeat_count) if repeat_count.isdigit() else 1))
+            case 'endrepeat' if repeat_starts:
+                repeat_start, repeat_count = repeat_starts.pop()
+                frames[repeat_start + 1:line_num] *= repeat_count
+            case 'read' if in_ranges is None or in_ranges[line_num]:
+                frames[line_num] = read_frames(command_split, path, read_file, unresolved_reads, reading + (path,))
+
+    return frames
+
+
+# the frame counts of input lines, which is the number each one starts with
+def input_frames(tas_tokens: validation.TokenizedTAS, input_line_nums: np.ndarray) -> np.ndarray:
+    # finding and converting them all in one string is much faster than going line by line
+    frame_columns = re_input_frames_multiline.findall('\n'.join(map(tas_tokens.stripped.__getitem__, input_line_nums.tolist())))
+
+    if len(frame_columns) != len(input_line_nums):
+        frame_columns = [frames_match[0] if (frames_match := re_input_frames.match(tas_tokens.stripped[line_num])) else '0' for line_num in input_line_nums.tolist()]
+
+    if max(map(len, frame_columns)) > max_frames_digits:
+        # don't let one absurdly long line count as billions of frames
+        frame_columns = [column if len(column) <= max_frames_digits else '0' for column in frame_columns]
+
+    frames = np.fromstring(' '.join(frame_columns), dtype=np.int64, sep=' ')
+
+    if len(frames) != len(frame_columns):
+        # non-ASCII digits
+        frames = np.array([int(column) for column in frame_columns], dtype=np.int64)
+
+    return frames
+
+
+# the frames that a Read command adds, which is the sum of the read file's lines between the start and end
+def read_frames(command_split: list[str], path: str, read_file: Optional[ReadFile], unresolved_reads: list[str], reading: tuple[str, ...]) -> int:
+    args = [arg.strip() for arg in command_split[1:]]
+    read = read_file(path, args[0]) if read_file and args else None
+
+    if not read or read[0] in reading or len(reading) > max_read_depth:
+        unresolved_reads.append(','.join(command_split))
+        return 0
+
+    read_path, read_tokens = read
+    frames = line_frames(read_tokens, read_path, read_file, unresolved_reads, reading)
+    start_line_num = find_read_line(read_tokens, args[1]) if len(args) > 1 else 0
+    end_line_num = find_read_line(read_tokens, args[2]) if len(args) > 2 else len(frames) - 1
+
+    if start_line_num is None or end_line_num is None:
+        unresolved_reads.append(','.join(command_split))
+        return 0
+
+    return int(frames[start_line_num:end_line_num + 1].sum())
+
+
+# Read start and end can be 1-indexed line numbers or labels (comments, including room labels and #Start)
+def find_read_line(tas_tokens: validation.TokenizedTAS, line: str) -> Optional[int]:
+    if line.isdigit():
+        return min(max(int(line) - 1, 0), len(tas_tokens.lines) - 1)
+
+    for line_num, line_type in enumerate(tas_tokens.types):
+        if line_type in (validation.LineType.COMMENT, validation.LineType.ROOM_LABEL, validation.LineType.START) and tas_tokens.stripped[line_num][1:].strip() == line:
+            return line_num
+
+
+re_input_frames = re.compile(r'\d+')
+re_input_frames_multiline = re.compile(r'^\d+', re.MULTILINE)
+max_read_depth = 10
+max_frames_digits = 9
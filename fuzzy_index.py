@@ -0,0 +1,72 @@
+from typing import Iterable, Optional, Sequence, Union
+
+
+# fuzzy matching over a fixed set of names (a project's filenames, SJ maps), with everything that doesn't depend on the query done once
+class FuzzyIndex:
+    def __init__(self, choices: Iterable[str]):
+        from rapidfuzz import process as fuzzy_process  # slow to import, so only done when building an index
+        self.extract = fuzzy_process.extract
+        self.extract_one = fuzzy_process.extractOne
+        self.choices = tuple(choices)
+        self.choices_set = frozenset(self.choices)
+        self.choices_lower = tuple(choice.lower() for choice in self.choices)
+        self.ngram_buckets: dict[int, dict[str, list[int]]] = {2: {}, 3: {}}  # n -> ngram -> indexes of choices containing it
+        self.short_choices: dict[int, list[int]] = {2: [], 3: []}  # n -> indexes of choices too short to have any ngrams, which always need checking
+
+        for choice_index, choice_lower in enumerate(self.choices_lower):
+            choice_name = choice_lower.removesuffix('.tas')
+
+            for n, buckets in self.ngram_buckets.items():
+                if len(choice_name) < n:
+                    self.short_choices[n].append(choice_index)
+
+                for ngram in ngrams(choice_name, n):
+                    buckets.setdefault(ngram, []).append(choice_index)
+
+    # choices that share any ngram with the query, in their original order. a close enough match always does, so this is only for high score cutoffs
+    def candidates(self, query: str) -> Sequence[str]:
+        query_name = query.lower().removesuffix('.tas')
+
+        if len(query_name) < 4:
+            return self.choices
+
+        n = 2 if len(query_name) < 8 else 3  # short names can be close matches with few shared trigrams
+        buckets = self.ngram_buckets[n]
+        candidate_indexes = set(self.short_choices[n])
+
+        for ngram in ngrams(query_name, n):
+            candidate_indexes.update(buckets.get(ngram, ()))
+
+        return [self.choices[candidate_index] for candidate_index in sorted(candidate_indexes)]
+
+    # the closest choice, if any is at least a close (90ish) match
+    def best_match(self, query: str, score_cutoff: float) -> Optional[str]:
+        match = self.extract_one(query, self.candidates(query), score_cutoff=score_cutoff)
+        return match[0] if match else None
+
+    # the closest choices above a (low) score, checking every choice
+    def matches(self, query: str, limit: int = 5, score_cutoff: float = 0) -> list[str]:
+        return [match[0] for match in self.extract(query, self.choices, limit=limit, score_cutoff=score_cutoff)]
+
+    def starting_with(self, prefix: str) -> list[str]:
+        return [choice for choice, choice_lower in zip(self.choices, self.choices_lower) if choice_lower.startswith(prefix)]
+
+
+def ngrams(name: str, n: int) -> set[str]:
+    return {name[i:i + n] for i in range(len(name) - n + 1)}
+
+
+# a project's index, rebuilt only if its filenames have changed since last time (in any order, since path caches aren't always sorted the same)
+# keyed by project ID in the bot, or by anything else stable for other tools
+def project_index(project_id: Union[int, str], filenames: Iterable[str]) -> FuzzyIndex:
+    filenames = tuple(filenames)
+    index = project_indexes.get(project_id)
+
+    if not index or index.choices_set != frozenset(filenames):
+        index = FuzzyIndex(filenames)
+        project_indexes[project_id] = index
+
+    return index
+
+
+project_indexes: dict[Union[int, str], FuzzyIndex] = {}
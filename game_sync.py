@@ -1,20 +1,24 @@
 import argparse
 import base64
+import concurrent.futures
+import dataclasses
 import functools
 import gzip
 import io
 import logging
 import os
 import platform
+import queue
 import re
 import shutil
 import stat
 import subprocess
+import threading
 import time
 import zipfile
 import zlib
 from pathlib import Path
-from typing import Optional, Union
+from typing import Any, Optional, Union
 
 import dateutil.parser
 import niquests
@@ -23,7 +27,9 @@ from deepdiff import DeepDiff
 
 import db
 import gen_token
+import github
 import main
+import read_resolver
 import utils
 import validation
 from utils import plural
@@ -33,6 +39,7 @@ def run_syncs():
     global log, game_sync_hash
     start_time = time.time()
     log = main.create_logger('game_sync')
+    read_resolver.log = log
     db.misc.set('last_game_sync_start_time', int(start_time))
 
     parser = argparse.ArgumentParser()
@@ -112,7 +119,6 @@ def sync_test(project_id: int, force: bool, force_file: str | None, safe_mode: b
     files_timed = 0
     queued_update_commits = []
     crash_logs_data = {}
-    crash_logs_dir = game_dir() / 'CrashLogs'
     get_mod_dependencies.cache_clear()
 
     if safe_mode:
@@ -144,6 +150,9 @@ def sync_test(project_id: int, force: bool, force_file: str | None, safe_mode: b
     log.info(f"Starting sync check for project: {project['name']} ({project_id})")
     db.misc.set('last_game_sync_start_time', int(start_time))
     log.info(f"Environment state changes: {DeepDiff(prev_environment_state, environment_state, ignore_order=True, ignore_numeric_type_changes=True, verbose_level=2)}")
+    # new commits alone only need the changed files to be rerun, anything else (mods, Everest, settings) could affect every file
+    environment_changes = {key for key in environment_state if environment_state[key] != prev_environment_state.get(key)}
+    full_run = force or bool(environment_changes - {'last_commit_time'})
     remove_save_files()
     update_mods(mods_to_load)
     get_mod_everest_yaml.cache_clear()
@@ -153,7 +162,7 @@ def sync_test(project_id: int, force: bool, force_file: str | None, safe_mode: b
     start_game(project['validate_room_labels'])
 
     # make sure path cache is correct while the game is launching
-    main.generate_path_cache(project_id)
+    main.generate_path_cache(project_id, priority=github.Priority.BACKGROUND)
     path_cache = db.path_caches.get(project_id)
 
     if not path_cache and not force:
@@ -164,6 +173,9 @@ def sync_test(project_id: int, force: bool, force_file: str | None, safe_mode: b
 
     # clone repo
     clone_time, repo_path = clone_repo(repo, project_id)
+    resolver = read_resolver.ReadResolver.from_folder(repo_path, path_cache)
+    head_sha = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=repo_path, capture_output=True).stdout.decode('UTF8').strip()
+    verified_shas = project.get('sync_verified_shas', {})  # projects from before this was added don't have it
     asserts_added = {}
     sid_cache_files_removed = []
     og_tas_lines = {}
@@ -183,6 +195,13 @@ def sync_test(project_id: int, force: bool, force_file: str | None, safe_mode: b
 
         log.info(f"Only checking file {force_file}")
         path_cache = {force_file: path_cache[force_file]}
+    elif full_run:
+        log.info(f"Checking all {len(path_cache)} files, due to environment changes: {sorted(environment_changes)}")
+    else:
+        selected_path_cache = select_changed_files(path_cache, verified_shas, head_sha, repo_path, resolver)
+        # keep times of files that don't need rerunning
+        filetimes = {tas_filename: filetime for tas_filename, filetime in project['filetimes'].items() if tas_filename in path_cache and tas_filename not in selected_path_cache}
+        path_cache = selected_path_cache
 
     for tas_filename in path_cache:
         file_path_repo = path_cache[tas_filename]
@@ -198,15 +217,13 @@ def sync_test(project_id: int, force: bool, force_file: str | None, safe_mode: b
                 tas_lines = tas_file.readlines()
                 og_tas_lines[tas_filename] = tas_lines.copy()
 
-                for tas_line in enumerate(tas_lines):
-                    if tas_line[1].lower() == '#start\n':
-                        assert_line = f'Assert,Equal,{sid},{{Level.Session.Area.SID}}\n'
-                        assert_line_num = tas_line[0] + 3
-                        tas_lines.insert(assert_line_num, assert_line)
-                        tas_file.seek(0)
-                        tas_file.writelines(tas_lines)
-                        asserts_added[file_path_repo] = (assert_line_num, assert_line)
-                        break
+                if start_lines := validation.tokenize_tas(tas_lines).lines_of_type(validation.LineType.START):
+                    assert_line = f'Assert,Equal,{sid},{{Level.Session.Area.SID}}\n'
+                    assert_line_num = start_lines[0] + 3
+                    tas_lines.insert(assert_line_num, assert_line)
+                    tas_file.seek(0)
+                    tas_file.writelines(tas_lines)
+                    asserts_added[file_path_repo] = (assert_line_num, assert_line)
 
     if asserts_added:
         log.info(f"Added SID assertions to {len(asserts_added)} file{plural(asserts_added)}: {asserts_added}")
@@ -230,189 +247,57 @@ def sync_test(project_id: int, force: bool, force_file: str | None, safe_mode: b
         sleep_scale = sleep_scale_default
 
     log.info(f"Previous desyncs: {previous_desyncs}")
-    game_process = wait_for_game_load(mods_to_load, project['name'])
-
-    for tas_filename in path_cache:
-        file_path_repo = path_cache[tas_filename]
-        file_path = repo_path / file_path_repo.replace('/', os.sep)
-
-        if 'lobby' in file_path_repo.lower() and 'lobby' not in tas_filename.lower():
-            log.info(f"Skipping {tas_filename} (lobby)")
-            continue
-        elif tas_filename in ('translocation.tas', 'mt_celeste_jazz_club.tas'):
-            continue
-
-        with open(file_path, 'rb') as tas_file:
-            tas_file_raw = tas_file.read()
-
-        # set up tas file
-        tas_lines = tas_file_raw.replace(b'\r\n', b'\n').decode('UTF8').splitlines(keepends=True)
-        tas_parsed = validation.parse_tas_file(tas_lines, False, False)
-
-        if tas_filename not in og_tas_lines:
-            og_tas_lines[tas_filename] = tas_lines.copy()
+    files_to_sync = list(path_cache.items())
+    instances = game_instances()[:max(1, len(files_to_sync))]
 
-        if tas_parsed.found_finaltime:
-            finaltime_line_lower = tas_lines[tas_parsed.finaltime_line_num].lower()
-            has_filetime = finaltime_line_lower.startswith('filetime')
-            finaltime_is_midway = finaltime_line_lower.startswith('midway')
-            finaltime_line_blank = f'{tas_lines[tas_parsed.finaltime_line_num].partition(' ')[0]} \n'
-            tas_lines[tas_parsed.finaltime_line_num] = finaltime_line_blank
+    if len(instances) > 1:
+        # longest first, so that a long file doesn't get started last and hold everything up
+        files_to_sync.sort(key=lambda file: resolver.frames(file[1]).total if file[1] in resolver.files else 0, reverse=True)
+        log.info(f"Sync checking {len(files_to_sync)} files with {len(instances)} game instances")
 
-            if has_filetime or finaltime_is_midway:
-                clear_debug_save()
+        for instance in instances[1:]:
+            start_game(project['validate_room_labels'], instance)
 
-            if has_filetime:
-                has_console_load = [line for line in tas_lines if line.startswith('console load')] != []
+    sync_context = SyncContext(project, mods_to_load, repo_path, resolver, og_tas_lines, sid_cache)
+    sync_results = run_sync_queue(instances, files_to_sync, sync_context)
+    sids_cached = []
 
-                if not has_console_load:
-                    # if it starts from begin, then menu there. doesn't change mod
-                    tas_lines[:0] = ['unsafe\n', 'console overworld\n', '2\n', '1,J\n', '94\n', '1,J\n', '56\n','1,U\n', '1,J\n', '14\n']
-        else:
-            log.info(f"{tas_filename} has no final time")
+    # merge in path cache order, so results don't depend on which instance finished first
+    for tas_filename, file_path_repo in path_cache.items():
+        if not (sync_result := sync_results.get(tas_filename)):
             continue
 
-        if 'CollabUtils2' in mods_to_load:
-            tas_lines.insert(0, f'Set,CollabUtils2.DisplayEndScreenForAllMaps,{not has_filetime}\n')
-
-        tas_lines.insert(0, 'Set,Everest.ShowModOptionsInGame,False\n')
-        tas_lines.append('\n***')
+        files_timed += sync_result.timed
+        crash_logs_data |= sync_result.crash_logs
 
-        with open(file_path, 'w', encoding='UTF8') as tas_file:
-            tas_file.truncate()
-            tas_file.write(''.join(tas_lines))
-
-        # now run it
-        time.sleep(0.5)
-        initial_mtime = os.path.getmtime(file_path)
-        file_sync_start_time = time.time()
-        log.info(f"Sync checking {tas_filename} ({tas_parsed.finaltime_trimmed})")
-        tas_started = False
-        tas_finished = False
-        sid = None
-        game_crashed = False
-
-        while not tas_started and not game_crashed:
-            try:
-                niquests.post(f'http://localhost:32270/tas/playtas?filePath={file_path}'.replace('+', '%2B'), timeout=10)
-            except niquests.RequestException:
-                if not game_process.is_running():
-                    game_crashed = True
-            else:
-                crash_logs = os.listdir(crash_logs_dir)
-                tas_started = True
+        if sync_result.desync:
+            desyncs.append(sync_result.desync)
 
-        while not tas_finished and not game_crashed:
-            if time.time() - file_sync_start_time > 3600 * 5:
-                raise TimeoutError(f"File {tas_filename} in project {project['name']} has frozen after five hours")
-
-            try:
-                scaled_sleep(20 if has_filetime else 5)
-                session_data = niquests.get('http://localhost:32270/tas/info?forceAllowCodeExecution=true', timeout=2).text
-            except niquests.RequestException:
-                if not game_process.is_running():
-                    game_crashed = True
-            else:
-                tas_running = 'Running: True' in session_data
-                session_current_frames = session_data.partition('CurrentFrame: ')[2].partition('<')[0]
-                session_total_frames = session_data.partition('TotalFrames: ')[2].partition('<')[0]
-                tas_finished = not tas_running or session_current_frames == session_total_frames
-
-                if tas_finished:
-                    niquests.post('http://localhost:32270/tas/sendhotkey?id=Pause', timeout=2)  # resume if paused tas
-
-                if not has_filetime:
-                    sid = session_data.partition('SID: ')[2].partition(' (')[0]
-
-        log.info("TAS has finished")
-        files_timed += 1
-        scaled_sleep(15 if has_filetime or 'SID:  ()' in session_data else 5)
-        extra_sleeps = 0
-
-        while not game_crashed and os.path.getmtime(file_path) == initial_mtime and extra_sleeps < 5:
-            time.sleep(3 + (extra_sleeps ** 2))
-            extra_sleeps += 1
-            log.info(f"Extra sleeps: {extra_sleeps}")
-
-        updated_crash_logs = os.listdir(crash_logs_dir)
-        new_crash_logs = [file for file in updated_crash_logs if file not in crash_logs]
-
-        if game_crashed or new_crash_logs:
-            log.warning(f"Game crashed ({new_crash_logs}), restarting and continuing")
-            scaled_sleep(10)
-            close_game()
-            scaled_sleep(5)
-            start_game(project['validate_room_labels'])
+        if sync_result.filetime:
+            filetimes[tas_filename] = sync_result.filetime
 
-            if new_crash_logs:
-                desyncs.append((tas_filename, "Crashed game"))
+        if sync_result.update_commit:
+            queued_update_commits.append(sync_result.update_commit)
 
-                for new_crash_log_name in new_crash_logs[:10]:
-                    with open(crash_logs_dir / new_crash_log_name, 'rb') as new_crash_log:
-                        crash_logs_data[f'{new_crash_log_name}.gz'] = b64encode(gzip.compress(new_crash_log.read()))
+        if sync_result.sid and file_path_repo not in sid_cache:
+            sid_cache[file_path_repo] = sync_result.sid
+            sids_cached.append(file_path_repo)
 
-            game_process = wait_for_game_load(mods_to_load, project['name'])
-            continue
-
-        # determine if it synced or not
-        with open(file_path, 'rb') as tas_file:
-            tas_updated = validation.as_lines(tas_file.read())
-
-        tas_parsed_new = validation.parse_tas_file(tas_updated, False, False, tas_parsed.finaltime_type)
-
-        # for silvers
-        if has_filetime:
-            clear_debug_save()
-
-        if not tas_parsed_new.found_finaltime:
-            log.warning(f"Desynced (no {finaltime_line_blank.partition(':')[0]})")
-            log.info(session_data.partition('<pre>')[2].partition('</pre>')[0])
-            desyncs.append((tas_filename, None))
-            continue
-
-        frame_diff = validation.calculate_time_difference(tas_parsed_new.finaltime, tas_parsed.finaltime)
-        time_synced = frame_diff == 0
-        time_delta = (f"{tas_parsed.finaltime_trimmed}({tas_parsed.finaltime_frames}) -> {tas_parsed_new.finaltime_trimmed}({tas_parsed_new.finaltime_frames}) "
-                      f"({'+' if frame_diff > 0 else ''}{frame_diff}f)")
-
-        if has_filetime or project['commit_any_time_saved']:
-            log.info(f"Time: {tas_parsed_new.finaltime_trimmed}")
+    if sids_cached:
+        db.sid_caches.set(project_id, sid_cache)
+        log.info(f"Cached SID{plural(sids_cached)} for {sids_cached}")
 
-            if has_filetime:
-                filetimes[tas_filename] = tas_parsed_new.finaltime_trimmed
+    close_game()
+    desynced_files = {desync[0] for desync in desyncs}
 
-            if not time_synced:
-                if project['commit_any_time_saved'] and frame_diff > 0:  # god this logic is a mess
-                    log.warning(f"Desynced: {time_delta}")
-                    desyncs.append((tas_filename, time_delta))
-                else:
-                    new_time_line = tas_updated[tas_parsed_new.finaltime_line_num]
-                    tas_lines_og = og_tas_lines[tas_filename]
-                    tas_lines_og[validation.parse_tas_file(tas_lines_og, False, False).finaltime_line_num] = f'{new_time_line}\n'
-                    commit_message = f"{'+' if frame_diff > 0 else ''}{frame_diff}f {tas_filename} ({tas_parsed_new.finaltime_trimmed})"
-                    queued_update_commits.append((file_path, tas_lines_og, tas_file_raw, commit_message))
-                    # don't commit now, since there may be desyncs
-                    log.info("Queued for update commit")
+    for tas_filename, file_path_repo in path_cache.items():
+        if tas_filename in desynced_files:
+            verified_shas.pop(file_path_repo, None)
         else:
-            if not tas_parsed_new.finaltime_frames:
-                log_error(f"Couldn't parse FileTime frames for {file_path_repo}")
-                continue
-
-            log_command = log.info if time_synced else log.warning
-            log_command(f"{'Synced' if time_synced else 'Desynced'}: {time_delta}")
+            verified_shas[file_path_repo] = head_sha
 
-            if time_synced:
-                if file_path_repo not in sid_cache and sid_is_valid(sid):
-                    sid_cache[file_path_repo] = sid
-                    db.sid_caches.set(project_id, sid_cache)
-                    log.info(f"Cached SID for {file_path_repo}: {sid}")
-                elif not sid:
-                    log.warning(f"Running {file_path_repo} yielded no SID")
-            else:
-                desyncs.append((tas_filename, time_delta))
-
-    close_game()
     project = db.projects.get(project_id)  # update this, in case it has changed since starting
+    project['sync_verified_shas'] = {file_path_repo: sha for file_path_repo, sha in verified_shas.items() if file_path_repo in resolver.files}
     project['sync_environment_state'] = environment_state
     project['filetimes'] = filetimes
     project['last_run_validation'] = int(clone_time)
@@ -482,18 +367,349 @@ def sync_test(project_id: int, force: bool, force_file: str | None, safe_mode: b
                         '-c', 'user.email=104732884+celestetas-improvements-tracker[bot]@users.noreply.github.com',
                         'commit',
                         '-m', commit_message])
-        subprocess.run(['git', 'push'])
+        pushed = push_with_rebase()
         commit_sha = subprocess.check_output(['git', 'rev-parse', 'HEAD'], encoding='UTF8').strip()
         os.chdir(base_dir)
         commit_url = f'https://github.com/{repo}/commit/{commit_sha}'
-        log.info(f"Successfully committed: {commit_url}")
 
-        if project_id == 598945702554501130:
-            db.send_sync_result(db.SyncResultType.MAINGAME_COMMIT, {'maingame_message': f"Committed `{commit_message}` <{commit_url}>"})
+        if pushed:
+            log.info(f"Successfully committed: {commit_url}")
+
+            if project_id == 598945702554501130:
+                db.send_sync_result(db.SyncResultType.MAINGAME_COMMIT, {'maingame_message': f"Committed `{commit_message}` <{commit_url}>"})
+        else:
+            log_error(f"Couldn't push {commit_url}")
 
     log.info(f"Sync check time: {format_elapsed_time(start_time)}")
 
 
+# what a sync check run needs for playing each file, shared by all the game instances
+@dataclasses.dataclass
+class SyncContext:
+    project: dict
+    mods_to_load: set
+    repo_path: Path
+    resolver: read_resolver.ReadResolver
+    og_tas_lines: dict[str, list[str]]
+    sid_cache: dict[str, str]
+
+
+@dataclasses.dataclass
+class FileSyncResult:
+    tas_filename: str
+    timed: bool = False
+    desync: Optional[tuple[str, Optional[str]]] = None
+    filetime: Optional[str] = None
+    sid: Optional[str] = None  # to cache, if it synced
+    update_commit: Optional[tuple] = None  # (file path, lines, raw file, commit message)
+    crash_logs: dict[str, str] = dataclasses.field(default_factory=dict)
+
+
+# each game instance takes files from a shared queue until it's empty, so a slow file only holds up its own instance
+def run_sync_queue(instances: list['GameInstance'], files_to_sync: list[tuple[str, str]], sync_context: SyncContext) -> dict[str, FileSyncResult]:
+    file_queue = queue.Queue()
+    stop = threading.Event()
+
+    for file_to_sync in files_to_sync:
+        file_queue.put(file_to_sync)
+
+    def instance_worker(instance: GameInstance) -> list[FileSyncResult]:
+        instance_results = []
+
+        try:
+            instance.process = wait_for_game_load(sync_context.mods_to_load, sync_context.project['name'], instance)
+
+            while not stop.is_set():
+                try:
+                    tas_filename, file_path_repo = file_queue.get_nowait()
+                except queue.Empty:
+                    break
+
+                if sync_result := sync_file(instance, tas_filename, file_path_repo, sync_context):
+                    instance_results.append(sync_result)
+        except Exception:
+            # let the other instances finish what they're playing, but not start anything else
+            stop.set()
+            raise
+
+        return instance_results
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(instances), thread_name_prefix='game_instance') as pool:
+        instance_futures = [pool.submit(instance_worker, instance) for instance in instances]
+
+    return {sync_result.tas_filename: sync_result for instance_future in instance_futures for sync_result in instance_future.result()}
+
+
+# play one file in a game instance and see if it syncs. None if it was skipped
+def sync_file(instance: 'GameInstance', tas_filename: str, file_path_repo: str, sync_context: SyncContext) -> Optional[FileSyncResult]:
+    project = sync_context.project
+    file_path = sync_context.repo_path / file_path_repo.replace('/', os.sep)
+    og_tas_lines = sync_context.og_tas_lines
+    crash_logs_dir = instance.path / 'CrashLogs'
+    sync_result = FileSyncResult(tas_filename)
+
+    if 'lobby' in file_path_repo.lower() and 'lobby' not in tas_filename.lower():
+        log.info(f"Skipping {tas_filename} (lobby)")
+        return
+    elif tas_filename in ('translocation.tas', 'mt_celeste_jazz_club.tas'):
+        return
+
+    with open(file_path, 'rb') as tas_file:
+        tas_file_raw = tas_file.read()
+
+    # set up tas file
+    tas_lines = tas_file_raw.replace(b'\r\n', b'\n').decode('UTF8').splitlines(keepends=True)
+    tas_parsed = validation.parse_tas_cached(tas_file_raw, False, False)[0]
+    frames = sync_context.resolver.frames(file_path_repo)
+
+    if tas_filename not in og_tas_lines:
+        og_tas_lines[tas_filename] = tas_lines.copy()
+
+    if tas_parsed.found_finaltime:
+        finaltime_line_lower = tas_lines[tas_parsed.finaltime_line_num].lower()
+        has_filetime = finaltime_line_lower.startswith('filetime')
+        finaltime_is_midway = finaltime_line_lower.startswith('midway')
+        finaltime_line_blank = f'{tas_lines[tas_parsed.finaltime_line_num].partition(' ')[0]} \n'
+        tas_lines[tas_parsed.finaltime_line_num] = finaltime_line_blank
+
+        if has_filetime or finaltime_is_midway:
+            clear_debug_save(instance)
+
+        if has_filetime:
+            has_console_load = [line for line in tas_lines if line.startswith('console load')] != []
+
+            if not has_console_load:
+                # if it starts from begin, then menu there. doesn't change mod
+                tas_lines[:0] = ['unsafe\n', 'console overworld\n', '2\n', '1,J\n', '94\n', '1,J\n', '56\n','1,U\n', '1,J\n', '14\n']
+    else:
+        log.info(f"{tas_filename} has no final time")
+        return
+
+    if 'CollabUtils2' in sync_context.mods_to_load:
+        tas_lines.insert(0, f'Set,CollabUtils2.DisplayEndScreenForAllMaps,{not has_filetime}\n')
+
+    tas_lines.insert(0, 'Set,Everest.ShowModOptionsInGame,False\n')
+    tas_lines.append('\n***')
+
+    with open(file_path, 'w', encoding='UTF8') as tas_file:
+        tas_file.truncate()
+        tas_file.write(''.join(tas_lines))
+
+    # now run it
+    time.sleep(0.5)
+    initial_mtime = os.path.getmtime(file_path)
+    file_sync_start_time = time.time()
+    log.info(f"Sync checking {tas_filename} ({tas_parsed.finaltime.trimmed if tas_parsed.finaltime else None}), predicted {frames.total}f ({frames.seconds() / 60:.1f} min of inputs)"
+             f"{f' in game instance {instance.number}' if instance.number else ''}")
+
+    if frames.unresolved_reads:
+        log.info(f"Couldn't resolve {len(frames.unresolved_reads)} read{plural(frames.unresolved_reads)}, using default freeze timeout")
+        freeze_timeout = freeze_timeout_max
+    else:
+        # frozen if it's taking far longer than its inputs should. lots of leeway, since the count misses loading, menuing, and commands that wait
+        freeze_timeout = min(freeze_timeout_max, max(freeze_timeout_min, frames.seconds() * 10))
+
+    tas_started = False
+    tas_finished = False
+    sid = None
+    game_crashed = False
+    game_froze = False
+    crash_logs = os.listdir(crash_logs_dir)
+
+    while not tas_started and not game_crashed:
+        try:
+            niquests.post(instance.url(f'tas/playtas?filePath={file_path}').replace('+', '%2B'), timeout=10)
+        except niquests.RequestException:
+            if not instance.process.is_running():
+                game_crashed = True
+        else:
+            crash_logs = os.listdir(crash_logs_dir)
+            tas_started = True
+
+    while not tas_finished and not game_crashed:
+        if time.time() - file_sync_start_time > freeze_timeout:
+            game_froze = True
+            break
+
+        try:
+            scaled_sleep(20 if has_filetime else 5)
+            session_data = niquests.get(instance.url('tas/info?forceAllowCodeExecution=true'), timeout=2).text
+        except niquests.RequestException:
+            if not instance.process.is_running():
+                game_crashed = True
+        else:
+            tas_running = 'Running: True' in session_data
+            session_current_frames = session_data.partition('CurrentFrame: ')[2].partition('<')[0]
+            session_total_frames = session_data.partition('TotalFrames: ')[2].partition('<')[0]
+            tas_finished = not tas_running or session_current_frames == session_total_frames
+
+            if tas_finished:
+                niquests.post(instance.url('tas/sendhotkey?id=Pause'), timeout=2)  # resume if paused tas
+
+            if not has_filetime:
+                sid = session_data.partition('SID: ')[2].partition(' (')[0]
+
+    # just this file fails, the rest of the project can still be checked
+    if game_froze:
+        log.warning(f"{tas_filename} has frozen after {freeze_timeout / 3600:.1f} hours, restarting and continuing")
+        sync_result.desync = (tas_filename, f"Froze after {freeze_timeout / 3600:.1f} hours")
+        close_game(instance)
+        scaled_sleep(5)
+        start_game(project['validate_room_labels'], instance)
+        instance.process = wait_for_game_load(sync_context.mods_to_load, project['name'], instance)
+        return sync_result
+
+    log.info(f"TAS has finished ({tas_filename})")
+    sync_result.timed = True
+    scaled_sleep(15 if has_filetime or 'SID:  ()' in session_data else 5)
+    extra_sleeps = 0
+
+    while not game_crashed and os.path.getmtime(file_path) == initial_mtime and extra_sleeps < 5:
+        time.sleep(3 + (extra_sleeps ** 2))
+        extra_sleeps += 1
+        log.info(f"Extra sleeps: {extra_sleeps}")
+
+    updated_crash_logs = os.listdir(crash_logs_dir)
+    new_crash_logs = [file for file in updated_crash_logs if file not in crash_logs]
+
+    if game_crashed or new_crash_logs:
+        log.warning(f"Game crashed ({new_crash_logs}), restarting and continuing")
+        scaled_sleep(10)
+        close_game(instance)
+        scaled_sleep(5)
+        start_game(project['validate_room_labels'], instance)
+
+        if new_crash_logs:
+            sync_result.desync = (tas_filename, "Crashed game")
+
+            for new_crash_log_name in new_crash_logs[:10]:
+                with open(crash_logs_dir / new_crash_log_name, 'rb') as new_crash_log:
+                    sync_result.crash_logs[f'{new_crash_log_name}.gz'] = b64encode(gzip.compress(new_crash_log.read()))
+
+        instance.process = wait_for_game_load(sync_context.mods_to_load, project['name'], instance)
+        return sync_result
+
+    # determine if it synced or not
+    with open(file_path, 'rb') as tas_file:
+        tas_parsed_new, tas_updated_tokens = validation.parse_tas_cached(tas_file.read(), False, False, tas_parsed.finaltime_type)
+        tas_updated = tas_updated_tokens.lines
+
+    # for silvers
+    if has_filetime:
+        clear_debug_save(instance)
+
+    if not tas_parsed_new.found_finaltime:
+        log.warning(f"Desynced (no {finaltime_line_blank.partition(':')[0]})")
+        log.info(session_data.partition('<pre>')[2].partition('</pre>')[0])
+        sync_result.desync = (tas_filename, None)
+        return sync_result
+
+    finaltime_new = tas_parsed_new.finaltime
+    frame_diff = finaltime_new - tas_parsed.finaltime
+    time_synced = frame_diff == 0
+    time_delta = f"{tas_parsed.finaltime.with_frames()} -> {finaltime_new.with_frames()} ({'+' if frame_diff > 0 else ''}{frame_diff}f)"
+
+    if has_filetime or project['commit_any_time_saved']:
+        log.info(f"Time: {finaltime_new.trimmed}")
+
+        if has_filetime:
+            sync_result.filetime = finaltime_new.trimmed
+
+        if not time_synced:
+            if project['commit_any_time_saved'] and frame_diff > 0:  # god this logic is a mess
+                log.warning(f"Desynced: {time_delta}")
+                sync_result.desync = (tas_filename, time_delta)
+            else:
+                new_time_line = tas_updated[tas_parsed_new.finaltime_line_num]
+                tas_lines_og = og_tas_lines[tas_filename]
+                tas_lines_og[validation.parse_tas_cached(''.join(tas_lines_og).encode('UTF8'), False, False)[0].finaltime_line_num] = f'{new_time_line}\n'
+                commit_message = f"{'+' if frame_diff > 0 else ''}{frame_diff}f {tas_filename} ({finaltime_new.trimmed})"
+                sync_result.update_commit = (file_path, tas_lines_og, tas_file_raw, commit_message)
+                # don't commit now, since there may be desyncs
+                log.info("Queued for update commit")
+    else:
+        if not finaltime_new.frames:
+            log_error(f"Couldn't parse FileTime frames for {file_path_repo}")
+            return sync_result
+
+        log_command = log.info if time_synced else log.warning
+        log_command(f"{'Synced' if time_synced else 'Desynced'}: {time_delta}")
+
+        if time_synced:
+            if file_path_repo not in sync_context.sid_cache and sid_is_valid(sid):
+                sync_result.sid = sid
+            elif not sid:
+                log.warning(f"Running {file_path_repo} yielded no SID")
+        else:
+            sync_result.desync = (tas_filename, time_delta)
+
+    return sync_result
+
+
+# if someone committed while syncing, put our commit on top of theirs and try again
+def push_with_rebase(max_attempts: int = 3) -> bool:
+    for attempt in range(max_attempts):
+        if subprocess.run(['git', 'push']).returncode == 0:
+            return True
+
+        log.warning(f"Push rejected (attempt {attempt + 1}/{max_attempts}), rebasing onto remote")
+
+        if subprocess.run(['git', 'pull', '--rebase']).returncode != 0:
+            subprocess.run(['git', 'rebase', '--abort'])
+            log.warning("Rebase failed")
+            return False
+
+    return False
+
+
+# only rerun files whose content, or any file they read from, changed since the commit they last synced at
+def select_changed_files(path_cache: dict, verified_shas: dict, head_sha: str, repo_path: Path, resolver: read_resolver.ReadResolver) -> dict:
+    affected_by_commit = {}
+    selected = {}
+
+    for tas_filename, file_path_repo in path_cache.items():
+        verified_sha = verified_shas.get(file_path_repo)
+
+        if verified_sha == head_sha:
+            continue
+        elif verified_sha and verified_sha not in affected_by_commit:
+            changed_files = git_changed_files(repo_path, verified_sha, head_sha)
+
+            if changed_files is None:
+                affected_by_commit[verified_sha] = None
+            else:
+                affected_by_commit[verified_sha] = changed_files.union(*[resolver.dependents(changed_file) for changed_file in changed_files])
+
+        affected_files = affected_by_commit.get(verified_sha)
+        unresolved_reads = file_path_repo in resolver.files and [read for read in resolver.reads(file_path_repo) if not read.path]
+
+        # rerun if never synced, can't diff, changed, reads a changed file, or has reads that may now resolve differently
+        if affected_files is None or file_path_repo in affected_files or unresolved_reads:
+            selected[tas_filename] = file_path_repo
+
+    log.info(f"Checking {len(selected)}/{len(path_cache)} files changed since last sync: {list(selected)}")
+    return selected
+
+
+def git_changed_files(repo_path: Path, old_sha: str, new_sha: str) -> Optional[set[str]]:
+    # the clone is shallow, so get the old commit too
+    fetch = subprocess.run(['git', 'fetch', '--depth=1', 'origin', old_sha], cwd=repo_path, capture_output=True)
+
+    if fetch.returncode != 0:
+        log.warning(f"Couldn't fetch commit {old_sha}, checking its files fully: {fetch.stderr.decode('UTF8', errors='replace').strip()}")
+        return None
+
+    diff = subprocess.run(['git', 'diff', '--name-only', '--no-renames', '-z', old_sha, new_sha], cwd=repo_path, capture_output=True)
+
+    if diff.returncode != 0:
+        log.warning(f"Couldn't diff {old_sha}..{new_sha}, checking its files fully")
+        return None
+
+    changed_files = {file for file in diff.stdout.decode('UTF8').split('\0') if file}
+    log.info(f"{len(changed_files)} file{plural(changed_files)} changed since {old_sha[:7]}")
+    return changed_files
+
+
 def clone_repo(repo: str, project_id: int, access_token: str | None = None):
     repo_cloned = repo.partition('/')[2]
     repo_cloned_rename = f'{repo_cloned} {project_id}'
@@ -521,11 +737,13 @@ def clone_repo(repo: str, project_id: int, access_token: str | None = None):
     return clone_time, repo_path
 
 
-def clear_debug_save():
+def clear_debug_save(instance: Optional['GameInstance'] = None):
+    instance = instance if instance else main_instance()
+
     try:
-        niquests.post('http://localhost:32270/console?command=overworld', timeout=10)
+        niquests.post(instance.url('console?command=overworld'), timeout=10)
         scaled_sleep(4)
-        niquests.post('http://localhost:32270/console?command=clrsav', timeout=10)
+        niquests.post(instance.url('console?command=clrsav'), timeout=10)
         scaled_sleep(4)
         log.info("Cleared debug save")
         scaled_sleep(4)
@@ -546,16 +764,18 @@ def format_desyncs(desyncs: list) -> str:
 
 
 def generate_blacklist(mods_to_load: set):
-    installed_mods = [item.name for item in (game_dir() / 'Mods').glob('*') if item.name.endswith('.zip')]
-    blacklist = []
+    # instances can share a mods folder, in which case this just writes the same blacklist again
+    for instance in game_instances():
+        installed_mods = [item.name for item in (instance.path / 'Mods').glob('*') if item.name.endswith('.zip')]
+        blacklist = []
 
-    for installed_mod in installed_mods:
-        if installed_mod.removesuffix('.zip') not in mods_to_load:
-            blacklist.append(installed_mod)
+        for installed_mod in installed_mods:
+            if installed_mod.removesuffix('.zip') not in mods_to_load:
+                blacklist.append(installed_mod)
 
-    with open(game_dir() / 'Mods/blacklist.txt', 'w') as blacklist_txt:
-        blacklist_txt.write("# This file has been created by the Improvements Tracker\n")
-        blacklist_txt.write('\n'.join(blacklist))
+        with open(instance.path / 'Mods/blacklist.txt', 'w') as blacklist_txt:
+            blacklist_txt.write("# This file has been created by the Improvements Tracker\n")
+            blacklist_txt.write('\n'.join(blacklist))
 
 
 # for when headless is enabled
@@ -584,12 +804,19 @@ def update_mods(mods: set):
 
 # remove all files related to any save
 def remove_save_files():
-    saves_dir = game_dir() / 'Saves'
-    save_files = [saves_dir / file for file in os.listdir(saves_dir) if file.startswith('debug') or (file[0].isdigit() and file[0] != '0')]
+    save_files = []
 
-    if platform.system() == 'Linux':
-        saves_dir = Path('~/.local/share/Celeste/Saves').expanduser()
-        save_files += [saves_dir / file for file in os.listdir(saves_dir) if re_save_file.match(file)]
+    for instance in game_instances():
+        saves_dir = instance.path / 'Saves'
+
+        if instance.number == 0 or saves_dir.is_dir():
+            save_files += [saves_dir / file for file in os.listdir(saves_dir) if file.startswith('debug') or (file[0].isdigit() and file[0] != '0')]
+
+        if platform.system() == 'Linux':
+            saves_dir = (instance.data_home() if instance.data_home() else Path('~/.local/share').expanduser()) / 'Celeste/Saves'
+
+            if saves_dir.is_dir():
+                save_files += [saves_dir / file for file in os.listdir(saves_dir) if re_save_file.match(file)]
 
     for save_file in save_files:
         os.remove(save_file)
@@ -610,18 +837,24 @@ def del_rw(function, path, excinfo):
     os.remove(path)
 
 
-def start_game(validate_room_labels: bool = False):
+def start_game(validate_room_labels: bool = False, instance: Optional['GameInstance'] = None):
+    instance = instance if instance else main_instance()
+
     if platform.system() == 'Linux':
-        subprocess.Popen(['gnome-terminal', '--', f'{game_dir()}/run_celeste.sh', '--validate-room-labels' if validate_room_labels else ''])
+        environment = os.environ | {'XDG_DATA_HOME': str(instance.data_home())} if instance.data_home() else None
+        subprocess.Popen(['gnome-terminal', '--', f'{instance.path}/run_celeste.sh', '--validate-room-labels' if validate_room_labels else ''], env=environment)
     else:
-        subprocess.Popen(f'{game_dir()}\\Celeste.exe{' --validate-room-labels' if validate_room_labels else ''}', creationflags=0x00000010)  # the creationflag is for not waiting until the process exits
+        subprocess.Popen(f'{instance.path}\\Celeste.exe{' --validate-room-labels' if validate_room_labels else ''}', creationflags=0x00000010)  # the creationflag is for not waiting until the process exits
+
+    if instance.number:
+        log.info(f"Started game instance {instance.number} (port {instance.port})")
 
     if validate_room_labels:
         log.info("Validating room labels enabled")
 
 
-def wait_for_game_load(mods: set, project_name: str):
-    import psutil
+def wait_for_game_load(mods: set, project_name: str, instance: Optional['GameInstance'] = None):
+    instance = instance if instance else main_instance()
     game_loaded = False
     last_game_loading_notify = time.perf_counter()
     wait_start_time = time.time()
@@ -629,7 +862,7 @@ def wait_for_game_load(mods: set, project_name: str):
     while not game_loaded:
         try:
             scaled_sleep(5)
-            niquests.get('http://localhost:32270/', timeout=2)
+            niquests.get(instance.url(''), timeout=2)
         except niquests.RequestException:
             current_time = time.perf_counter()
 
@@ -645,19 +878,54 @@ def wait_for_game_load(mods: set, project_name: str):
     scaled_sleep(5)
     log.info(f"Game loaded, mod versions: {mod_versions(mods)}")
     scaled_sleep(max(0, 10 - (time.perf_counter() - mod_versions_start_time)))
-    process_name = 'Celeste' if platform.system() == 'Linux' else 'Celeste.exe'
 
-    for process in psutil.process_iter(['name']):
-        if process.name() == process_name:
-            if platform.system() == 'Windows':
-                process.nice(psutil.BELOW_NORMAL_PRIORITY_CLASS)
-                log.info("Set game process to low priority")
+    # syncing needs the process to tell crashes from slow responses, so don't start without it
+    if not (process := game_process(instance)):
+        raise GameProcessError(f"Couldn't find the game process for instance {instance.number} (port {instance.port}, {instance.path}) in project {project_name}")
+
+    if platform.system() == 'Windows':
+        import psutil
+        process.nice(psutil.BELOW_NORMAL_PRIORITY_CLASS)
+        log.info("Set game process to low priority")
+
+    return process
+
+
+# an instance's process is the one running from its folder. if that can't be told, the only one running is good enough
+def game_process(instance: 'GameInstance'):
+    import psutil
+    process_name = 'Celeste' if platform.system() == 'Linux' else 'Celeste.exe'
+    processes = [process for process in psutil.process_iter(['name', 'exe']) if process.info['name'] == process_name]
 
+    for process in processes:
+        if process.info['exe'] and Path(process.info['exe']).parent == instance.path:
             return process
 
+    if len(processes) == 1:
+        return processes[0]
+    elif processes:
+        log.warning(f"Couldn't tell which of {len(processes)} game processes is instance {instance.number}")
 
-def close_game():
-    if platform.system() == 'Linux':
+
+class GameProcessError(Exception):
+    pass
+
+
+# close every game (and Studio), or just one instance's game
+def close_game(instance: Optional['GameInstance'] = None):
+    if instance and instance.process:
+        import psutil
+
+        try:
+            instance.process.kill()
+            log.info(f"Closed Celeste{f' (instance {instance.number})' if instance.number else ''}")
+        except psutil.NoSuchProcess:
+            log.info(f"Game instance {instance.number} already closed")
+
+        instance.process = None
+    elif instance and instance.number:
+        log.warning(f"Don't know game instance {instance.number}'s process, so can't close only it")
+    elif platform.system() == 'Linux':
         close_game_linux()
     else:
         close_game_windows()
@@ -777,9 +1045,9 @@ def generate_environment_state(project: dict, mods: set) -> dict:
         state[project_key] = project[project_key]
 
     try:
-        r_commits = niquests.get(f'https://api.github.com/repos/{project['repo']}/commits', headers=main.headers, params={'per_page': 1}, timeout=10)
+        r_commits = github.get(f'https://api.github.com/repos/{project['repo']}/commits', github.Priority.BACKGROUND, headers=main.headers, params={'per_page': 1}, timeout=10)
         utils.handle_potential_request_error(r_commits, 200)
-    except niquests.RequestException:
+    except (niquests.RequestException, github.RateLimitedError):
         log_error()
         return project['sync_environment_state']
 
@@ -865,6 +1133,33 @@ def get_gb_mods() -> Optional[dict]:
     return gb_mods
 
 
+# a copy of the game for playing files in. the main one is the "celeste" folder, on DebugRC's default port. hosts can add more in host.toml, as
+# [[game_sync.instances]] with a path and port each, to sync check multiple files at once. those each need their own install or overlay, set up to listen on their port
+@dataclasses.dataclass
+class GameInstance:
+    number: int
+    path: Path
+    port: int
+    process: Optional[Any] = None  # psutil.Process, once it's loaded
+
+    def url(self, endpoint: str) -> str:
+        return f'http://localhost:{self.port}/{endpoint}'
+
+    # on Linux, saves go in XDG_DATA_HOME instead of the game folder, so other instances need their own
+    def data_home(self) -> Optional[Path]:
+        if self.number and platform.system() == 'Linux':
+            return self.path / 'data'
+
+
+def game_instances() -> list[GameInstance]:
+    return [main_instance()] + [GameInstance(number, Path(instance['path']).resolve(), instance['port']) for number, instance in enumerate(utils.host().sync_instances, start=1)]
+
+
+@functools.cache
+def main_instance() -> GameInstance:
+    return GameInstance(0, game_dir(), 32270)
+
+
 @functools.cache
 def mods_dir() -> Path:
     mods_path = Path('Mods')  # expects a symlink
@@ -947,8 +1242,8 @@ def everest_installed_version() -> int:
 
 
 def everest_download_and_extract_stable():
-    r_everest_release = niquests.get('https://api.github.com/repos/EverestAPI/Everest/releases/latest',
-                                     headers={'Accept': 'application/vnd.github.v3+json', 'X-GitHub-Api-Version': '2022-11-28'})
+    r_everest_release = github.get('https://api.github.com/repos/EverestAPI/Everest/releases/latest', github.Priority.BACKGROUND,
+                                   headers={'Accept': 'application/vnd.github.v3+json', 'X-GitHub-Api-Version': '2022-11-28'})
     utils.handle_potential_request_error(r_everest_release, 200)
     everest_release = orjson.loads(r_everest_release.content)
 
@@ -990,6 +1285,8 @@ re_redact_token = re.compile(r"'token': '[^']*'")
 re_save_file = re.compile(r"([1-9]|\d{2,})(?:-modsavedata|-mod(?:save|session)-\w+)?\.celeste")
 game_sync_hash = None
 sleep_scale = 1.0
+freeze_timeout_min = 3600
+freeze_timeout_max = 3600 * 5
 gb_mods_cache: dict | None = None
 
 if __name__ == '__main__':
@@ -0,0 +1,337 @@
+import asyncio
+import base64
+import collections
+import enum
+import logging
+import threading
+import time
+from typing import Callable, Optional, Union
+
+import niquests
+import orjson
+
+import utils
+
+
+# builds a single commit out of any number of files via the git data API, instead of one contents API commit per file
+class CommitBuilder:
+    def __init__(self, repo: str, headers: dict):
+        self.repo = repo
+        self.headers = headers
+        self.files: dict[str, bytes] = {}
+        self.blob_shas: dict[str, str] = {}
+        self.deleted_files: set[str] = set()
+        # called with (builder, head sha, base tree sha) before every attempt, can stage files and return a line to add to the commit message
+        self.pre_commit_hooks: list[Callable[['CommitBuilder', str, str], Optional[str]]] = []
+        # called with (builder, new commit) after committing, while still holding the repo's commit lock
+        self.post_commit_hooks: list[Callable[['CommitBuilder', dict], None]] = []
+
+    def add_file(self, path: str, content: bytes):
+        self.deleted_files.discard(path)
+
+        if self.files.get(path) != content:
+            self.files[path] = content
+            self.blob_shas.pop(path, None)
+
+    def delete_file(self, path: str):
+        self.unstage(path)
+        self.deleted_files.add(path)
+
+    def unstage(self, path: str):
+        self.files.pop(path, None)
+        self.blob_shas.pop(path, None)
+
+    # commits to the same repo wait for each other, so that they don't keep conflicting
+    def commit(self, message: str, author: Optional[dict] = None, max_attempts: int = 3) -> dict:
+        queued_time = time.perf_counter()
+
+        with repo_commit_locks.setdefault(self.repo, threading.Lock()):
+            start_time = time.perf_counter()
+            new_commit = self.commit_unqueued(message, author, max_attempts)
+            queue_latency, commit_time = start_time - queued_time, time.perf_counter() - start_time
+
+            for post_commit_hook in self.post_commit_hooks:
+                post_commit_hook(self, new_commit)
+
+        commit_latencies.setdefault(self.repo, collections.deque(maxlen=100)).append((queue_latency, commit_time))
+        log.info(f"Commit to {self.repo} waited {queue_latency:.2f}s in queue and took {commit_time:.2f}s")
+        return new_commit
+
+    def commit_unqueued(self, message: str, author: Optional[dict], max_attempts: int) -> dict:
+        log.info(f"Building commit of {len(self.files)} file{utils.plural(self.files)} for {self.repo}: {list(self.files)}"
+                 f"{f', deleting {list(self.deleted_files)}' if self.deleted_files else ''}")
+        branch = default_branch(self.repo, self.headers)
+        head = self.get_head(branch)
+
+        if head is None:
+            # the git data API doesn't work on empty repos, so create the first commit the old way
+            self.commit_to_empty_repo(message, author)
+            head = self.get_head(branch)
+
+            if not self.files:
+                return head[2]
+
+        for attempt in range(max_attempts):
+            if attempt:
+                head = self.get_head(branch)
+
+            head_sha, base_tree_sha, _ = head
+            full_message = message
+
+            for pre_commit_hook in self.pre_commit_hooks:
+                if message_line := pre_commit_hook(self, head_sha, base_tree_sha):
+                    full_message += f'\n\n{message_line}'
+
+            self.create_blobs()
+            tree_sha = self.create_tree(base_tree_sha)
+            commit_data = {'message': full_message, 'tree': tree_sha, 'parents': [head_sha]}
+
+            if author:
+                commit_data['author'] = author
+
+            r = post(f'https://api.github.com/repos/{self.repo}/git/commits', headers=self.headers, data=orjson.dumps(commit_data))
+            utils.handle_potential_request_error(r, 201)
+
+            if r.status_code != 201:
+                raise CommitError(f"Couldn't create commit in {self.repo} (status code {r.status_code})")
+
+            new_commit = orjson.loads(r.content)
+            r = patch(f'https://api.github.com/repos/{self.repo}/git/refs/heads/{branch}', headers=self.headers,
+                      data=orjson.dumps({'sha': new_commit['sha'], 'force': False}))
+
+            if r.status_code == 200:
+                log.info(f"Updated {branch} from {head_sha} to {new_commit['sha']}")
+                return new_commit
+            elif r.status_code in (409, 422):
+                # someone else committed in between, so rebuild the tree on top of their commit
+                log.warning(f"{self.repo} {branch} moved while committing (attempt {attempt + 1}/{max_attempts}), retrying")
+            else:
+                utils.handle_potential_request_error(r, 200)
+                raise CommitError(f"Couldn't update {branch} in {self.repo} (status code {r.status_code})")
+
+        raise CommitError(f"Couldn't update {branch} in {self.repo} after {max_attempts} attempts")
+
+    # returns (commit sha, tree sha, commit json), or None if the repo is empty
+    def get_head(self, branch: str) -> Optional[tuple[str, str, dict]]:
+        r = get(f'https://api.github.com/repos/{self.repo}/git/ref/heads/{branch}', headers=self.headers)
+
+        if r.status_code == 409:
+            log.info(f"{self.repo} is empty")
+            return None
+
+        utils.handle_potential_request_error(r, 200)
+        head_sha = orjson.loads(r.content)['object']['sha']
+        r = get(f'https://api.github.com/repos/{self.repo}/git/commits/{head_sha}', headers=self.headers)
+        utils.handle_potential_request_error(r, 200)
+        head_commit = orjson.loads(r.content)
+        return head_sha, head_commit['tree']['sha'], head_commit
+
+    # blobs don't depend on the base tree, so they survive retries
+    def create_blobs(self):
+        for path, content in self.files.items():
+            if path in self.blob_shas:
+                continue
+
+            blob_data = {'content': base64.b64encode(content).decode('UTF8'), 'encoding': 'base64'}
+            r = post(f'https://api.github.com/repos/{self.repo}/git/blobs', headers=self.headers, data=orjson.dumps(blob_data))
+            utils.handle_potential_request_error(r, 201)
+
+            if r.status_code != 201:
+                raise CommitError(f"Couldn't create blob for {path} in {self.repo} (status code {r.status_code})")
+
+            self.blob_shas[path] = orjson.loads(r.content)['sha']
+
+    def create_tree(self, base_tree_sha: str) -> str:
+        tree = [{'path': path, 'mode': '100644', 'type': 'blob', 'sha': self.blob_shas[path]} for path in self.files]
+        tree.extend({'path': path, 'mode': '100644', 'type': 'blob', 'sha': None} for path in self.deleted_files)
+        r = post(f'https://api.github.com/repos/{self.repo}/git/trees', headers=self.headers, data=orjson.dumps({'base_tree': base_tree_sha, 'tree': tree}))
+        utils.handle_potential_request_error(r, 201)
+
+        if r.status_code != 201:
+            raise CommitError(f"Couldn't create tree in {self.repo} (status code {r.status_code})")
+
+        return orjson.loads(r.content)['sha']
+
+    def commit_to_empty_repo(self, message: str, author: Optional[dict]):
+        path, content = next(iter(self.files.items()))
+        data = {'content': base64.b64encode(content).decode('UTF8'), 'message': message}
+
+        if author:
+            data['author'] = author
+
+        r = put(f'https://api.github.com/repos/{self.repo}/contents/{path}', headers=self.headers, data=orjson.dumps(data))
+        utils.handle_potential_request_error(r, 201)
+
+        if r.status_code != 201:
+            raise CommitError(f"Couldn't create {path} in empty repo {self.repo} (status code {r.status_code})")
+
+        del self.files[path]
+
+
+# average (queue latency, commit time) of recent commits to a repo
+def commit_latency(repo: str) -> Optional[tuple[float, float]]:
+    if latencies := commit_latencies.get(repo):
+        return sum(latency[0] for latency in latencies) / len(latencies), sum(latency[1] for latency in latencies) / len(latencies)
+
+
+def default_branch(repo: str, headers: dict) -> str:
+    if repo not in default_branches:
+        r = get(f'https://api.github.com/repos/{repo}', headers=headers)
+        utils.handle_potential_request_error(r, 200)
+        default_branches[repo] = orjson.loads(r.content)['default_branch']
+
+    return default_branches[repo]
+
+
+class Priority(enum.IntEnum):
+    USER = 0  # improvement posts and commands
+    BACKGROUND = 1  # path cache rebuilds, sync checks, room suggestions
+
+
+# the rate limit state of one installation (or the app itself, or unauthenticated requests), from GitHub's response headers
+class RateLimitBucket:
+    def __init__(self, name: str):
+        self.name = name
+        self.remaining: Optional[int] = None
+        self.limit: Optional[int] = None
+        self.reset_time = 0.0
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    # take a request from the bucket and return 0, or return how long until a request of this priority can be sent
+    def acquire(self, priority: Priority) -> float:
+        with self.lock:
+            now = time.time()
+
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            elif self.remaining is None or now >= self.reset_time:
+                return 0
+
+            # background requests leave some of the limit for users
+            reserve = 0 if priority == Priority.USER else max(background_reserve_min, int(self.limit * background_reserve_fraction))
+
+            if self.remaining > reserve:
+                self.remaining -= 1
+                return 0
+            else:
+                return self.reset_time - now
+
+    def update(self, response: niquests.Response):
+        with self.lock:
+            now = time.time()
+
+            if 'X-RateLimit-Remaining' in response.headers:
+                self.remaining = int(response.headers['X-RateLimit-Remaining'])
+                self.limit = int(response.headers['X-RateLimit-Limit'])
+                self.reset_time = float(response.headers['X-RateLimit-Reset'])
+
+            if response.status_code not in (403, 429):
+                return
+
+            if 'Retry-After' in response.headers:
+                self.blocked_until = now + int(response.headers['Retry-After'])
+            elif self.remaining == 0:
+                self.blocked_until = self.reset_time
+            elif b'secondary rate limit' in response.content.lower():
+                # github says to wait at least a minute if there's no header
+                self.blocked_until = now + 60
+            else:
+                return  # just a normal 403
+
+            log.warning(f"Rate limited on {self.name} for {self.blocked_until - now:.0f} seconds")
+
+    def is_blocked(self) -> bool:
+        return time.time() < self.blocked_until
+
+
+def request(method: str, url: str, priority: Priority = Priority.USER, max_attempts: int = 3, **kwargs) -> niquests.Response:
+    bucket = get_bucket(kwargs.get('headers'))
+
+    if on_event_loop():
+        log.warning(f"Sending {method} {url} from the event loop, which blocks it. Use asyncio.to_thread")
+
+    for attempt in range(max_attempts):
+        while wait := bucket.acquire(priority):
+            if priority == Priority.BACKGROUND or wait > user_max_wait:
+                raise RateLimitedError(f"{bucket.name} is rate limited for {wait:.0f} seconds, not sending {method} {url} ({priority.name})")
+
+            log.warning(f"Waiting {wait:.1f} seconds for {bucket.name} rate limit")
+            time.sleep(wait)
+
+        r = niquests.request(method, url, **kwargs)
+        bucket.update(r)
+
+        if not bucket.is_blocked():
+            break
+
+    return r
+
+
+# blocking the event loop's thread stops discord's heartbeats, so requests should always be sent from other threads
+def on_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
+def get(url: str, priority: Priority = Priority.USER, **kwargs) -> niquests.Response:
+    return request('GET', url, priority, **kwargs)
+
+
+def post(url: str, priority: Priority = Priority.USER, **kwargs) -> niquests.Response:
+    return request('POST', url, priority, **kwargs)
+
+
+def put(url: str, priority: Priority = Priority.USER, **kwargs) -> niquests.Response:
+    return request('PUT', url, priority, **kwargs)
+
+
+def patch(url: str, priority: Priority = Priority.USER, **kwargs) -> niquests.Response:
+    return request('PATCH', url, priority, **kwargs)
+
+
+def delete(url: str, priority: Priority = Priority.USER, **kwargs) -> niquests.Response:
+    return request('DELETE', url, priority, **kwargs)
+
+
+# installation tokens change every hour, but the limit is per installation
+def get_bucket(headers: Optional[dict]) -> RateLimitBucket:
+    authorization = headers.get('Authorization') if headers else None
+
+    if not authorization:
+        name = 'unauthenticated'
+    elif authorization in installation_names:
+        name = installation_names[authorization]
+    else:
+        name = 'app'
+
+    if name not in rate_limit_buckets:
+        rate_limit_buckets[name] = RateLimitBucket(name)
+
+    return rate_limit_buckets[name]
+
+
+def name_installation(headers: dict, installation_owner: str):
+    installation_names[headers['Authorization']] = installation_owner
+
+
+class CommitError(Exception):
+    pass
+
+
+class RateLimitedError(Exception):
+    pass
+
+
+log: Union[logging.Logger, utils.LogPlaceholder] = utils.LogPlaceholder()
+default_branches = {}
+rate_limit_buckets: dict[str, RateLimitBucket] = {}
+repo_commit_locks: dict[str, threading.Lock] = {}
+commit_latencies: dict[str, collections.deque] = {}
+installation_names: dict[str, str] = {}
+background_reserve_min = 100
+background_reserve_fraction = 0.1
+user_max_wait = 10
@@ -1,16 +1,22 @@
+import asyncio
 import base64
+import collections
+import collections.abc
+import concurrent.futures
 import dataclasses
 import datetime
-import io
+import functools
 import logging
 import os
 import random
 import re
 import sys
+import tempfile
 import time
 import tomllib
 import urllib.parse
 import zipfile
+import zlib
 from pathlib import Path
 from typing import Optional, Union
 
@@ -18,10 +24,14 @@ import discord
 import niquests
 import orjson
 
+import blob_cache
 import commands
 import db
+import fuzzy_index
 import gen_token
+import github
 import project_editor
+import read_resolver
 import spreadsheet
 import tasks
 import utils
@@ -54,16 +64,12 @@ async def process_improvement_message(message: discord.Message, project: Optiona
         await message.add_reaction('🍿')
 
     for zip_attachment in zip_attachments:
-        log.info(f"Downloading and parsing {zip_attachment.filename} from {zip_attachment.url}")
-        r = niquests.get(zip_attachment.url)
-        utils.handle_potential_request_error(r, 200)
-
-        with zipfile.ZipFile(io.BytesIO(r.content), 'r') as zip_file:
-            for file in zip_file.filelist:
-                if file.filename.endswith('.tas'):
-                    with zip_file.open(file) as file_opened:
-                        basename = os.path.basename(file.filename)
-                        tas_attachments.append(AttachmentFromZip(basename, f'{zip_attachment.filename}/{file.filename}', file_opened.read()))
+        try:
+            tas_attachments.extend(await asyncio.to_thread(extract_zip_tases, zip_attachment))
+        except ZipAttachmentError as error:
+            log.warning(f"Couldn't process {zip_attachment.filename}: {error}")
+            await message.add_reaction('❌')
+            await message.reply(f"`{zip_attachment.filename}` {error}, so it won't be processed.")
 
     if len(tas_attachments) == 0:
         log.info("No TAS file found 👍")
@@ -92,47 +98,66 @@ async def process_improvement_message(message: discord.Message, project: Optiona
         await message.clear_reaction('⏭')
     await message.add_reaction('👀')
     generate_request_headers(project['installation_owner'])
+    commit_builder = github.CommitBuilder(project['repo'], headers)
+    staged_files = []
+
+    if project['use_contributors_file']:
+        commit_builder.pre_commit_hooks.append(functools.partial(stage_contributors, message.channel.id, project))
+        commit_builder.post_commit_hooks.append(functools.partial(contributors_committed, message.channel.id))
+
+    pending_files = []
+    db.path_caches.enable_cache()
 
     for attachment in tas_attachments:
-        log.info(f"Processing file {attachment.filename} at {attachment.url}")
-        repo = project['repo']
+        log.info(f"Downloading file {attachment.filename} from {attachment.url}")
 
         if isinstance(attachment, AttachmentFromZip):
             file_content = attachment.content
-        else:
+        elif not (file_content := blob_cache.get_attachment(attachment.url)):
             r = niquests.get(attachment.url)
             utils.handle_potential_request_error(r, 200)
             file_content = r.content
 
+            if r.status_code == 200:
+                blob_cache.put_attachment(attachment.url, file_content)
+
         filename, filename_no_underscores = attachment.filename, attachment.filename.replace('_', ' ')
-        db.path_caches.enable_cache()
+        path_cache = db.path_caches.get(message.channel.id)
 
-        if filename not in db.path_caches.get(message.channel.id) and filename_no_underscores in db.path_caches.get(message.channel.id):
+        if filename not in path_cache and filename_no_underscores in path_cache:
             log.info(f"Considering {filename} as {filename_no_underscores}")
             filename = filename_no_underscores
 
-        old_file_content = download_old_file(message.channel.id, repo, filename)
-        validation_result = validation.validate(file_content, filename, message, old_file_content, project, skip_validation)
-        db.path_caches.disable_cache()
+        old_file_content = await asyncio.to_thread(download_old_file, message.channel.id, project['repo'], filename)
+        pending_files.append(PendingFile(attachment, filename, file_content, old_file_content, path_cache))
+
+        if project['room_indexing_includes_reads'] and not skip_validation:
+            try:
+                pending_files[-1].read_files = await asyncio.to_thread(get_read_files, project, pending_files[-1])
+            except Exception:
+                # room labels just won't be checked
+                await utils.report_error(client)
+
+    db.path_caches.disable_cache()
+    validation_results = await validate_files(pending_files, message, project, skip_validation)
+
+    for pending_file, (validation_result, file_content) in zip(pending_files, validation_results):
+        attachment, filename = pending_file.attachment, pending_file.filename
+        log.info(f"Processing file {filename}")
 
         if validation_result.valid_tas:
             # I love it when
             # when timesave :)
             # (or drafts)
-            file_content = convert_line_endings(file_content, old_file_content)
-            commit_status = commit(project, message, filename, file_content, validation_result)
+            staged_file = await asyncio.to_thread(stage_file, project, message, filename, file_content, validation_result, commit_builder)
             project['last_commit_time'] = int(time.time())
 
             # try to only add to project log if not already added
             if not skip_validation or message.id not in db.project_logs.get(message.channel.id):
                 add_project_log(message)
 
-            if commit_status:
-                await message.add_reaction('🚧' if validation_result.wip else '📝')
-                history_data = (utils.detailed_user(message), message.channel.id, project['name'], *commit_status, attachment.url)
-                db.history_log.set(utils.log_timestamp(), str(history_data))
-                log.info("Added to history log")
-                await edit_pin(message.channel)
+            if staged_file:
+                staged_files.append((staged_file, validation_result, attachment))
             else:
                 log.info("File is a draft, and committing drafts is disabled for this project 🤘")
                 await message.add_reaction('🤘')
@@ -156,7 +181,7 @@ async def process_improvement_message(message: discord.Message, project: Optiona
                 await edit_pin(message.channel)
 
             db.projects.set(message.channel.id, project)
-            update_contributors(message.author, message.channel.id, project)
+            update_contributors(message.author, message.channel.id)
         else:
             db.misc.set('last_failed_message', f'{message.channel.id}-{message.id}')
             log_messages = ", ".join(validation_result.log_text)
@@ -178,6 +203,27 @@ async def process_improvement_message(message: discord.Message, project: Optiona
         if len(tas_attachments) > 1:
             log.info(f"Done processing {filename}")
 
+    # everything from this message (and any new contributors) lands in one commit
+    if commit_builder.files:
+        try:
+            commit_message, commit_url = await commit(message, staged_files, commit_builder)
+        except (github.CommitError, github.RateLimitedError) as error:
+            await utils.report_error(client, f"Couldn't commit from {message.jump_url}: {error!r}")
+            await message.clear_reaction('👀')
+            await message.add_reaction('❌')
+            await message.reply(f"Couldn't commit {'this file' if len(staged_files) == 1 else 'these files'} to the repo ({error}), please try posting again in a bit.")
+            await set_status(message, project['name'])
+            return True
+
+        for staged_file, validation_result, attachment in staged_files:
+            await message.add_reaction('🚧' if validation_result.wip else '📝')
+            history_data = (utils.detailed_user(message), message.channel.id, project['name'], commit_message, commit_url, attachment.url)
+            db.history_log.set(utils.log_timestamp(), str(history_data))
+
+        if staged_files:
+            log.info(f"Added {len(staged_files)} file{plural(staged_files)} to history log")
+            await edit_pin(message.channel)
+
     await message.clear_reaction('👀')
     log.info("Done processing message")
     await set_status(message, project['name'])
@@ -201,41 +247,70 @@ def format_markdown_list(elements: list[str]) -> str:
     return "- " + "\n- ".join(elements)
 
 
-# assumes already verified TAS
-def commit(project: dict, message: discord.Message, filename: str, content: bytes, validation_result: validation.ValidationResult) -> Optional[tuple]:
-    log.info("Potentially committing file")
-    repo = project['repo']
-    data = {'content': base64.b64encode(content).decode('UTF8')}
+# assumes already verified TAS, returns the file's commit message line, whether it's a draft, and its path in the repo (or None if not committing)
+def stage_file(project: dict, message: discord.Message, filename: str, content: bytes, validation_result: validation.ValidationResult,
+               commit_builder: github.CommitBuilder) -> Optional[tuple[str, bool, str]]:
+    log.info("Potentially staging file for commit")
     author = utils.nickname(message.author)
     file_path = get_file_repo_path(message.channel.id, filename)
     chapter_time = f" ({validation_result.finaltime})" if validation_result.finaltime else ""
-    user_github_account = utils.get_user_github_account(message.author.id)
 
     if file_path:
         draft = False
         timesave = f"{validation_result.timesave} " if validation_result.timesave else "Updated: "
-        data['sha'] = get_sha(repo, file_path)
-        data['message'] = f"{timesave}{filename}{chapter_time} from {author}\n\n{message.jump_url}\n{message.content}"
+        commit_line = f"{timesave}{filename}{chapter_time} from {author}"
     elif not project['commit_drafts']:
         return
     else:
         draft = True
-        data['message'] = f"{filename} {'WIP' if validation_result.wip else 'draft'} by {author}{chapter_time}"
+        commit_line = f"{filename} {'WIP' if validation_result.wip else 'draft'} by {author}{chapter_time}"
         subdir = project['subdir']
         file_path = f'{subdir}/{filename}' if subdir else filename
-        db.path_caches.add_file(message.channel.id, filename, file_path)
 
-    if user_github_account:
-        data['author'] = {'name': user_github_account[0], 'email': user_github_account[1]}
-        log.info(f"Set commit author to {data['author']}")
+    commit_builder.add_file(file_path, content)
+    log.info(f"Staged {file_path}: \"{commit_line}\"")
+    return commit_line, draft, file_path
 
-    log.info(f"Set commit message to \"{data['message'].partition('\n')[0]}\" (truncated)")
-    session = niquests.Session(disable_http2=True)
-    r = session.put(f'https://api.github.com/repos/{repo}/contents/{file_path}', headers=headers, data=orjson.dumps(data))
-    utils.handle_potential_request_error(r, 201 if draft else 200)
-    commit_url = orjson.loads(r.content)['commit']['html_url']
-    log.info(f"Successfully committed: {commit_url}")
-    return data['message'], commit_url
+
+# commit all staged files at once, off the event loop since it can wait on other commits to the repo
+async def commit(message: discord.Message, staged_files: list, commit_builder: github.CommitBuilder) -> tuple[str, str]:
+    commit_lines = [staged_file[0][0] for staged_file in staged_files]
+    has_improvement = any(not staged_file[0][1] for staged_file in staged_files)
+    author = None
+
+    if len(commit_lines) == 1:
+        commit_message = commit_lines[0]
+    else:
+        commit_message = f"Updated {len(commit_lines)} files from {utils.nickname(message.author)}\n\n" + '\n'.join(commit_lines)
+
+    if rooms_changed_lines := [validation.format_rooms_changed(staged_file[1].rooms_changed, staged_file[2].filename if len(staged_files) > 1 else None)
+                               for staged_file in staged_files if staged_file[1].rooms_changed]:
+        commit_message += '\n\n' + '\n'.join(rooms_changed_lines)
+
+    if has_improvement:
+        commit_message += f"\n\n{message.jump_url}\n{message.content}"
+
+    if user_github_account := utils.get_user_github_account(message.author.id):
+        author = {'name': user_github_account[0], 'email': user_github_account[1]}
+        log.info(f"Set commit author to {author}")
+
+    log.info(f"Set commit message to \"{commit_message.partition('\n')[0]}\" (truncated)")
+    new_commit = await asyncio.to_thread(commit_builder.commit, commit_message, author)
+
+    for content in commit_builder.files.values():
+        blob_cache.put_blob(content)
+
+    blob_cache.save_index()
+
+    update_repo_snapshot(message.channel.id, commit_builder.files)
+
+    # drafts only go in the path cache once they're actually in the repo
+    for staged_file in staged_files:
+        if staged_file[0][1]:
+            db.path_caches.add_file(message.channel.id, staged_file[0][2].rpartition('/')[2], staged_file[0][2])
+
+    log.info(f"Successfully committed: {new_commit['html_url']}")
+    return new_commit['message'], new_commit['html_url']
 
 
 # if a file exists in the repo, get its path
@@ -250,7 +325,7 @@ def get_file_repo_path(project_id: int, filename: str) -> Optional[str]:
 
 
 # walk the project's repo and cache the path of all TAS files found
-def generate_path_cache(project_id: int, project: Optional[dict] = None) -> dict:
+def generate_path_cache(project_id: int, project: Optional[dict] = None, priority: github.Priority = github.Priority.USER) -> dict:
     if not project:
         project = db.projects.get(project_id)
 
@@ -259,11 +334,12 @@ def generate_path_cache(project_id: int, project: Optional[dict] = None) -> dict
     excluded_items = project['excluded_items']
     project_subdir_base = project_subdir.partition('/')[0]
     log.info(f"Caching {repo} structure ({project_subdir=})")
-    r = niquests.get(f'https://api.github.com/repos/{repo}/contents', headers=headers)
+    r = github.get(f'https://api.github.com/repos/{repo}/contents', priority, headers=headers)
     utils.handle_potential_request_error(r, 200)
     contents_json = orjson.loads(r.content)
     studioconfig_path = None
     path_cache = {}  # always start from scratch
+    blob_shas = {}  # repo path -> blob SHA, for the repo snapshot
 
     if excluded_items:
         log.info(f"Excluded items: {excluded_items}")
@@ -281,7 +357,7 @@ def generate_path_cache(project_id: int, project: Optional[dict] = None) -> dict
             if item['type'] == 'dir' and (item['name'].startswith(project_subdir_base) if project_subdir else True):
                 # recursively get files in dirs (fyi {'recursive': 1} means true, not a depth of 1)
                 dir_sha = item['sha']
-                r = niquests.get(f'https://api.github.com/repos/{repo}/git/trees/{dir_sha}', headers=headers, params={'recursive': 1})
+                r = github.get(f'https://api.github.com/repos/{repo}/git/trees/{dir_sha}', priority, headers=headers, params={'recursive': 1})
                 utils.handle_potential_request_error(r, 200)
 
                 for subitem in orjson.loads(r.content)['tree']:
@@ -292,20 +368,23 @@ def generate_path_cache(project_id: int, project: Optional[dict] = None) -> dict
 
                         if subitem_name.endswith('.tas') and in_subdir and subitem_name not in excluded_items:
                             path_cache[subitem_name] = subitem_full_path
+                            blob_shas[subitem_full_path] = subitem['sha']
 
                         if subitem_name == '.studioconfig.toml' and in_subdir:
                             studioconfig_path = subitem_full_path
             elif not project_subdir and item['name'].endswith('.tas'):
                 path_cache[item['name']] = item['path']
+                blob_shas[item['path']] = item['sha']
 
     db.path_caches.set(project_id, path_cache)
+    fuzzy_index.project_index(project_id, path_cache)
     log.info(f"Cached: {path_cache}")
     previous_room_indexing_includes_reads = project['room_indexing_includes_reads']
     room_indexing_includes_reads = False
 
     if studioconfig_path:
         try:
-            r = niquests.get(f'https://api.github.com/repos/{repo}/contents/{studioconfig_path}', headers=headers)
+            r = github.get(f'https://api.github.com/repos/{repo}/contents/{studioconfig_path}', priority, headers=headers)
             r_json = orjson.loads(r.content)
             utils.handle_potential_request_error(r, 200)
             studioconfig_data = base64.b64decode(r_json['content']).decode('UTF8')
@@ -322,12 +401,42 @@ def generate_path_cache(project_id: int, project: Optional[dict] = None) -> dict
         project['room_indexing_includes_reads'] = room_indexing_includes_reads
         db.projects.set(project['project_id'], project)
 
+    if room_indexing_includes_reads:
+        repo_snapshots[project_id] = read_resolver.ReadResolver(RepoSnapshot(repo, blob_shas), path_cache)
+    else:
+        repo_snapshots.pop(project_id, None)
+
     return path_cache
 
 
+# for projects with IncludeReads room label indexing, the repo files that a posted file reads from (directly or not), which validation needs to index its labels
+def get_read_files(project: dict, pending_file: 'PendingFile') -> dict[str, bytes]:
+    project_id = project['project_id']
+
+    if project_id not in repo_snapshots:
+        generate_path_cache(project_id, project)
+
+    resolver = repo_snapshots[project_id]
+    file_path = validation.file_repo_path(pending_file.filename, project, pending_file.path_cache)
+    tas_tokens = validation.parse_tas_cached(pending_file.content, False, False)[1]
+    read_files = {read_path: resolver.files[read_path] for read_path in sorted(resolver.read_closure(file_path, tas_tokens))}
+    log.info(f"{pending_file.filename} reads from {len(read_files)} file{plural(read_files)}")
+    return read_files
+
+
+# keep snapshots up to date with what was just committed, so the next posts don't index against old versions
+def update_repo_snapshot(project_id: int, files: dict[str, bytes]):
+    tas_files = {path: content for path, content in files.items() if path.endswith('.tas')}
+
+    if tas_files and (resolver := repo_snapshots.get(project_id)):
+        snapshot = resolver.files
+        blob_shas = snapshot.blob_shas | {path: blob_cache.blob_sha(content) for path, content in tas_files.items()}
+        repo_snapshots[project_id] = read_resolver.ReadResolver(RepoSnapshot(snapshot.repo, blob_shas, snapshot.contents | tas_files), resolver.path_cache)
+
+
 # we know the file exists, so get its SHA for updating
 def get_sha(repo: str, file_path: str) -> str:
-    r = niquests.get(f'https://api.github.com/repos/{repo}/contents/{file_path}', headers=headers)
+    r = github.get(f'https://api.github.com/repos/{repo}/contents/{file_path}', headers=headers)
     utils.handle_potential_request_error(r, 200)
     repo_contents = orjson.loads(r.content)
     log.info(f"Found SHA of {file_path}: {repo_contents['sha']}")
@@ -344,12 +453,42 @@ def is_processable_message(message: discord.Message, project: dict) -> bool:
         return post_time > project['install_time']
 
 
+# edits are delayed and coalesced per channel, and only sent if the text actually changed
 async def edit_pin(channel: discord.TextChannel, create_from_project: Optional[dict] = None):
     if create_from_project:
-        project = create_from_project
+        text_out = render_pin(create_from_project)
+        pin_hashes[channel.id] = zlib.adler32(text_out.encode('UTF8'))
+        log.info("Creating pin")
+        return await channel.send(text_out)
+
+    if channel.id in pending_pin_edits:
+        log.info("Pin edit already pending")
     else:
+        pending_pin_edits[channel.id] = asyncio.create_task(edit_pin_after_delay(channel))
+
+
+async def edit_pin_after_delay(channel: discord.TextChannel):
+    await asyncio.sleep(pin_edit_delay)
+    # anything that changes after this point gets its own edit
+    del pending_pin_edits[channel.id]
+
+    try:
         project = db.projects.get(channel.id)
+        text_out = render_pin(project)
+        text_hash = zlib.adler32(text_out.encode('UTF8'))
+
+        if pin_hashes.get(channel.id) == text_hash:
+            log.info("Pin is unchanged, not editing")
+            return
 
+        await channel.get_partial_message(project['pin']).edit(content=text_out)
+        pin_hashes[channel.id] = text_hash
+        log.info("Edited pin")
+    except Exception:
+        await utils.report_error(client)
+
+
+def render_pin(project: dict) -> str:
     ensure_level = project['ensure_level']
     desyncs = project['desyncs']
     desyncs_text = "\n"
@@ -360,7 +499,9 @@ async def edit_pin(channel: discord.TextChannel, create_from_project: Optional[d
     maingame_times = ("1A (49.130)", "1B (1:04.838)", "1C (15.147)", "2A (1:25.034)", "2B (1:15.667)", "2C (19.414)", "3A (3:14.310)", "3B (1:28.349)", "3C (15.878)", "4A (1:46.794)",
                       "4B (2:00.819)", "4C (24.905)", "5A (3:10.077)", "5B (1:41.660)", "5C (16.337)", "6A (4:35.621)", "6B (3:15.296)", "6C (21.607)", "7A (6:39.636)", "7B (4:41.588)",
                       "7C (34.153)", "8A (2:24.364)", "8B (2:04.406)", "8C (22.270)")
-    example_timesave = f"-{round(random.triangular(1, 50, 0))}f {random.choice(maingame_times)}"
+    # seeded so that the pin doesn't change every time it's rendered
+    rng = random.Random(project['project_id'])
+    example_timesave = f"-{round(rng.triangular(1, 50, 0))}f {rng.choice(maingame_times)}"
 
     text = "Welcome to the **{0} TAS project!** This improvements channel is in part managed by this bot, which automatically verifies and commits files. When posting " \
            f"a file, please include the amount of frames saved{level_text_ensure} and the ChapterTime of the file, (ex: `{example_timesave}`). {lobby_text}" \
@@ -408,7 +549,6 @@ async def edit_pin(channel: discord.TextChannel, create_from_project: Optional[d
 
     name = project['name']
     repo = project['repo']
-    pin = project['pin']
     subdir = project['subdir']
     admins = ', '.join([f'<@{admin}>' for admin in project['admins']])
     repo_url = f'https://github.com/{repo}/tree/HEAD/{urllib.parse.quote(subdir)}' if subdir else f'https://github.com/{repo}'
@@ -421,14 +561,7 @@ async def edit_pin(channel: discord.TextChannel, create_from_project: Optional[d
         log.warning(f"Pin text is too long ({len(text_out)} chars), trimming")
         text_out = text_out[:1900]
 
-    if create_from_project:
-        log.info("Creating pin")
-        return await channel.send(text_out)
-    else:
-        pin_message = channel.get_partial_message(pin)
-        await pin_message.edit(content=text_out)
-        log.info("Edited pin")
-        return pin_message
+    return text_out
 
 
 def download_old_file(project_id: int, repo: str, filename: str, path_cache: Optional[dict] = None) -> Optional[bytes]:
@@ -441,10 +574,15 @@ def download_old_file(project_id: int, repo: str, filename: str, path_cache: Opt
         if path_cache is None:
             log.info("Downloading old version of file, for time reference")
 
-        r = niquests.get(f'https://api.github.com/repos/{repo}/contents/{old_file_path}', headers=headers)
+        # the file can be changed outside the bot at any time, so find its current blob SHA from the folder listing (which doesn't include contents)
+        old_file_folder, _, old_file_name = old_file_path.rpartition('/')
+        r = github.get(f'https://api.github.com/repos/{repo}/contents/{old_file_folder}', headers=headers)
         r_json = orjson.loads(r.content)
+        old_file_shas = {item['name']: item['sha'] for item in r_json if item['type'] == 'file'} if r.status_code == 200 and isinstance(r_json, list) else {}
 
-        if r.status_code == 404 and 'message' in r_json:
+        if old_file_name in old_file_shas:
+            return download_blob(repo, old_file_shas[old_file_name], old_file_path)
+        elif r.status_code in (200, 404):
             if path_cache is None:
                 log.warning("File existed in path cache but doesn't seem to exist in repo. Retrying download with updated path cache")
                 new_path_cache = generate_path_cache(project_id)
@@ -453,11 +591,24 @@ def download_old_file(project_id: int, repo: str, filename: str, path_cache: Opt
                 log.warning("File not available")
         else:
             utils.handle_potential_request_error(r, 200)
-            return base64.b64decode(r_json['content'])
     else:
         log.info("No old version of file exists")
 
 
+# blobs never change, so they're cached by SHA forever (or until evicted)
+def download_blob(repo: str, sha: str, path: str) -> bytes:
+    if content := blob_cache.get_blob(sha):
+        return content
+
+    log.info(f"Downloading {path} ({sha[:7]})")
+    r = github.get(f'https://api.github.com/repos/{repo}/git/blobs/{sha}', headers=headers)
+    utils.handle_potential_request_error(r, 200)
+    content = base64.b64decode(orjson.loads(r.content)['content'])
+    blob_cache.put_blob(content)
+    blob_cache.save_index()
+    return content
+
+
 @dataclasses.dataclass
 class AttachmentFromZip:
     filename: str
@@ -465,6 +616,207 @@ class AttachmentFromZip:
     content: bytes
 
 
+@dataclasses.dataclass
+class PendingFile:
+    attachment: Union[discord.Attachment, AttachmentFromZip]
+    filename: str
+    content: bytes
+    old_content: Optional[bytes]
+    path_cache: dict
+    read_files: Optional[dict[str, bytes]] = None
+
+
+# a repo's TAS files as of the last path cache, which are only downloaded once something reads them. they're looked up by blob SHA, so the cache never goes stale
+class RepoSnapshot(collections.abc.Mapping):
+    def __init__(self, repo: str, blob_shas: dict[str, str], contents: Optional[dict[str, bytes]] = None):
+        self.repo = repo
+        self.blob_shas = blob_shas
+        self.contents = contents if contents else {}
+
+    def __getitem__(self, path: str) -> bytes:
+        if path in self.contents:
+            return self.contents[path]
+
+        content = download_blob(self.repo, self.blob_shas[path], path)
+        self.contents[path] = content
+        return content
+
+    # without downloading anything
+    def __contains__(self, path: object) -> bool:
+        return path in self.blob_shas
+
+    def __iter__(self):
+        return iter(self.blob_shas)
+
+    def __len__(self) -> int:
+        return len(self.blob_shas)
+
+
+@dataclasses.dataclass
+class ContributorsFile:
+    path: str
+    tree_sha: str
+    blob_sha: Optional[str]
+    names: set[str]
+
+
+class ZipAttachmentError(Exception):
+    pass
+
+
+# stream a zip to a temp file and get its TAS files, checking the sizes in the zip's headers before decompressing anything
+def extract_zip_tases(zip_attachment: discord.Attachment) -> list[AttachmentFromZip]:
+    log.info(f"Downloading and parsing {zip_attachment.filename} from {zip_attachment.url}")
+
+    if zip_attachment.size > zip_max_download:
+        raise ZipAttachmentError(f"is too large ({zip_attachment.size / 1048576:.1f} MB)")
+
+    # the zip itself isn't cached, just what's extracted from it
+    if cached_tases := blob_cache.get_zip_tases(zip_attachment.url):
+        return [AttachmentFromZip(filename, f'{zip_attachment.filename}/{zip_path}', content) for filename, zip_path, content in cached_tases]
+
+    tases = []
+
+    with tempfile.SpooledTemporaryFile(max_size=zip_max_in_memory) as zip_spooled:
+        r = niquests.get(zip_attachment.url, stream=True)
+        utils.handle_potential_request_error(r, 200)
+        downloaded = 0
+
+        for chunk in r.iter_content(65536):
+            downloaded += len(chunk)
+
+            if downloaded > zip_max_download:
+                raise ZipAttachmentError(f"is too large (over {zip_max_download / 1048576:.0f} MB)")
+
+            zip_spooled.write(chunk)
+
+        zip_spooled.seek(0)
+
+        try:
+            with zipfile.ZipFile(zip_spooled, 'r') as zip_file:
+                tas_infos = [file for file in zip_file.infolist() if file.filename.endswith('.tas') and not file.is_dir()]
+                total_size = sum(file.file_size for file in tas_infos)
+                log.info(f"{zip_attachment.filename} has {len(tas_infos)} TAS file{plural(tas_infos)}, {total_size} bytes uncompressed")
+
+                if len(tas_infos) > zip_max_tases:
+                    raise ZipAttachmentError(f"has too many TAS files ({len(tas_infos)}, max is {zip_max_tases})")
+                elif total_size > zip_max_total_size:
+                    raise ZipAttachmentError(f"has too much data ({total_size / 1048576:.1f} MB uncompressed)")
+
+                for file in tas_infos:
+                    if file.file_size > zip_max_tas_size:
+                        raise ZipAttachmentError(f"has a TAS file that's too large (`{file.filename}`, {file.file_size / 1024:.1f} KB)")
+
+                    with zip_file.open(file) as file_opened:
+                        # don't trust the header's size
+                        content = file_opened.read(file.file_size + 1)
+
+                    if len(content) > file.file_size:
+                        raise ZipAttachmentError(f"has an incorrect size for `{file.filename}`")
+
+                    tases.append(AttachmentFromZip(os.path.basename(file.filename), f'{zip_attachment.filename}/{file.filename}', content))
+        except zipfile.BadZipFile as error:
+            raise ZipAttachmentError(f"couldn't be opened ({error})")
+
+    blob_cache.put_zip_tases(zip_attachment.url, [(tas.filename, tas.url.partition('/')[2], tas.content) for tas in tases])
+    return tases
+
+
+# validate files in worker processes so that big files and packs don't block the event loop. returns each file's result and its content with line endings converted
+# files that were already checked for this message (so it's been edited) only get their message checks redone
+async def validate_files(pending_files: list, message: discord.Message, project: dict, skip_validation: bool) -> list[tuple[validation.ValidationResult, bytes]]:
+    global validation_pool
+    message_data = validation.MessageData.from_message(message)
+    file_checks_keys = [(message.id, blob_cache.blob_sha(pending_file.content), blob_cache.blob_sha(pending_file.old_content) if pending_file.old_content else None,
+                         validation.file_checks_context(project, pending_file.read_files)) for pending_file in pending_files]
+    results: list[Optional[tuple[validation.ValidationResult, bytes]]] = [None] * len(pending_files)
+    to_validate = []
+
+    # the fuzzy indexes are only kept in this process
+    possible_filenames = [validation.draft_possible_filename(pending_file.filename, pending_file.path_cache, message.channel.id) if pending_file.old_content is None else None
+                          for pending_file in pending_files]
+
+    for file_num, pending_file in enumerate(pending_files):
+        if file_checks := file_checks_cache.get(file_checks_keys[file_num]):
+            validation_result = validation.revalidate_message(file_checks, pending_file.filename, message_data, project, skip_validation, pending_file.path_cache,
+                                                              possible_filenames[file_num])
+            content = convert_line_endings(pending_file.content, pending_file.old_content) if validation_result.valid_tas else pending_file.content
+            results[file_num] = (validation_result, content)
+        else:
+            to_validate.append(file_num)
+
+    if not to_validate:
+        return results
+
+    loop = asyncio.get_running_loop()
+    pool = get_validation_pool()
+    queued_time = time.time()
+    validations = [loop.run_in_executor(pool, validate_in_worker, pending_files[file_num].content, pending_files[file_num].filename, message_data,
+                                        pending_files[file_num].old_content, project, skip_validation, pending_files[file_num].path_cache, pending_files[file_num].read_files,
+                                        possible_filenames[file_num])
+                   for file_num in to_validate]
+
+    try:
+        worker_results = await asyncio.gather(*validations)
+    except concurrent.futures.BrokenExecutor:
+        # a worker died (probably out of memory), and the pool is unusable after that
+        log.error("Validation pool broke, will start a new one")
+        validation_pool = None
+        raise
+
+    for file_num, (validation_result, content, start_time, validation_time) in zip(to_validate, worker_results):
+        queue_latency = max(start_time - queued_time, 0)
+        validation_latencies.append((queue_latency, validation_time))
+        log.info(f"Validating {pending_files[file_num].filename} waited {queue_latency:.3f}s in queue and took {validation_time:.3f}s")
+        results[file_num] = (validation_result, content)
+
+        if validation_result.file_checks:
+            file_checks_cache.put(file_checks_keys[file_num], validation_result.file_checks)
+
+    return results
+
+
+# the whole CPU heavy part of handling a file, in a validation worker. only takes and returns plain data, so that it pickles cheaply
+def validate_in_worker(content: bytes, filename: str, message_data: validation.MessageData, old_content: Optional[bytes], project: dict, skip_validation: bool,
+                       path_cache: dict, read_files: Optional[dict[str, bytes]] = None, possible_filename: Optional[str] = None) -> tuple[validation.ValidationResult, bytes, float, float]:
+    start_time = time.time()
+    validation_start_time = time.perf_counter()
+    validation_result = validation.validate(content, filename, message_data, old_content, project, skip_validation, path_cache, read_files, possible_filename)
+
+    if validation_result.valid_tas:
+        content = convert_line_endings(content, old_content)
+
+    return validation_result, content, start_time, time.perf_counter() - validation_start_time
+
+
+# one pool shared by every project, so that a pack's files are spread over all the cores
+# the pool is started (and its workers spawned) on login, so that the first file doesn't wait for it
+def get_validation_pool() -> concurrent.futures.ProcessPoolExecutor:
+    global validation_pool
+
+    if not validation_pool:
+        workers = os.cpu_count() or 1
+        validation_pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+
+        for _ in range(workers):
+            validation_pool.submit(warm_up_worker)
+
+        log.info(f"Started validation pool with {workers} workers")
+
+    return validation_pool
+
+
+# get a worker through its imports and first validation setup before any real files show up
+def warm_up_worker():
+    validation.tokenize_tas(['console load 1', '#Start', '   1,R'])
+
+
+# average (queue latency, validation time) of recently validated files
+def validation_latency() -> Optional[tuple[float, float]]:
+    if validation_latencies:
+        return sum(latency[0] for latency in validation_latencies) / len(validation_latencies), sum(latency[1] for latency in validation_latencies) / len(validation_latencies)
+
+
 def convert_line_endings(tas: bytes, old_tas: Optional[bytes]) -> bytes:
     uses_crlf = tas.count(b'\r\n') >= tas.count(b'\n')
 
@@ -488,7 +840,7 @@ def convert_line_endings(tas: bytes, old_tas: Optional[bytes]) -> bytes:
         return tas
 
 
-def update_contributors(contributor: discord.User, project_id: int, project: dict):
+def update_contributors(contributor: discord.User, project_id: int):
     try:
         project_contributors = db.contributors.get(project_id, keep_primary_key=False)
     except db.DBKeyError:
@@ -506,10 +858,9 @@ def update_contributors(contributor: discord.User, project_id: int, project: dic
 
     db.contributors.set(project_id, project_contributors)
 
-    if not project['use_contributors_file']:
-        log.info("Not updating Contributors.txt")
-        return
 
+# pre commit hook that adds any contributors missing from Contributors.txt, so they get batched into an improvement commit
+def stage_contributors(project_id: int, project: dict, commit_builder: github.CommitBuilder, head_sha: str, base_tree_sha: str) -> Optional[str]:
     if project['contributors_file_path'] in ('.', '') and not project['subdir']:
         contributors_txt_path = 'Contributors.txt'
     elif project['contributors_file_path']:
@@ -517,56 +868,102 @@ def update_contributors(contributor: discord.User, project_id: int, project: dic
     else:
         contributors_txt_path = f"{project['subdir']}/Contributors.txt"
 
-    db_contributor_names = [project_contributors[id_]['name'] for id_ in project_contributors]
-    repo = project['repo']
-    r = niquests.get(f'https://api.github.com/repos/{repo}/contents/{contributors_txt_path}', headers=headers)
-    r_json = orjson.loads(r.content)
+    try:
+        project_contributors = db.contributors.get(project_id, keep_primary_key=False)
+    except db.DBKeyError:
+        project_contributors = {}
 
-    if r.status_code == 404 and 'message' in r_json and r_json['message'] in ("Not Found", "This repository is empty."):
-        commit_message = "Created Contributors.txt"
-        created_file = True
-        do_commit = True
-        repo_contributors = db_contributor_names
+    db_contributor_names = {project_contributors[id_]['name'] for id_ in project_contributors}
+    contributors_file = contributors_files.get(project_id)
+
+    if contributors_file and contributors_file.path == contributors_txt_path and contributors_file.tree_sha == base_tree_sha:
+        log.info(f"Using cached Contributors.txt ({len(contributors_file.names)} names)")
     else:
-        utils.handle_potential_request_error(r, 200)
-        repo_contributors = base64.b64decode(r_json['content']).decode('UTF8').splitlines()
-        contributors_added = []
-        created_file = False
-        do_commit = False
+        # the repo's changed since the last time the bot committed, so the file might've too
+        r = github.get(f"https://api.github.com/repos/{project['repo']}/contents/{contributors_txt_path}", headers=commit_builder.headers, params={'ref': head_sha})
+        r_json = orjson.loads(r.content)
+
+        if r.status_code == 404 and 'message' in r_json and r_json['message'] in ("Not Found", "This repository is empty."):
+            contributors_file = ContributorsFile(contributors_txt_path, base_tree_sha, None, set())
+        else:
+            utils.handle_potential_request_error(r, 200)
+
+            if contributors_file and contributors_file.path == contributors_txt_path and contributors_file.blob_sha == r_json['sha']:
+                repo_contributors = contributors_file.names
+            else:
+                repo_contributors = set(base64.b64decode(r_json['content']).decode('UTF8').splitlines())
+
+            contributors_file = ContributorsFile(contributors_txt_path, base_tree_sha, r_json['sha'], repo_contributors)
 
-        for db_contributor in db_contributor_names:
-            if db_contributor not in repo_contributors:
-                repo_contributors.append(db_contributor)
-                contributors_added.append(db_contributor)
-                do_commit = True
+        contributors_files[project_id] = contributors_file
+        log.info(f"Downloaded Contributors.txt ({len(contributors_file.names)} names)")
 
+    contributors_added = db_contributor_names - contributors_file.names
+
+    if not contributors_added:
+        commit_builder.unstage(contributors_txt_path)
+        return
+
+    file_data = '\n'.join(sorted(contributors_file.names | contributors_added, key=str.casefold)).encode('UTF8')
+    commit_builder.add_file(contributors_txt_path, file_data)
+
+    if contributors_file.blob_sha:
         commit_message = f"Added {', '.join(sorted(contributors_added, key=str.casefold))} to Contributors.txt"
+    else:
+        commit_message = "Created Contributors.txt"
+
+    log.info(commit_message)
+    return commit_message
+
+
+# post commit hook, the cached Contributors.txt is now whatever was staged (or unchanged) and at the new tree
+def contributors_committed(project_id: int, commit_builder: github.CommitBuilder, new_commit: dict):
+    if project_id not in contributors_files:
+        return
 
-    if do_commit:
-        file_data = '\n'.join(sorted(repo_contributors, key=str.casefold)).encode('UTF8')
-        commit_data = {'content': base64.b64encode(file_data).decode('UTF8'), 'message': commit_message}
+    contributors_file = contributors_files[project_id]
 
-        if not created_file:
-            commit_data['sha'] = get_sha(repo, contributors_txt_path)
+    if contributors_file.path in commit_builder.files:
+        contributors_file.names = set(commit_builder.files[contributors_file.path].decode('UTF8').splitlines())
+        contributors_file.blob_sha = commit_builder.blob_shas.get(contributors_file.path)
 
-        log.info(commit_message)
-        r = niquests.put(f'https://api.github.com/repos/{repo}/contents/{contributors_txt_path}', headers=headers, data=orjson.dumps(commit_data))
-        utils.handle_potential_request_error(r, 201 if created_file else 200)
+    contributors_file.tree_sha = new_commit['tree']['sha']
 
 
+# status changes are coalesced and pushed at most once per status_update_interval, with the latest status winning
 async def set_status(message: Optional[discord.Message] = None, project_name: Optional[str] = None):
+    global latest_status, status_push_task
+
     if message:
-        status = f"{projects_count()} TAS projects, last processed post from {utils.nickname(message.author)} in \"{project_name}\""
-        db.misc.set('status', status)
+        latest_status = f"{projects_count()} TAS projects, last processed post from {utils.nickname(message.author)} in \"{project_name}\""
     else:
         try:
-            status = db.misc.get('status')
+            latest_status = db.misc.get('status')
         except db.DBKeyError:
-            status = f"{projects_count()} TAS projects"
-            db.misc.set('status', status)
+            latest_status = f"{projects_count()} TAS projects"
+
+    if status_push_task:
+        log.info(f"Queued status \"Watching {latest_status}\"")
+    else:
+        status_push_task = asyncio.create_task(push_status())
+
 
-    log.info(f"Setting status to \"Watching {status}\"")
-    await client.change_presence(status=discord.Status.online, activity=discord.Activity(name=status, type=discord.ActivityType.watching))
+async def push_status():
+    global pushed_status, last_status_push_time, status_push_task
+    await asyncio.sleep(max(0.0, last_status_push_time + status_update_interval - time.time()))
+    status_push_task = None
+
+    if latest_status == pushed_status:
+        return
+
+    try:
+        log.info(f"Setting status to \"Watching {latest_status}\"")
+        pushed_status = latest_status
+        last_status_push_time = time.time()
+        await client.change_presence(status=discord.Status.online, activity=discord.Activity(name=pushed_status, type=discord.ActivityType.watching))
+        db.misc.set('status', pushed_status)
+    except Exception:
+        await utils.report_error(client)
 
 
 def projects_count() -> int:
@@ -584,6 +981,7 @@ def generate_request_headers(installation_owner: str, min_time: int = 30):
     headers = {'Authorization': f'Bearer {gen_token.access_token(installation_owner, min_time)}',
                'Accept': 'application/vnd.github+json',
                'X-GitHub-Api-Version': '2022-11-28'}
+    github.name_installation(headers, installation_owner)
 
 
 def create_logger(name: str, use_file_handler: bool = True) -> logging.Logger:
@@ -613,7 +1011,9 @@ def create_logger(name: str, use_file_handler: bool = True) -> logging.Logger:
 
     global log
     log = logger
+    blob_cache.log = logger
     gen_token.log = logger
+    github.log = logger
     validation.log = logger
     utils.log = logger
     commands.log = logger
@@ -633,4 +1033,22 @@ safe_mode = None
 safe_projects = (970380662907482142, 973793458919723088, 975867007868235836, 976903244863381564, 1067206696927248444)
 inaccessible_projects = set(safe_projects)
 fast_project_ids = set()
+validation_pool: Optional[concurrent.futures.ProcessPoolExecutor] = None
+validation_latencies = collections.deque(maxlen=100)
+file_checks_cache = validation.LRUCache(64)  # (message ID, file blob SHA, old file blob SHA) -> validation.FileChecks
+repo_snapshots: dict[int, read_resolver.ReadResolver] = {}  # project ID -> resolver over a RepoSnapshot, for IncludeReads projects
+contributors_files: dict[int, ContributorsFile] = {}
+pending_pin_edits: dict[int, asyncio.Task] = {}
+pin_hashes: dict[int, int] = {}
+pin_edit_delay = 5
+latest_status: Optional[str] = None
+pushed_status: Optional[str] = None
+last_status_push_time = 0.0
+status_push_task: Optional[asyncio.Task] = None
+status_update_interval = 30
+zip_max_download = 25 * 1048576
+zip_max_in_memory = 2 * 1048576
+zip_max_tases = 100
+zip_max_tas_size = validation.max_tas_size
+zip_max_total_size = 20 * 1048576
 re_lobby_filename = re.compile(r'.+_(\d+)-(\d+)\.tas')
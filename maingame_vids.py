@@ -11,6 +11,7 @@ import niquests
 
 import game_sync
 import main
+import validation
 
 
 FILES_BLACKLIST = \
@@ -132,8 +133,10 @@ def get_rooms_from_tas(tas_lines: list[str], tas_path: Path | str) -> tuple[list
     current_room = None
     rooms_excluded_count = 0
 
-    for line_num, line in enumerate([*tas_lines, '#lvl_']):
-        if line.startswith('#lvl_'):  # start new room
+    tas_tokens = validation.tokenize_tas([*tas_lines, '#lvl_'])
+
+    for line_num, line in enumerate(tas_tokens.lines):
+        if tas_tokens.types[line_num] == validation.LineType.ROOM_LABEL:  # start new room
             if current_room:
                 if len(current_room.inputs) > 3:
                     current_room.finalize()
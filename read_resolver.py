@@ -0,0 +1,202 @@
+import dataclasses
+import logging
+import posixpath
+from pathlib import Path
+from typing import Mapping, Optional, Union
+
+import frame_count
+import utils
+import validation
+
+
+@dataclasses.dataclass(frozen=True)
+class Read:
+    line_num: int
+    command: str
+    path: Optional[str]  # repo path of the read file, None if it couldn't be found
+    start_line_num: Optional[int]  # inclusive, None if the label couldn't be found
+    end_line_num: Optional[int]
+
+
+# resolves Read commands between a repo's TAS files, and tracks which files include which. paths are repo paths ("folder/file.tas")
+class ReadResolver:
+    def __init__(self, files: Mapping[str, bytes], path_cache: Optional[dict[str, str]] = None):
+        self.files = files
+        self.path_cache = path_cache if path_cache else {}
+        self.folders: dict[str, list[str]] = {}
+        self.resolved_paths: dict[tuple[str, str], Optional[str]] = {}
+        self.reads_cache: dict[str, list[Read]] = {}
+        self.expanded_cache: dict[tuple[str, int, int], tuple[str, ...]] = {}
+        self.frames_cache: dict[str, frame_count.FrameCount] = {}
+        self.dependents_cache: Optional[dict[str, frozenset[str]]] = None
+
+        for path in sorted(files):
+            self.folders.setdefault(posixpath.dirname(path), []).append(path)
+
+    @classmethod
+    def from_folder(cls, folder: Path, path_cache: Optional[dict[str, str]] = None) -> 'ReadResolver':
+        return cls({tas_path.relative_to(folder).as_posix(): tas_path.read_bytes() for tas_path in folder.rglob('*.tas') if '.git' not in tas_path.parts}, path_cache)
+
+    def tokens(self, path: str) -> validation.TokenizedTAS:
+        return validation.parse_tas_cached(self.files[path], False, False)[1]
+
+    # find the file a Read command means, the same way Studio does: relative to the reading file, with the extension optional, or just the start of a
+    # filename. falls back to the path cache by filename, for reads that weren't updated after a file was moved
+    def resolve_path(self, reading_path: str, read_arg: str) -> Optional[str]:
+        key = (reading_path, read_arg)
+
+        if key in self.resolved_paths:
+            return self.resolved_paths[key]
+
+        path = posixpath.normpath(posixpath.join(posixpath.dirname(reading_path), read_arg.strip().replace('\\', '/')))
+        resolved_path = None
+
+        for candidate in (path, f'{path}.tas'):
+            if candidate in self.files:
+                resolved_path = candidate
+                break
+        else:
+            folder, filename_start = posixpath.split(path)
+
+            for candidate in self.folders.get(folder, ()):
+                if posixpath.basename(candidate).lower().startswith(filename_start.lower()):
+                    resolved_path = candidate
+                    break
+            else:
+                filename = posixpath.basename(path)
+                filename = filename if filename.endswith('.tas') else f'{filename}.tas'
+
+                if self.path_cache.get(filename) in self.files:
+                    resolved_path = self.path_cache[filename]
+
+        self.resolved_paths[key] = resolved_path
+        return resolved_path
+
+    # all the Read commands in a file, with their targets and line ranges resolved
+    def reads(self, path: str) -> list[Read]:
+        if path not in self.reads_cache:
+            self.reads_cache[path] = self.find_reads(path, self.tokens(path))
+
+        return self.reads_cache[path]
+
+    # reads from a file's tokens, which can be a version of the file that isn't in the repo (yet)
+    def find_reads(self, path: str, tas_tokens: validation.TokenizedTAS) -> list[Read]:
+        return [self.resolve_read(path, line_num, command_split) for line_num, command_split in tas_tokens.commands.items()
+                if command_split[0].lower() == 'read' and len(command_split) > 1]
+
+    def resolve_read(self, path: str, line_num: int, command_split: list[str]) -> Read:
+        args = [arg.strip() for arg in command_split[1:]]
+        read_path = self.resolve_path(path, args[0])
+        start_line_num = end_line_num = None
+
+        if read_path:
+            read_tokens = self.tokens(read_path)
+            start_line_num = frame_count.find_read_line(read_tokens, args[1]) if len(args) > 1 else 0
+            end_line_num = frame_count.find_read_line(read_tokens, args[2]) if len(args) > 2 else len(read_tokens.lines) - 1
+
+        return Read(line_num, ','.join(command_split), read_path, start_line_num, end_line_num)
+
+    # a file's lines with every Read replaced by the lines it reads, recursively. unresolvable and recursive reads are left as is
+    def expand(self, path: str, start_line_num: int = 0, end_line_num: Optional[int] = None, expanding: tuple[str, ...] = ()) -> tuple[str, ...]:
+        tas_tokens = self.tokens(path)
+        end_line_num = len(tas_tokens.lines) - 1 if end_line_num is None else end_line_num
+        key = (path, start_line_num, end_line_num)
+
+        if key in self.expanded_cache:
+            return self.expanded_cache[key]
+
+        reads = {read.line_num: read for read in self.reads(path)}
+        expanded = []
+        recursed = False
+
+        for line_num in range(start_line_num, end_line_num + 1):
+            read = reads.get(line_num)
+
+            if not read or not read.path or read.start_line_num is None or read.end_line_num is None:
+                expanded.append(tas_tokens.lines[line_num])
+            elif read.path in expanding or read.path == path or len(expanding) > frame_count.max_read_depth:
+                expanded.append(tas_tokens.lines[line_num])
+                recursed = True
+            else:
+                expanded.extend(self.expand(read.path, read.start_line_num, read.end_line_num, expanding + (path,)))
+
+        expanded = tuple(expanded)
+
+        if not recursed:
+            # a recursive expansion depends on where it started from, so only memoize the rest
+            self.expanded_cache[key] = expanded
+
+        return expanded
+
+    # Read resolution for frame_count, so counts include every file read
+    def read_file(self, reading_path: str, read_arg: str) -> Optional[tuple[str, validation.TokenizedTAS]]:
+        if read_path := self.resolve_path(reading_path, read_arg):
+            return read_path, self.tokens(read_path)
+
+    def frames(self, path: str) -> frame_count.FrameCount:
+        if path not in self.frames_cache:
+            self.frames_cache[path] = frame_count.count_frames(self.tokens(path), self.read_file, path)
+
+        return self.frames_cache[path]
+
+    # files that this file reads from directly
+    def dependencies(self, path: str) -> set[str]:
+        return {read.path for read in self.reads(path) if read.path and read.path != path}
+
+    # every file that a file reads from, directly or through other files
+    def read_closure(self, path: str, tas_tokens: Optional[validation.TokenizedTAS] = None) -> set[str]:
+        reads = self.find_reads(path, tas_tokens) if tas_tokens else self.reads(path)
+        found = set()
+        to_visit = [read.path for read in reads if read.path and read.path != path]
+
+        while to_visit:
+            read_path = to_visit.pop()
+
+            if read_path not in found:
+                found.add(read_path)
+                to_visit.extend(self.dependencies(read_path))
+
+        found.discard(path)
+        return found
+
+    # every file -> the files that it reads from directly
+    def dependency_graph(self) -> dict[str, set[str]]:
+        return {path: self.dependencies(path) for path in self.files}
+
+    # every file that reads from this one, directly or through other files
+    def dependents(self, path: str) -> frozenset[str]:
+        if self.dependents_cache is None:
+            self.dependents_cache = build_dependents(self.dependency_graph())
+
+        return self.dependents_cache.get(path, frozenset())
+
+
+# invert a dependency graph, and walk it so that each file maps to everything that transitively depends on it
+def build_dependents(dependency_graph: dict[str, set[str]]) -> dict[str, frozenset[str]]:
+    direct_dependents = {}
+
+    for path, dependencies in dependency_graph.items():
+        for dependency in dependencies:
+            direct_dependents.setdefault(dependency, set()).add(path)
+
+    dependents = {}
+
+    for path in direct_dependents:
+        found = set()
+        to_visit = list(direct_dependents[path])
+
+        while to_visit:
+            dependent = to_visit.pop()
+
+            if dependent not in found:
+                found.add(dependent)
+                to_visit.extend(direct_dependents.get(dependent, ()))
+
+        found.discard(path)
+        dependents[path] = frozenset(found)
+
+    log.info(f"Built read dependency graph: {len(dependency_graph)} files, {len(dependents)} read by others")
+    return dependents
+
+
+log: Union[logging.Logger, utils.LogPlaceholder] = utils.LogPlaceholder()
@@ -0,0 +1,154 @@
+import argparse
+import concurrent.futures
+import io
+import logging
+import os
+import re
+import time
+import zipfile
+from pathlib import Path
+from typing import Union
+
+import orjson
+
+import db
+import github
+import utils
+import validation
+
+
+# check every TAS in a project (or just a folder) against the current validation rules, to see what would fail after changing them
+def run_revalidation():
+    global log
+    log = logging.getLogger('revalidate')
+    log.setLevel(logging.INFO)
+    log.addHandler(logging.StreamHandler())
+
+    parser = argparse.ArgumentParser(description="Revalidate every TAS file in local folders and/or project repos, and write a JSON report for each")
+    parser.add_argument('paths', help="Local folders or repo clones to check, using default project settings", nargs='*')
+    parser.add_argument('--project', help="Project name or ID to check, optionally with the path to an existing clone (\"name=path\"), otherwise the repo is downloaded",
+                        action='append', default=[])
+    parser.add_argument('--processes', help="Number of worker processes (default: CPU count)", type=int, default=os.cpu_count())
+    parser.add_argument('--output', help="Folder to write reports to", default='revalidation_reports')
+    args = parser.parse_args()
+
+    if not args.paths and not args.project:
+        parser.error("Give at least one path or --project")
+
+    output_path = Path(args.output)
+    output_path.mkdir(exist_ok=True)
+    sources = [(Path(path).resolve().name, default_project, read_folder(Path(path), default_project)) for path in args.paths]
+
+    for project_arg in args.project:
+        project_name_or_id, _, clone_path = project_arg.partition('=')
+
+        if not (project := db.projects.get_by_name_or_id(project_name_or_id)):
+            log.error(f"Couldn't find project \"{project_name_or_id}\"")
+            continue
+
+        tas_files = read_folder(Path(clone_path), project) if clone_path else download_repo(project)
+        sources.append((project['name'], project, tas_files))
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.processes, initializer=init_worker) as pool:
+        for name, project, tas_files in sources:
+            report = revalidate_files(pool, name, project, tas_files)
+            report_path = output_path / f'{re_unsafe_filename.sub('_', name)}.json'
+            report_path.write_bytes(orjson.dumps(report, option=orjson.OPT_INDENT_2))
+            log.info(f"Wrote {report_path}")
+
+
+def revalidate_files(pool: concurrent.futures.ProcessPoolExecutor, name: str, project: dict, tas_files: dict[str, bytes]) -> dict:
+    log.info(f"Revalidating {len(tas_files)} files for {name}")
+    start_time = time.perf_counter()
+    futures = [pool.submit(revalidate_file, path, tas, project) for path, tas in tas_files.items()]
+    results = sorted((future.result() for future in futures), key=lambda result: result['path'])
+    total_time = time.perf_counter() - start_time
+    invalid_results = [result for result in results if not result['valid']]
+    total_bytes = sum(len(tas) for tas in tas_files.values())
+    log.info(f"{name}: {len(invalid_results)}/{len(results)} files failed, took {total_time:.2f}s "
+             f"({len(results) / total_time:.1f} files/s, {total_bytes / 1048576 / total_time:.2f} MB/s)")
+
+    for invalid_result in invalid_results:
+        log.info(f"{invalid_result['path']}: {', '.join(invalid_result['log_text'])}")
+
+    return {'name': name,
+            'project_id': project['project_id'],
+            'time': int(time.time()),
+            'files': len(results),
+            'invalid_files': len(invalid_results),
+            'total_bytes': total_bytes,
+            'total_time': total_time,
+            'files_per_second': len(results) / total_time,
+            'validation_time': sum(result['validation_time'] for result in results),
+            'results': results}
+
+
+# validate a file without a post to go with it, by faking a message that passes the message checks
+def revalidate_file(path: str, tas: bytes, project: dict) -> dict:
+    start_time = time.perf_counter()
+    filename = path.rpartition('/')[2]
+    project = project | {'ensure_level': False}
+
+    try:
+        tas_parsed = validation.parse_tas_cached(tas, True)[0]
+        message = validation.MessageData(f"draft {tas_parsed.finaltime}", 0, 0)
+        validation_result = validation.validate(tas, filename, message, None, project, path_cache={})
+    except UnicodeDecodeError as error:
+        validation_result = validation.ValidationResult(False, [f"Couldn't decode file: {error}"], [f"{filename} not being UTF8"])
+
+    return {'path': path,
+            'valid': validation_result.valid_tas,
+            'warning_text': validation_result.warning_text,
+            'log_text': validation_result.log_text,
+            'finaltime': validation_result.finaltime,
+            'size': len(tas),
+            'validation_time': time.perf_counter() - start_time}
+
+
+def read_folder(folder: Path, project: dict) -> dict[str, bytes]:
+    tas_files = {}
+
+    for tas_path in folder.rglob('*.tas'):
+        path = tas_path.relative_to(folder).as_posix()
+
+        if is_included(path, project):
+            tas_files[path] = tas_path.read_bytes()
+
+    return tas_files
+
+
+def download_repo(project: dict) -> dict[str, bytes]:
+    import main
+    main.generate_request_headers(project['installation_owner'])
+    log.info(f"Downloading {project['repo']}")
+    r = github.get(f'https://api.github.com/repos/{project['repo']}/zipball', github.Priority.BACKGROUND, headers=main.headers, timeout=60)
+    utils.handle_potential_request_error(r, 200)
+    tas_files = {}
+
+    with zipfile.ZipFile(io.BytesIO(r.content), 'r') as archive_file:
+        for file in archive_file.filelist:
+            path = file.filename.partition('/')[2]  # remove the archive's root folder
+
+            if path.endswith('.tas') and is_included(path, project):
+                with archive_file.open(file) as file_opened:
+                    tas_files[path] = file_opened.read()
+
+    return tas_files
+
+
+def is_included(path: str, project: dict) -> bool:
+    return path.startswith(project['subdir']) and not [item for item in project['excluded_items'] if path.startswith(item)]
+
+
+def init_worker():
+    validation.log = logging.getLogger('revalidate_worker')
+    validation.log.setLevel(logging.WARNING)
+
+
+log: Union[logging.Logger, utils.LogPlaceholder] = utils.LogPlaceholder()
+default_project = {'project_id': 0, 'name': "", 'subdir': "", 'excluded_items': [], 'is_lobby': False, 'ensure_level': False, 'disallowed_command_exemptions': [],
+                   'room_indexing_includes_reads': False}
+re_unsafe_filename = re.compile(r'[<>:"/\\|?*]')
+
+if __name__ == '__main__':
+    run_revalidation()
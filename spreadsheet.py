@@ -15,6 +15,7 @@ from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
 import db
+import fuzzy_index
 import utils
 import validation
 from utils import plural
@@ -298,27 +299,25 @@ async def taser_status(interaction: discord.Interaction, taser: str):
 def update_stats(filename: str, validation_result: validation.ValidationResult, date: Optional[str] = None):
     sj_map = sj_data_filenames[filename]
     log.info(f"Updating spreadsheet stats for {sj_map} ({filename})")
-    tas_lines, _ = validation_result.sj_data
+    tas_tokens, _ = validation_result.sj_data
     recordcount = 0
 
     map_row = MapRow(sj_map)
     map_row.current_time_cell.write(validation_result.finaltime)
     map_row.improvement_date_cell.write(date if date else datetime.datetime.now().strftime('%Y-%m-%d'))
     draft_time = map_row.draft_time_cell.value()
-    new_frames = validation.time_to_frames(validation_result.finaltime)
+    new_frames = validation_result.finaltime_frames
 
     if draft_time:
-        draft_frames = validation.time_to_frames(draft_time)
-        timesave_frames = validation.calculate_time_difference(draft_frames, new_frames)
+        draft_frames = validation.FrameTime.parse(draft_time).frames
+        timesave_frames = draft_frames - new_frames
         percent_saved = (timesave_frames / draft_frames) * 100
         map_row.time_saved_cell.write(f"{timesave_frames}f ({percent_saved:.1f}%)")
     else:
         log.warning("No draft time")
 
-    for line in tas_lines:
-        if line.startswith('RecordCount: '):
-            recordcount = int(line.partition(':')[2].strip())
-            break
+    if recordcount_command := tas_tokens.find_command('RecordCount:'):
+        recordcount = int(recordcount_command[1])
 
     if recordcount:
         map_row.records_cell.write(recordcount)
@@ -349,14 +348,18 @@ def sj_fuzzy_match(search: str) -> tuple:
     if not search:
         return ()
 
-    from rapidfuzz import process as fuzzy_process
-    sj_maps = sj_data.keys()
-    fuzzes = fuzzy_process.extract(search, sj_maps)
-    fuzzes_thresholded = [sj_map[0] for sj_map in fuzzes[:25] if sj_map[1] >= 65]
-    sj_maps_startwith = [sj_map for sj_map in sj_maps if sj_map.lower().startswith(search)]
+    sj_index = sj_fuzzy_index()
+    fuzzes_thresholded = sj_index.matches(search, score_cutoff=65)
+    sj_maps_startwith = sj_index.starting_with(search)
     return tuple(dict.fromkeys(sj_maps_startwith + fuzzes_thresholded))
 
 
+# autocomplete calls this every keypress, so build it once
+@functools.cache
+def sj_fuzzy_index() -> fuzzy_index.FuzzyIndex:
+    return fuzzy_index.FuzzyIndex(sj_data)
+
+
 @functools.lru_cache(maxsize=512)
 def correct_map_case(map_name: str) -> str:
     if map_name in sj_data:
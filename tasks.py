@@ -16,10 +16,10 @@ from pathlib import Path
 
 import cron_validator
 import discord
-import niquests
 from discord.ext import tasks
 
 import db
+import github
 import main
 import maingame_vids
 import spreadsheet
@@ -51,11 +51,15 @@ async def run_and_catch_task(task_function: callable):
     if inspect.iscoroutinefunction(task_function):
         try:
             await task_function()
+        except github.RateLimitedError as error:
+            log.info(f"Backing off {task_function.__name__}: {error}")
         except Exception:
             await utils.report_error(client)
     else:
         try:
             task_function()
+        except github.RateLimitedError as error:
+            log.info(f"Backing off {task_function.__name__}: {error}")
         except Exception:
             utils.log_error()
 
@@ -260,7 +264,7 @@ async def room_suggestions():
             return
 
         log.info(f"Updating room improvement suggestion for project \"{project['name']}\"")
-        r = niquests.get(f'https://github.com/{repo}/archive/refs/heads/master.zip', timeout=30)
+        r = github.get(f'https://github.com/{repo}/archive/refs/heads/master.zip', github.Priority.BACKGROUND, timeout=30)
         utils.handle_potential_request_error(r, 200)
         rooms: list[maingame_vids.Room] = []
         chosen_room: maingame_vids.Room
@@ -1,24 +1,38 @@
 import ast
+import asyncio
+import base64
 import dataclasses
 import datetime
 import functools
+import subprocess
+import threading
 import time
+import urllib.error
+import urllib.request
 from decimal import Decimal
 from pathlib import Path
 from typing import Optional
 
 import discord
+import orjson
 import pytest
 
+import blob_cache
 import bot
 import commands
 import db
+import frame_count
+import fuzzy_index
 import game_sync
 import gen_token
+import github
 import main
+import read_resolver
+import revalidate
 import spreadsheet
 import utils
 import validation
+import validation_service
 
 
 @pytest.fixture
@@ -126,6 +140,18 @@ class MockGuild:
     id: Optional[int] = None
 
 
+@dataclasses.dataclass
+class MockResponse:
+    status_code: int
+    json: dict
+    headers: dict = dataclasses.field(default_factory=dict)
+    text: str = ''
+
+    @property
+    def content(self) -> bytes:
+        return orjson.dumps(self.json)
+
+
 def mock_message(*args, **kwargs):
     return MockMessage(*args, **kwargs)
 
@@ -161,7 +187,7 @@ async def test_process_improvement_message(setup_log, monkeypatch):
         filename: str
         url: str
 
-    def mock_commit(*args) -> tuple:
+    async def mock_commit(*args) -> tuple:
         return "-0f 0oi71n.tas (1:08.748) from Kataiser", 'https://github.com/Kataiser/improvements-bot-testing/commit/8cffb3495b8b8423a8762834cc1b1a329bf86a47'
 
     monkeypatch.setattr(main, 'commit', mock_commit)
@@ -190,6 +216,56 @@ async def test_process_improvement_message(setup_log, monkeypatch):
     assert message.reactions == {'📝'}
 
 
+def test_extract_zip_tases(setup_log, monkeypatch, tmp_path):
+    @dataclasses.dataclass
+    class MockAttachment:
+        filename: str
+        url: str
+        size: int
+
+    class MockResponse:
+        status_code = 200
+
+        def __init__(self, content: bytes):
+            self.content = content
+
+        def iter_content(self, chunk_size: int):
+            for i in range(0, len(self.content), chunk_size):
+                yield self.content[i:i + chunk_size]
+
+    monkeypatch.setattr(main.blob_cache, 'cache_dir', tmp_path)
+    monkeypatch.setattr(main.blob_cache, 'index_loaded', None)
+    zip_content = Path('test_tases\\test.zip').read_bytes()
+    monkeypatch.setattr(main.niquests, 'get', lambda *args, **kwargs: MockResponse(zip_content))
+    zip_attachment = MockAttachment('test.zip', 'https://cdn.discordapp.com/attachments/test.zip', len(zip_content))
+    tases = main.extract_zip_tases(zip_attachment)
+    assert len(tases) == 11
+    assert tases[5].filename == 'glitchy - Copy.tas'
+    assert tases[5].url == 'test.zip/glitchy/glitchy - Copy.tas'
+    assert len(tases[8].content) == 10009
+
+    # extracted files are cached, not the zip
+    monkeypatch.setattr(main.niquests, 'get', lambda *args, **kwargs: pytest.fail("Should have been cached"))
+    assert main.extract_zip_tases(zip_attachment) == tases
+    assert main.blob_cache.blob_sha(zip_content) not in main.blob_cache.load_index()['blobs']
+    monkeypatch.setattr(main.niquests, 'get', lambda *args, **kwargs: MockResponse(zip_content))
+    monkeypatch.setattr(main.blob_cache, 'index_loaded', None)
+    monkeypatch.setattr(main.blob_cache, 'cache_dir', tmp_path / 'empty')
+
+    monkeypatch.setattr(main, 'zip_max_tases', 10)
+    with pytest.raises(main.ZipAttachmentError, match="too many TAS files"):
+        main.extract_zip_tases(zip_attachment)
+
+    monkeypatch.setattr(main, 'zip_max_tases', 100)
+    monkeypatch.setattr(main, 'zip_max_tas_size', 8192)
+    with pytest.raises(main.ZipAttachmentError, match="royal_gardens.tas"):
+        main.extract_zip_tases(zip_attachment)
+
+    monkeypatch.setattr(main, 'zip_max_download', 8192)
+    with pytest.raises(main.ZipAttachmentError, match="too large"):
+        main.extract_zip_tases(zip_attachment)
+
+
 def test_generate_path_cache(setup_log):
     path_cache = main.generate_path_cache(970380662907482142)
     assert path_cache['0oi71n.tas'] == '0oi71n.tas'
@@ -217,6 +293,35 @@ def test_download_old_file(setup_log):
     assert len(main.download_old_file(970380662907482142, 'Kataiser/improvements-bot-testing', 'chaos_assembly_lol_lmao.tas')) == 4827
 
 
+def test_download_old_file_changed(setup_log, monkeypatch, tmp_path):
+    blobs = {blob_cache.blob_sha(content): content for content in (b'  1\n', b'  2\n')}
+    current_sha = blob_cache.blob_sha(b'  1\n')
+    requests = []
+
+    def mock_get(url: str, **kwargs) -> MockResponse:
+        requests.append(url.removeprefix('https://api.github.com/repos/test/repo/'))
+
+        if '/git/blobs/' in url:
+            return MockResponse(200, {'sha': url.rpartition('/')[2], 'content': base64.b64encode(blobs[url.rpartition('/')[2]]).decode('UTF8')})
+        else:
+            return MockResponse(200, [{'name': '1A.tas', 'path': 'celeste/1A.tas', 'sha': current_sha, 'type': 'file'}])
+
+    monkeypatch.setattr(main.github, 'get', mock_get)
+    monkeypatch.setattr(blob_cache, 'cache_dir', tmp_path)
+    monkeypatch.setattr(blob_cache, 'index_loaded', None)
+    path_cache = {'1A.tas': 'celeste/1A.tas'}
+    assert main.download_old_file(0, 'test/repo', '1A.tas', path_cache) == b'  1\n'
+    assert main.download_old_file(0, 'test/repo', '1A.tas', path_cache) == b'  1\n'
+    assert requests == ['contents/celeste', f'git/blobs/{current_sha}', 'contents/celeste']
+
+    # changed outside the bot
+    requests.clear()
+    current_sha = blob_cache.blob_sha(b'  2\n')
+    assert main.download_old_file(0, 'test/repo', '1A.tas', path_cache) == b'  2\n'
+    assert requests == ['contents/celeste', f'git/blobs/{current_sha}']
+    assert main.download_old_file(0, 'test/repo', '2A.tas', path_cache) is None
+
+
 def test_convert_line_endings(setup_log):
     tas_crlf = Path('test_tases\\line endings\\raindrops_on_roses_crlf.tas').read_bytes()
     tas_lf = Path('test_tases\\line endings\\raindrops_on_roses_lf.tas').read_bytes()
@@ -228,6 +333,219 @@ def test_convert_line_endings(setup_log):
     assert main.convert_line_endings(tas_lf, None) == tas_lf
 
 
+def test_get_read_files(setup_log, monkeypatch):
+    test_project = {'project_id': 0, 'subdir': '', 'room_indexing_includes_reads': True}
+    files = {'1A.tas': b'Read,common/menu\n', 'common/menu.tas': b'Read,loop\n', 'common/loop.tas': b'  1\n', 'common/unread.tas': b'  2\n'}
+    snapshot = main.RepoSnapshot('test/repo', {path: main.blob_cache.blob_sha(content) for path, content in files.items()}, files.copy())
+    monkeypatch.setattr(main, 'repo_snapshots', {0: read_resolver.ReadResolver(snapshot)})
+    pending_file = main.PendingFile(None, '1A.tas', b'Read,common/menu\nRead,common/unread\n', files['1A.tas'], {'1A.tas': '1A.tas'})
+    assert main.get_read_files(test_project, pending_file) == {path: files[path] for path in ('common/loop.tas', 'common/menu.tas', 'common/unread.tas')}
+
+    main.update_repo_snapshot(0, {'common/menu.tas': b'  3\n', 'Contributors.txt': b'Kataiser'})
+    assert main.repo_snapshots[0].files['common/menu.tas'] == b'  3\n' and 'Contributors.txt' not in main.repo_snapshots[0].files
+    assert main.get_read_files(test_project, pending_file) == {path: main.repo_snapshots[0].files[path] for path in ('common/menu.tas', 'common/unread.tas')}
+
+
+def test_validate_files(setup_log, monkeypatch):
+    test_project = {'project_id': 0, 'is_lobby': False, 'excluded_items': (), 'ensure_level': False, 'disallowed_command_exemptions': [], 'room_indexing_includes_reads': False}
+    monkeypatch.setattr(main, 'validation_latencies', main.collections.deque(maxlen=100))
+    tas_crlf = Path('test_tases\\line endings\\raindrops_on_roses_crlf.tas').read_bytes()
+    tas_lf = Path('test_tases\\line endings\\raindrops_on_roses_lf.tas').read_bytes()
+    pending_files = [main.PendingFile(None, 'raindrops_on_roses.tas', tas_crlf, None, {}), main.PendingFile(None, 'empty.tas', b'', None, {})]
+    message = MockMessage("raindrops draft (1:51.299)", MockChannel(970380662907482142), MockUser())
+    results = asyncio.run(main.validate_files(pending_files, message, test_project, False))
+    assert [result[0].valid_tas for result in results] == [True, False]
+    assert results[0][1] == tas_lf
+    assert results[1][0].log_text == ["empty.tas being empty"]
+    assert len(main.validation_latencies) == 2
+    assert main.validation_latency()[1] > 0
+
+    # an edit to the message only redoes the message checks, without going through the pool
+    monkeypatch.setattr(main, 'file_checks_cache', validation.LRUCache(64))
+    message.id = 1
+    results = asyncio.run(main.validate_files(pending_files[:1], message, test_project, False))
+    message.content = "raindrops (1:51.299)"
+    edited_results = asyncio.run(main.validate_files(pending_files[:1], message, test_project, False))
+    assert len(main.validation_latencies) == 3
+    assert main.file_checks_cache.hits == 1
+    assert edited_results[0][0].log_text == ["no \"draft\" text in message"]
+    message.content = "raindrops WIP"
+    edited_results = asyncio.run(main.validate_files(pending_files[:1], message, test_project, False))
+    assert edited_results[0] == (dataclasses.replace(results[0][0], wip=True, timesave=None), tas_lf)
+
+    # the cached checks also depend on the files read from, for projects that index room labels through reads
+    message.id = 3
+    message.content = "a draft (1:00.000)"
+    reads_project = test_project | {'room_indexing_includes_reads': True}
+    tas = b'console load 1\n#Start\nRead,../common/intro\n#lvl_a (1)\n  20\n#lvl_c (0)\n  5\n#lvl_b\n  1\nChapterTime: 1:00.000(3529)\n'
+    pending_file = main.PendingFile(None, 'a.tas', tas, None, {'a.tas': 'levels/a.tas'}, {'common/intro.tas': b'#lvl_a (0)\n  10\n#lvl_b (0)\n  5\n'})
+    results = asyncio.run(main.validate_files([pending_file], message, reads_project, False))
+    assert results[0][0].log_text == ["missing room label #lvl_b on line 8 in a.tas"]
+    message.content = "a draft (1:00.000), edited"
+    pending_file.read_files = {'common/intro.tas': b'  15\n'}
+    edited_results = asyncio.run(main.validate_files([pending_file], message, reads_project, False))
+    assert edited_results[0][0].log_text == ["incorrect initial room label #lvl_c (0) on line 6 in a.tas"]
+    assert main.file_checks_cache.hits == 2  # just the earlier edits
+
+    # draft suggestions come from this process's fuzzy index
+    message.id = 2
+    message.content = "raindrops (1:51.299)"
+    pending_file = main.PendingFile(None, 'raindrop_on_roses.tas', tas_crlf, None, {'raindrops_on_roses.tas': 'raindrops_on_roses.tas'})
+    results = asyncio.run(main.validate_files([pending_file], message, test_project, False))
+    assert "(did you mean `raindrops_on_roses.tas`?)" in results[0][0].warning_text[0]
+
+    # invalid files don't get converted
+    message_data = validation.MessageData("raindrops draft (1:51.299)", 0, 0)
+    assert main.validate_in_worker(tas_crlf, 'raindrops_on_roses.tas', message_data, tas_lf, test_project, False, {})[:2] == (
+        validation.ValidationResult(False, ["This file is identical to what's already in the repo."], ["file raindrops_on_roses.tas is unchanged from repo"]), tas_crlf)
+
+
+def test_validate_files_concurrently(setup_log, monkeypatch):
+    test_project = {'project_id': 0, 'is_lobby': False, 'excluded_items': (), 'ensure_level': False, 'disallowed_command_exemptions': [], 'room_indexing_includes_reads': False}
+
+    def slow_validate(tas: bytes, *args) -> validation.ValidationResult:
+        time.sleep(0.5)
+        return validation.ValidationResult(False, [], [tas.decode('UTF8')])
+
+    # the workers are forked after this, so they get the slow validate
+    monkeypatch.setattr(main.validation, 'validate', slow_validate)
+    monkeypatch.setattr(main.os, 'cpu_count', lambda: 4)
+    monkeypatch.setattr(main, 'validation_pool', None)
+    monkeypatch.setattr(main, 'file_checks_cache', validation.LRUCache(64))
+    pending_files = [main.PendingFile(None, f'{file_num}.tas', str(file_num).encode('UTF8'), None, {}) for file_num in range(4)]
+    message = MockMessage("pack draft", MockChannel(970380662907482142), MockUser())
+    main.get_validation_pool()
+    time.sleep(1)  # let the workers start
+    start_time = time.perf_counter()
+    results = asyncio.run(main.validate_files(pending_files, message, test_project, False))
+    assert [result[0].log_text for result in results] == [['0'], ['1'], ['2'], ['3']]
+    assert time.perf_counter() - start_time < 1.5
+    main.validation_pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_edit_pin(setup_log, monkeypatch):
+    class MockPinChannel:
+        id = 970380662907482142
+        edits = []
+
+        def get_partial_message(self, message_id: int):
+            return self
+
+        async def edit(self, content: str):
+            self.edits.append(content)
+
+    project = {'project_id': 970380662907482142, 'name': "Improvements bot testing", 'repo': 'Kataiser/improvements-bot-testing', 'subdir': '', 'pin': 1,
+               'admins': [219955313334288385], 'ensure_level': False, 'is_lobby': False, 'desyncs': [], 'do_run_validation': False}
+    monkeypatch.setattr(db.projects, 'get', lambda *args, **kwargs: project)
+    monkeypatch.setattr(main, 'pin_edit_delay', 0.1)
+    monkeypatch.setattr(main, 'pin_hashes', {})
+    assert main.render_pin(project) == main.render_pin(project)
+    channel = MockPinChannel()
+
+    for _ in range(3):
+        await main.edit_pin(channel)
+
+    await asyncio.sleep(0.2)
+    assert len(channel.edits) == 1
+    await main.edit_pin(channel)
+    await asyncio.sleep(0.2)
+    assert len(channel.edits) == 1
+    project['admins'].append(234520815658336258)
+    await main.edit_pin(channel)
+    await asyncio.sleep(0.2)
+    assert len(channel.edits) == 2
+    assert "Admins: <@219955313334288385>, <@234520815658336258>" in channel.edits[1]
+
+
+@pytest.mark.asyncio
+async def test_set_status(setup_log, monkeypatch):
+    class MockPresenceClient:
+        presences = []
+
+        async def change_presence(self, status: discord.Status, activity: discord.Activity):
+            self.presences.append(activity.name)
+
+    db_writes = []
+    monkeypatch.setattr(main, 'client', MockPresenceClient())
+    monkeypatch.setattr(main, 'status_update_interval', 0.2)
+    monkeypatch.setattr(main, 'last_status_push_time', 0.0)
+    monkeypatch.setattr(main, 'fast_project_ids', {1, 2, 3})
+    monkeypatch.setattr(db.misc, 'set', lambda key, value: db_writes.append(value))
+    monkeypatch.setattr(discord, 'Message', mock_message)
+    message = discord.Message('', MockChannel(970380662907482142), MockUser())
+
+    for project_name in ("A", "B", "C"):
+        await main.set_status(message, project_name)
+
+    await asyncio.sleep(0.05)
+    assert main.client.presences == ["3 TAS projects, last processed post from Kataiser in \"C\""]
+
+    for project_name in ("D", "E"):
+        await main.set_status(message, project_name)
+
+    await asyncio.sleep(0.05)
+    assert len(main.client.presences) == 1
+    await asyncio.sleep(0.25)
+    assert main.client.presences[1] == "3 TAS projects, last processed post from Kataiser in \"E\""
+    assert db_writes == main.client.presences
+
+
+def test_stage_contributors(setup_log, monkeypatch):
+    downloads = []
+
+    def mock_get(url: str, **kwargs) -> MockResponse:
+        downloads.append(kwargs['params']['ref'])
+        return MockResponse(200, {'sha': 'blob1', 'content': base64.b64encode(b'Kataiser\nVamp').decode('UTF8')})
+
+    project = {'project_id': 970380662907482142, 'repo': 'Kataiser/improvements-bot-testing', 'subdir': '', 'contributors_file_path': ''}
+    contributors = {'219955313334288385': {'name': "Kataiser", 'count': 5}}
+    monkeypatch.setattr(main.github, 'get', mock_get)
+    monkeypatch.setattr(db.contributors, 'get', lambda *args, **kwargs: contributors)
+    monkeypatch.setattr(main, 'contributors_files', {})
+    commit_builder = github.CommitBuilder(project['repo'], {})
+    assert main.stage_contributors(970380662907482142, project, commit_builder, 'head1', 'tree1') is None
+    assert main.stage_contributors(970380662907482142, project, commit_builder, 'head1', 'tree1') is None
+    assert downloads == ['head1']
+    assert commit_builder.files == {}
+
+    # new contributor goes in the same commit, and the cache follows the commit
+    contributors['234520815658336258'] = {'name': "Soloiini", 'count': 1}
+    assert main.stage_contributors(970380662907482142, project, commit_builder, 'head1', 'tree1') == "Added Soloiini to Contributors.txt"
+    assert commit_builder.files == {'Contributors.txt': b'Kataiser\nSoloiini\nVamp'}
+    commit_builder.blob_shas['Contributors.txt'] = 'blob2'
+    main.contributors_committed(970380662907482142, commit_builder, {'tree': {'sha': 'tree2'}})
+    assert main.contributors_files[970380662907482142] == main.ContributorsFile('Contributors.txt', 'tree2', 'blob2', {'Kataiser', 'Soloiini', 'Vamp'})
+    commit_builder = github.CommitBuilder(project['repo'], {})
+    assert main.stage_contributors(970380662907482142, project, commit_builder, 'head2', 'tree2') is None
+    assert downloads == ['head1']
+
+
+# BLOB CACHE
+
+def test_blob_cache(setup_log, monkeypatch, tmp_path):
+    monkeypatch.setattr(blob_cache, 'cache_dir', tmp_path)
+    monkeypatch.setattr(blob_cache, 'index_loaded', None)
+    monkeypatch.setattr(blob_cache, 'max_size', 10)
+    assert blob_cache.blob_sha(b'hello\n') == 'ce013625030ba8dba906f756967f9e9ca394464a'
+    assert blob_cache.get_attachment('https://cdn.discordapp.com/attachments/1/2/a.tas?ex=1&is=2&hm=3') is None
+    blob_cache.put_attachment('https://cdn.discordapp.com/attachments/1/2/a.tas?ex=1&is=2&hm=3', b'hello\n')
+    assert blob_cache.get_attachment('https://cdn.discordapp.com/attachments/1/2/a.tas?ex=4&is=5&hm=6') == b'hello\n'
+    assert blob_cache.put_blob(b'hello\n') == 'ce013625030ba8dba906f756967f9e9ca394464a'
+    assert (tmp_path / 'ce013625030ba8dba906f756967f9e9ca394464a').read_bytes() == b'hello\n'
+    assert len(list(tmp_path.iterdir())) == 2  # blob and index
+
+    # still there after reloading
+    monkeypatch.setattr(blob_cache, 'index_loaded', None)
+    assert blob_cache.get_blob('ce013625030ba8dba906f756967f9e9ca394464a') == b'hello\n'
+    assert blob_cache.get_blob('0000000000000000000000000000000000000000') is None
+
+    # over the size cap, least recently used goes first
+    blob_cache.put_attachment('https://cdn.discordapp.com/attachments/1/2/b.tas', b'world\n')
+    assert blob_cache.get_attachment('https://cdn.discordapp.com/attachments/1/2/a.tas') is None
+    assert blob_cache.get_attachment('https://cdn.discordapp.com/attachments/1/2/b.tas') == b'world\n'
+
+
 # GEN TOKEN
 
 def test_generate_jwt(setup_log):
@@ -252,6 +570,124 @@ def test_access_token():
     assert token == token2
 
 
+# GITHUB
+
+def test_commit_builder_retry(setup_log, monkeypatch):
+    heads = ['head1', 'head2']
+    requests = []
+
+    def mock_request(method: str, url: str, **kwargs) -> MockResponse:
+        requests.append((method, url))
+
+        if method == 'GET' and url.endswith('/git/ref/heads/main'):
+            return MockResponse(200, {'object': {'sha': heads[0]}})
+        elif method == 'GET':
+            return MockResponse(200, {'sha': url.rpartition('/')[2], 'tree': {'sha': f"tree_{url.rpartition('/')[2]}"}})
+        elif method == 'POST':
+            return MockResponse(201, {'sha': f"{url.rpartition('/')[2]}_{len(requests)}", 'html_url': 'url', **orjson.loads(kwargs['data'])})
+        elif len(heads) > 1:  # someone else committed first
+            heads.pop(0)
+            return MockResponse(422, {'message': "Update is not a fast forward"})
+        else:
+            return MockResponse(200, {})
+
+    monkeypatch.setattr(github.niquests, 'request', mock_request)
+    monkeypatch.setitem(github.default_branches, 'Kataiser/improvements-bot-testing', 'main')
+    commit_builder = github.CommitBuilder('Kataiser/improvements-bot-testing', {})
+    commit_builder.add_file('a.tas', b'a')
+    commit_builder.add_file('subproject/b.tas', b'b')
+    commit_builder.add_file('Contributors.txt', b'Kataiser')
+    new_commit = commit_builder.commit("Updated 2 files from Kataiser")
+    assert new_commit['parents'] == ['head2']
+    assert new_commit['tree'].startswith('trees_')
+    assert len([r for r in requests if r[1].endswith('/git/blobs')]) == 3
+    assert len([r for r in requests if r[1].endswith('/git/trees')]) == 2
+    assert len([r for r in requests if r[0] == 'PATCH']) == 2
+
+
+def test_commit_queue(setup_log, monkeypatch):
+    active_commits = []
+    max_active_commits = []
+    trees = []
+
+    def mock_request(method: str, url: str, **kwargs) -> MockResponse:
+        if url.endswith('/git/ref/heads/main'):
+            active_commits.append(url)
+            max_active_commits.append(len(active_commits))
+            return MockResponse(200, {'object': {'sha': 'head'}})
+        elif method == 'GET':
+            return MockResponse(200, {'sha': 'head', 'tree': {'sha': 'tree'}})
+        elif method == 'POST':
+            if url.endswith('/git/trees'):
+                trees.append(orjson.loads(kwargs['data'])['tree'])
+
+            time.sleep(0.05)
+            return MockResponse(201, {'sha': 'sha', 'html_url': 'url'})
+        else:
+            active_commits.pop()
+            return MockResponse(200, {})
+
+    monkeypatch.setattr(github.niquests, 'request', mock_request)
+    monkeypatch.setitem(github.default_branches, 'Kataiser/improvements-bot-testing', 'main')
+    monkeypatch.setattr(github, 'commit_latencies', {})
+    commit_builders = [github.CommitBuilder('Kataiser/improvements-bot-testing', {}) for _ in range(2)]
+    commit_builders[0].add_file('a.tas', b'a')
+    commit_builders[1].delete_file('a.tas')
+    commit_builders[1].add_file('b.tas', b'a')
+    threads = [threading.Thread(target=commit_builder.commit, args=("Renamed a.tas to b.tas",)) for commit_builder in commit_builders]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    assert max(max_active_commits) == 1
+    assert len(github.commit_latencies['Kataiser/improvements-bot-testing']) == 2
+    assert github.commit_latency('Kataiser/improvements-bot-testing')[1] >= 0.1
+    assert {'path': 'a.tas', 'mode': '100644', 'type': 'blob', 'sha': None} in max(trees, key=len)
+
+
+def test_rate_limit_priority(setup_log, monkeypatch):
+    reset_time = int(time.time()) + 600
+    remaining = [150]
+
+    def mock_request(method: str, url: str, **kwargs) -> MockResponse:
+        remaining[0] -= 1
+        return MockResponse(200, {}, {'X-RateLimit-Remaining': str(remaining[0]), 'X-RateLimit-Limit': '5000', 'X-RateLimit-Reset': str(reset_time)})
+
+    monkeypatch.setattr(github.niquests, 'request', mock_request)
+    monkeypatch.setattr(github, 'rate_limit_buckets', {})
+    monkeypatch.setattr(github, 'installation_names', {})
+    headers = {'Authorization': 'Bearer ghs_test'}
+    github.name_installation(headers, 'Kataiser')
+    github.get('https://api.github.com/repos/Kataiser/improvements-bot-testing', github.Priority.BACKGROUND, headers=headers)
+    assert github.rate_limit_buckets['Kataiser'].remaining == 149
+
+    # background requests stop at the reserve (500 for a 5000 limit), user requests don't
+    with pytest.raises(github.RateLimitedError):
+        github.get('https://api.github.com/repos/Kataiser/improvements-bot-testing', github.Priority.BACKGROUND, headers=headers)
+
+    assert github.get('https://api.github.com/repos/Kataiser/improvements-bot-testing', headers=headers).status_code == 200
+    assert remaining[0] == 148
+
+    # secondary rate limits block everything
+    monkeypatch.setattr(github.niquests, 'request', lambda *args, **kwargs: MockResponse(403, {'message': "You have exceeded a secondary rate limit"}, {'Retry-After': '60'}))
+    with pytest.raises(github.RateLimitedError):
+        github.get('https://api.github.com/repos/Kataiser/improvements-bot-testing', headers=headers)
+
+    assert github.rate_limit_buckets['Kataiser'].is_blocked()
+
+    # short waits are fine, and requests from the event loop still go through (with a warning)
+    async def get_on_event_loop():
+        return github.get('https://api.github.com/repos/Kataiser/improvements-bot-testing', headers=headers)
+
+    monkeypatch.setattr(github.niquests, 'request', mock_request)
+    github.rate_limit_buckets['Kataiser'].blocked_until = time.time() + 0.2
+    assert asyncio.run(asyncio.to_thread(github.get, 'https://api.github.com/repos/Kataiser/improvements-bot-testing', headers=headers)).status_code == 200
+    assert asyncio.run(get_on_event_loop()).status_code == 200
+
+
 # VALIDATION
 
 def test_validate(setup_log, monkeypatch):
@@ -269,19 +705,27 @@ def test_validate(setup_log, monkeypatch):
     monkeypatch.setattr(db.path_caches, 'get', mock_path_caches_get)
     ehs_valid = Path('test_tases\\expert_heartside.tas').read_bytes()
     ehs_old = Path('test_tases\\expert_heartside_old.tas').read_bytes()
+    ehs_rooms_changed = {'a00_intro2': -2, 'a01_jackal': -9, 'a02_skunkynator': 3, 'a03_pansear': -2, 'a04_agent': -40, 'a05_flamecrafter': -31, 'b00_intro': -9,
+                         'b01_stotch': 2, 'b02_alt_alt': 0, 'b02_nyan': -32, 'b02_alt': -1, 'b03_banana': 21, 'b04_powerav': -30, 'b06_transition': 2, 'c00_intro': 1,
+                         'c01_redboule': -3, 'c02_moladan': -1, 'c03_alice': 1, 'c04_fonda': -2, 'd00_intro': -10, 'd01_ru': -111, 'd02_lethargicdoggo': -41, 'd03_appels': 2,
+                         'e04_scroogle': 1, 'e06_transition': 1, 'f02.5_xolimono': -1, 'f03_hivemindsrule': -13, 'f04_alt': 0, 'f07_introcar': 0, 'f07_and_you': -4}
     mock_kataiser = MockUser(219955313334288385, "Kataiser", "kataiser")
     message = discord.Message("-229f Expert Heartside (7:54.929)", MockChannel(970380662907482142), mock_kataiser)
 
-    result_valid = validation.ValidationResult(valid_tas=True, warning_text=[], log_text=[], finaltime='7:54.929', timesave='-229f', finaltime_frames=27937)
+    result_valid = validation.ValidationResult(valid_tas=True, warning_text=[], log_text=[], finaltime='7:54.929', timesave='-229f', finaltime_frames=27937,
+                                              rooms_changed=ehs_rooms_changed)
     assert validation.validate(ehs_valid, 'expert_heartside.tas', message, ehs_old, test_project, False) == result_valid
 
     message_draft = discord.Message("Expert Heartside draft in 7:54.929", MockChannel(970380662907482142), mock_kataiser)
     result_valid_draft = validation.ValidationResult(valid_tas=True, warning_text=[], log_text=[], finaltime='7:54.929', finaltime_frames=27937)
     assert validation.validate(ehs_valid, 'expert_heartside.tas', message_draft, None, test_project, False) == result_valid_draft
 
-    result_too_big = validation.ValidationResult(valid_tas=False, warning_text=["This TAS file is very large (265.5 KB). For safety, it won't be processed."],
-                                                 log_text=["expert_heartside.tas being too long (271883 bytes)"])
-    assert validation.validate(Path('test_tases\\invalids\\ehs_too_big.tas').read_bytes(), 'expert_heartside.tas', message, None, test_project, False) == result_too_big
+    # large files are validated in streaming mode, which has no room changes
+    ehs_big = Path('test_tases\\invalids\\ehs_too_big.tas').read_bytes()
+    assert validation.validate(ehs_big, 'expert_heartside.tas', message, ehs_old, test_project, False) == dataclasses.replace(result_valid, rooms_changed=None)
+    result_too_big = validation.ValidationResult(valid_tas=False, warning_text=["This TAS file is very large (4248.2 KB). For safety, it won't be processed."],
+                                                 log_text=["expert_heartside.tas being too long (4350128 bytes)"])
+    assert validation.validate(ehs_big * 16, 'expert_heartside.tas', message, None, test_project, False) == result_too_big
 
     test_project['excluded_items'] = ('expert_heartside.tas',)
     result_excluded = validation.ValidationResult(valid_tas=False, warning_text=["This filename is excluded from the project."],
@@ -452,19 +896,23 @@ def test_validate(setup_log, monkeypatch):
     assert validation.validate(Path('test_tases\\sailorsbreak.tas').read_bytes(), 'sailorsbreak.tas', message, None, test_project, False) == result_space_start
 
     message_no_timesave = discord.Message("Expert Heartside (7:54.929)", MockChannel(), mock_kataiser)
-    result_no_timesave = validation.ValidationResult(valid_tas=False, finaltime='7:54.929', finaltime_frames=27937,
-                                                     warning_text=["Please mention how many frames were saved or lost, with the text \"-229f\" (if that's correct), and post again."],
+    result_no_timesave = validation.ValidationResult(valid_tas=False, finaltime='7:54.929', finaltime_frames=27937, rooms_changed=ehs_rooms_changed,
+                                                     warning_text=["Please mention how many frames were saved or lost, with the text \"-229f\" (if that's correct), and post again. "
+                                                                   "Rooms changed: a00_intro2 (-2f), a01_jackal (-9f), a02_skunkynator (+3f), a03_pansear (-2f), a04_agent (-40f), "
+                                                                   "a05_flamecrafter (-31f), b00_intro (-9f), b01_stotch (+2f), b02_alt_alt, b02_nyan (-32f), and 20 more."],
                                                      log_text=["no timesave in message (should be -229f)"])
     assert validation.validate(ehs_valid, 'expert_heartside.tas', message_no_timesave, ehs_old, test_project, False) == result_no_timesave
 
     message_wrong_timesave = discord.Message("-666f Expert Heartside (7:54.929)", MockChannel(), mock_kataiser)
-    result_wrong_timesave = validation.ValidationResult(valid_tas=False, finaltime='7:54.929', finaltime_frames=27937, timesave='-666f',
+    result_wrong_timesave = validation.ValidationResult(valid_tas=False, finaltime='7:54.929', finaltime_frames=27937, timesave='-666f', rooms_changed=ehs_rooms_changed,
                                                         warning_text=["Frames saved is incorrect (you said \"-666f\", but it seems to be \"-229f\"), please fix and post again. Make sure "
-                                                                      "you updated the time and improved the latest version of the file."],
+                                                                      "you updated the time and improved the latest version of the file. Rooms changed: a00_intro2 (-2f), "
+                                                                      "a01_jackal (-9f), a02_skunkynator (+3f), a03_pansear (-2f), a04_agent (-40f), a05_flamecrafter (-31f), b00_intro (-9f), "
+                                                                      "b01_stotch (+2f), b02_alt_alt, b02_nyan (-32f), and 20 more."],
                                                         log_text=["incorrect time saved in message (is \"-666f\", should be \"-229f\")"])
     assert validation.validate(ehs_valid, 'expert_heartside.tas', message_wrong_timesave, ehs_old, test_project, False) == result_wrong_timesave
 
-    result_wrong_timesave_options = validation.ValidationResult(valid_tas=False, finaltime='7:54.929', finaltime_frames=27937, timesave='-229f',
+    result_wrong_timesave_options = validation.ValidationResult(valid_tas=False, finaltime='7:54.929', finaltime_frames=27937, timesave='-229f', rooms_changed={},
                                                                 warning_text=["Frames saved is incorrect (you said \"-229f\", but it seems to be \"-0f\" or \"+0f\"), please fix and post "
                                                                               "again. Make sure you updated the time and improved the latest version of the file."],
                                                                 log_text=["incorrect time saved in message (is \"-229f\", should be \"-0f\" or \"+0f\")"])
@@ -476,23 +924,26 @@ def test_validate(setup_log, monkeypatch):
                                                                 "again. If it shouldn't be a draft, make sure your filename is exactly the same as in the repo (did you mean "
                                                                 "`grandmaster_heartside.tas`?).", "The level name is missing in your message, please add it and post again."],
                                                   log_text=["no \"draft\" text in message", "level name ['grandmasterheartside2'] missing in message content"])
-    assert validation.validate(ehs_valid, 'grandmaster_heartside2.tas', message, None, test_project, False) == result_no_draft
+    possible_filename = validation.draft_possible_filename('grandmaster_heartside2.tas', None, message.channel.id)
+    assert validation.validate(ehs_valid, 'grandmaster_heartside2.tas', message, None, test_project, False, possible_filename=possible_filename) == result_no_draft
 
     message_no_levelname = discord.Message("-229f (7:54.929)", MockChannel(), mock_kataiser)
-    result_no_levelname = validation.ValidationResult(valid_tas=False, finaltime='7:54.929', finaltime_frames=27937, timesave='-229f',
+    result_no_levelname = validation.ValidationResult(valid_tas=False, finaltime='7:54.929', finaltime_frames=27937, timesave='-229f', rooms_changed=ehs_rooms_changed,
                                                       warning_text=["The level name is missing in your message, please add it and post again."],
                                                       log_text=["level name ['expertheartside'] missing in message content"])
     assert validation.validate(ehs_valid, 'expert_heartside.tas', message_no_levelname, ehs_old, test_project, False) == result_no_levelname
 
     test_project['project_id'] = 598945702554501130
     message_maingame_levelname = discord.Message("-0f Farewell 8:04.177(28481)", MockChannel(), mock_kataiser)
-    result_maingame_levelname = validation.ValidationResult(valid_tas=True, finaltime='8:04.177', finaltime_frames=28481, timesave='-0f', warning_text=[], log_text=[])
+    result_maingame_levelname = validation.ValidationResult(valid_tas=True, finaltime='8:04.177', finaltime_frames=28481, timesave='-0f', warning_text=[], log_text=[],
+                                                            rooms_changed={'e-00yb': 1, 'e-02': -1})
     farewell = Path('test_tases\\9.tas').read_bytes()
     farewell_prev = Path('test_tases\\9_prev.tas').read_bytes()
     assert validation.validate(farewell, '9.tas', message_maingame_levelname, farewell_prev, test_project, False) == result_maingame_levelname
 
     message_maingame_levelname2 = discord.Message("-1f 4SH (3:24.867 → 3:24.850)", MockChannel(), mock_kataiser)
-    result_maingame_levelname2 = validation.ValidationResult(valid_tas=True, finaltime='3:24.850', finaltime_frames=12050, timesave='-1f', warning_text=[], log_text=[])
+    result_maingame_levelname2 = validation.ValidationResult(valid_tas=True, finaltime='3:24.850', finaltime_frames=12050, timesave='-1f', warning_text=[], log_text=[],
+                                                             rooms_changed={'a-05': -1, 'd-10': 0})
     ridge_sh = Path('test_tases\\4SH0.tas').read_bytes()
     ridge_sh_prev = Path('test_tases\\4SH0_prev.tas').read_bytes()
     assert validation.validate(ridge_sh, '4SH0.tas', message_maingame_levelname2, ridge_sh_prev, test_project, False) == result_maingame_levelname2
@@ -500,62 +951,62 @@ def test_validate(setup_log, monkeypatch):
 
 def test_parse_tas_file(setup_log):
     test_tases = [('0_-_All_C_Sides.tas', 71,
-                   validation.ParsedTASFile(breakpoints=[], found_finaltime=True, finaltime='2:43.659', finaltime_trimmed='2:43.659',
-                                            finaltime_line_num=70, finaltime_frames=9627, finaltime_type=validation.FinalTimeTypes.File)),
+                   validation.ParsedTASFile(breakpoints=[], found_finaltime=True, finaltime=validation.FrameTime('2:43.659', 9627),
+                                            finaltime_line_num=70, finaltime_type=validation.FinalTimeTypes.File)),
                   ('6AC.tas', 308,
-                   validation.ParsedTASFile(breakpoints=[], found_finaltime=True, finaltime='47.600', finaltime_trimmed='47.600',
-                                            finaltime_line_num=305, finaltime_frames=2800, finaltime_type=validation.FinalTimeTypes.Comment)),
+                   validation.ParsedTASFile(breakpoints=[], found_finaltime=True, finaltime=validation.FrameTime('47.600', 2800),
+                                            finaltime_line_num=305, finaltime_type=validation.FinalTimeTypes.Comment)),
                   ('0oi71n.tas', 501,
-                   validation.ParsedTASFile(breakpoints=[], found_finaltime=True, finaltime='1:08.748', finaltime_trimmed='1:08.748',
-                                            finaltime_line_num=498, finaltime_frames=4044, finaltime_type=validation.FinalTimeTypes.Chapter)),
+                   validation.ParsedTASFile(breakpoints=[], found_finaltime=True, finaltime=validation.FrameTime('1:08.748', 4044),
+                                            finaltime_line_num=498, finaltime_type=validation.FinalTimeTypes.Chapter)),
                   ('0oi71n 2.tas', 501,
-                   validation.ParsedTASFile(breakpoints=[], found_finaltime=True, finaltime='1:08.748', finaltime_trimmed='1:08.748',
-                                            finaltime_line_num=498, finaltime_frames=4044, finaltime_type=validation.FinalTimeTypes.Chapter)),
+                   validation.ParsedTASFile(breakpoints=[], found_finaltime=True, finaltime=validation.FrameTime('1:08.748', 4044),
+                                            finaltime_line_num=498, finaltime_type=validation.FinalTimeTypes.Chapter)),
                   ('1k_Kataiser.tas', 250,
-                   validation.ParsedTASFile(breakpoints=[], found_finaltime=True, finaltime='0:46.308', finaltime_trimmed='46.308',
-                                            finaltime_line_num=249, finaltime_frames=2724, finaltime_type=validation.FinalTimeTypes.Comment)),
+                   validation.ParsedTASFile(breakpoints=[], found_finaltime=True, finaltime=validation.FrameTime('0:46.308', 2724),
+                                            finaltime_line_num=249, finaltime_type=validation.FinalTimeTypes.Comment)),
                   ('5C_TPH.tas', 110,
-                   validation.ParsedTASFile(breakpoints=[], found_finaltime=True, finaltime='0:33.745', finaltime_trimmed='33.745',
-                                            finaltime_line_num=108, finaltime_frames=1985, finaltime_type=validation.FinalTimeTypes.Chapter)),
+                   validation.ParsedTASFile(breakpoints=[], found_finaltime=True, finaltime=validation.FrameTime('0:33.745', 1985),
+                                            finaltime_line_num=108, finaltime_type=validation.FinalTimeTypes.Chapter)),
                   ('abby-cookie.tas', 28,
-                   validation.ParsedTASFile(breakpoints=[], found_finaltime=True, finaltime='2.108', finaltime_trimmed='2.108',
-                                            finaltime_line_num=27, finaltime_frames=124, finaltime_type=validation.FinalTimeTypes.Comment)),
+                   validation.ParsedTASFile(breakpoints=[], found_finaltime=True, finaltime=validation.FrameTime('2.108', 124),
+                                            finaltime_line_num=27, finaltime_type=validation.FinalTimeTypes.Comment)),
                   ('expert_heartside.tas', 3576,
-                   validation.ParsedTASFile(breakpoints=[], found_finaltime=True, finaltime='7:54.929', finaltime_trimmed='7:54.929',
-                                            finaltime_line_num=3575, finaltime_frames=27937, finaltime_type=validation.FinalTimeTypes.Chapter)),
+                   validation.ParsedTASFile(breakpoints=[], found_finaltime=True, finaltime=validation.FrameTime('7:54.929', 27937),
+                                            finaltime_line_num=3575, finaltime_type=validation.FinalTimeTypes.Chapter)),
                   ('deskilln-deathkontrol.tas', 158,
-                   validation.ParsedTASFile(breakpoints=[], found_finaltime=True, finaltime='12.699', finaltime_trimmed='12.699',
-                                            finaltime_line_num=157, finaltime_frames=747, finaltime_type=validation.FinalTimeTypes.Comment)),
+                   validation.ParsedTASFile(breakpoints=[], found_finaltime=True, finaltime=validation.FrameTime('12.699', 747),
+                                            finaltime_line_num=157, finaltime_type=validation.FinalTimeTypes.Comment)),
                   ('drifting_deep.tas', 1029,
-                   validation.ParsedTASFile(breakpoints=[], found_finaltime=True, finaltime='2:44.662', finaltime_trimmed='2:44.662',
-                                            finaltime_line_num=1028, finaltime_frames=9686, finaltime_type=validation.FinalTimeTypes.Chapter)),
+                   validation.ParsedTASFile(breakpoints=[], found_finaltime=True, finaltime=validation.FrameTime('2:44.662', 9686),
+                                            finaltime_line_num=1028, finaltime_type=validation.FinalTimeTypes.Chapter)),
                   ('temple_of_a_thousand_skies.tas', 395,
-                   validation.ParsedTASFile(breakpoints=[], found_finaltime=True, finaltime='2:22.392', finaltime_trimmed='2:22.392',
-                                            finaltime_line_num=394, finaltime_frames=8376, finaltime_type=validation.FinalTimeTypes.Chapter)),
+                   validation.ParsedTASFile(breakpoints=[], found_finaltime=True, finaltime=validation.FrameTime('2:22.392', 8376),
+                                            finaltime_line_num=394, finaltime_type=validation.FinalTimeTypes.Chapter)),
                   ('pufferfish_transportation.tas', 466,
-                   validation.ParsedTASFile(breakpoints=[], found_finaltime=True, finaltime='1:26.377', finaltime_trimmed='1:26.377',
-                                            finaltime_line_num=465, finaltime_frames=5081, finaltime_type=validation.FinalTimeTypes.Chapter)),
+                   validation.ParsedTASFile(breakpoints=[], found_finaltime=True, finaltime=validation.FrameTime('1:26.377', 5081),
+                                            finaltime_line_num=465, finaltime_type=validation.FinalTimeTypes.Chapter)),
                   ('royal_gardens.tas', 985,
-                   validation.ParsedTASFile(breakpoints=[], found_finaltime=True, finaltime='2:34.853', finaltime_trimmed='2:34.853',
-                                            finaltime_line_num=984, finaltime_frames=9109, finaltime_type=validation.FinalTimeTypes.Chapter)),
+                   validation.ParsedTASFile(breakpoints=[], found_finaltime=True, finaltime=validation.FrameTime('2:34.853', 9109),
+                                            finaltime_line_num=984, finaltime_type=validation.FinalTimeTypes.Chapter)),
                   ('sky_palace.tas', 645,
-                   validation.ParsedTASFile(breakpoints=[], found_finaltime=True, finaltime='1:29.879', finaltime_trimmed='1:29.879',
-                                            finaltime_line_num=644, finaltime_frames=5287, finaltime_type=validation.FinalTimeTypes.Chapter)),
+                   validation.ParsedTASFile(breakpoints=[], found_finaltime=True, finaltime=validation.FrameTime('1:29.879', 5287),
+                                            finaltime_line_num=644, finaltime_type=validation.FinalTimeTypes.Chapter)),
                   ('undergrowth.tas', 618,
-                   validation.ParsedTASFile(breakpoints=[], found_finaltime=True, finaltime='1:34.333', finaltime_trimmed='1:34.333',
-                                            finaltime_line_num=617, finaltime_frames=5549, finaltime_type=validation.FinalTimeTypes.Chapter)),
+                   validation.ParsedTASFile(breakpoints=[], found_finaltime=True, finaltime=validation.FrameTime('1:34.333', 5549),
+                                            finaltime_line_num=617, finaltime_type=validation.FinalTimeTypes.Chapter)),
                   ('the_lab.tas', 751,
-                   validation.ParsedTASFile(breakpoints=[], found_finaltime=True, finaltime='1:32.497', finaltime_trimmed='1:32.497',
-                                            finaltime_line_num=750, finaltime_frames=5441, finaltime_type=validation.FinalTimeTypes.Chapter)),
+                   validation.ParsedTASFile(breakpoints=[], found_finaltime=True, finaltime=validation.FrameTime('1:32.497', 5441),
+                                            finaltime_line_num=750, finaltime_type=validation.FinalTimeTypes.Chapter)),
                   ('The_Mines_Kataiser.tas', 238,
-                   validation.ParsedTASFile(breakpoints=[], found_finaltime=True, finaltime='0:39.321', finaltime_trimmed='39.321',
-                                            finaltime_line_num=237, finaltime_frames=2313, finaltime_type=validation.FinalTimeTypes.Chapter)),
+                   validation.ParsedTASFile(breakpoints=[], found_finaltime=True, finaltime=validation.FrameTime('0:39.321', 2313),
+                                            finaltime_line_num=237, finaltime_type=validation.FinalTimeTypes.Chapter)),
                   ('glitchy\\glitchy.tas', 684,
-                   validation.ParsedTASFile(breakpoints=[], found_finaltime=True, finaltime='0:47.651', finaltime_trimmed='47.651',
-                                            finaltime_line_num=683, finaltime_frames=2803, finaltime_type=validation.FinalTimeTypes.Chapter)),
+                   validation.ParsedTASFile(breakpoints=[], found_finaltime=True, finaltime=validation.FrameTime('0:47.651', 2803),
+                                            finaltime_line_num=683, finaltime_type=validation.FinalTimeTypes.Chapter)),
                   ('3H.tas', 466,
-                   validation.ParsedTASFile(breakpoints=[], found_finaltime=True, finaltime='2:53.519', finaltime_trimmed='2:53.519',
-                                            finaltime_line_num=465, finaltime_frames=10207, finaltime_type=validation.FinalTimeTypes.Chapter))]
+                   validation.ParsedTASFile(breakpoints=[], found_finaltime=True, finaltime=validation.FrameTime('2:53.519', 10207),
+                                            finaltime_line_num=465, finaltime_type=validation.FinalTimeTypes.Chapter))]
 
     for test_tas in test_tases:
         print(test_tas[0])
@@ -567,25 +1018,168 @@ def test_parse_tas_file(setup_log):
     print(custom_test_tas)
     lines = validation.as_lines(Path(f'test_tases\\{custom_test_tas}').read_bytes())
     assert len(lines) == 466
-    expected_parsed = validation.ParsedTASFile(breakpoints=[], found_finaltime=True, finaltime='1:26.717', finaltime_trimmed='1:26.717',
-                                               finaltime_line_num=279, finaltime_frames=5101, finaltime_type=validation.FinalTimeTypes.MidwayChapter)
+    expected_parsed = validation.ParsedTASFile(breakpoints=[], found_finaltime=True, finaltime=validation.FrameTime('1:26.717', 5101),
+                                               finaltime_line_num=279, finaltime_type=validation.FinalTimeTypes.MidwayChapter)
     assert validation.parse_tas_file(lines, True, required_finaltime_type=validation.FinalTimeTypes.MidwayChapter) == expected_parsed
 
     custom_test_tas = 'Caper_Cavortion.tas'
     print(custom_test_tas)
     lines = validation.as_lines(Path(f'test_tases\\{custom_test_tas}').read_bytes())
     assert len(lines) == 304
-    expected_parsed = validation.ParsedTASFile(breakpoints=['287'], found_finaltime=True, finaltime='1:26.071', finaltime_trimmed='1:26.071',
-                                               finaltime_line_num=298, finaltime_frames=5063, finaltime_type=validation.FinalTimeTypes.Comment)
+    expected_parsed = validation.ParsedTASFile(breakpoints=['287'], found_finaltime=True, finaltime=validation.FrameTime('1:26.071', 5063),
+                                               finaltime_line_num=298, finaltime_type=validation.FinalTimeTypes.Comment)
     assert validation.parse_tas_file(lines, True) == expected_parsed
-    expected_parsed = validation.ParsedTASFile(breakpoints=[], found_finaltime=True, finaltime='1:26.071', finaltime_trimmed='1:26.071',
-                                               finaltime_line_num=298, finaltime_frames=5063, finaltime_type=validation.FinalTimeTypes.Comment)
+    expected_parsed = validation.ParsedTASFile(breakpoints=[], found_finaltime=True, finaltime=validation.FrameTime('1:26.071', 5063),
+                                               finaltime_line_num=298, finaltime_type=validation.FinalTimeTypes.Comment)
     assert validation.parse_tas_file(lines, False) == expected_parsed
-    expected_parsed = validation.ParsedTASFile(breakpoints=['287'], found_finaltime=False, finaltime=None, finaltime_trimmed=None,
-                                               finaltime_line_num=None, finaltime_frames=None, finaltime_type=None)
+    expected_parsed = validation.ParsedTASFile(breakpoints=['287'], found_finaltime=False, finaltime=None,
+                                               finaltime_line_num=None, finaltime_type=None)
     assert validation.parse_tas_file(lines, True, allow_comment_time=False) == expected_parsed
 
 
+def test_tokenize_tas(setup_log):
+    lines = validation.as_lines(Path('test_tases\\abby-cookie.tas').read_bytes())
+    tas_tokens = validation.tokenize_tas(lines)
+    line_type = validation.LineType
+    assert list(tas_tokens.types[:8]) == [line_type.COMMAND, line_type.INPUT, line_type.EMPTY, line_type.START, line_type.INPUT, line_type.EMPTY, line_type.ROOM_LABEL, line_type.INPUT]
+    assert tas_tokens.types[27] == line_type.FINAL_TIME
+    assert tas_tokens.commands == {0: ['console', 'load', 'SpringCollab2020/0-Lobbies/1-Beginner', '3192', '160']}
+    assert tas_tokens.finaltimes == {27: validation.FinalTimeTypes.Comment}
+    assert tas_tokens.lines_of_type(line_type.ROOM_LABEL) == [6]
+    assert tas_tokens.find_command('console') == ['console', 'load', 'SpringCollab2020/0-Lobbies/1-Beginner', '3192', '160']
+    assert tas_tokens.find_command('RecordCount:') is None
+
+    tas_tokens = validation.tokenize_tas(['Read,file,start', 'RecordCount: 12', '  5,R***', '#comment', 'ChapterTime: 0:12.699(747)'])
+    assert list(tas_tokens.types) == [line_type.COMMAND, line_type.COMMAND, line_type.BREAKPOINT, line_type.COMMENT, line_type.FINAL_TIME]
+    assert tas_tokens.find_command('RecordCount:') == ['RecordCount:', '12']
+    assert tas_tokens.breakpoints == [2]
+    assert tas_tokens.finaltimes == {4: validation.FinalTimeTypes.Chapter}
+
+
+def test_parse_tas_cached(setup_log):
+    tas = Path('test_tases\\Caper_Cavortion.tas').read_bytes()
+    validation.parsed_tas_cache.clear()
+    validation.tokenized_tas_cache.clear()
+    tas_parsed, tas_tokens = validation.parse_tas_cached(tas, True)
+    assert tas_parsed == validation.parse_tas_file(validation.as_lines(tas), True)
+    assert tas_tokens.lines == validation.as_lines(tas)
+    hits = validation.parsed_tas_cache.hits
+    assert validation.parse_tas_cached(tas, True) == (tas_parsed, tas_tokens)
+    assert validation.parse_tas_cached(tas, True)[0] is tas_parsed
+    assert validation.parsed_tas_cache.hits == hits + 2
+
+    tas_parsed_no_comment_time, tas_tokens_no_comment_time = validation.parse_tas_cached(tas, True, allow_comment_time=False)
+    assert tas_tokens_no_comment_time is tas_tokens
+    assert not tas_parsed_no_comment_time.found_finaltime
+    assert validation.parse_tas_cached(tas + b'\n# 1:00.000', True)[0].finaltime == validation.FrameTime('1:00.000', 3529)
+
+    validation.parsed_tas_cache.max_size = 2
+    validation.parse_tas_cached(tas, False)
+    assert len(validation.parsed_tas_cache.items) == 2
+    validation.parsed_tas_cache.max_size = 256
+
+
+def test_diff_lines():
+    old_lines = ['#Start', '#lvl_a', '1,R', '2,J', '#lvl_b', '3,L', '4,D', '#lvl_c', '5,X']
+    new_lines = ['#Start', '#lvl_a', '1,R', '2,J', '#lvl_b', '3,L', '1,U', '4,D', '#lvl_c']
+    unchanged_lines, changed_lines = validation.diff_lines(old_lines, new_lines)
+    assert unchanged_lines == {0: 0, 1: 1, 2: 2, 3: 3, 4: 4, 5: 5, 7: 6, 8: 7}
+    assert changed_lines == {6, 8}
+    assert validation.diff_lines(old_lines, old_lines) == ({line_num: line_num for line_num in range(9)}, set())
+
+
+def test_diff_tas(setup_log):
+    old_lines = ['console load 1', '#Start', '#lvl_a', '1,R', '2,J', '#lvl_b', '3,L', 'Repeat,2', '4,D', 'EndRepeat', '#lvl_a', '5,X', '#lvl_c', '6', '#lvl_d', '7']
+    new_lines = ['console load 1', '#Start', '#lvl_a', '1,R', '2,J', '#lvl_b', '3,L', 'Repeat,3', '4,D', 'EndRepeat', '2,U', '#lvl_a', '1,X', '#lvl_c', '6', '#lvl_e', '8']
+    tas_diff = validation.diff_tas(validation.tokenize_tas(old_lines), validation.tokenize_tas(new_lines))
+    assert tas_diff.rooms_changed == {'b': 6, 'a': -4, 'e': 8, 'd': -7}
+    assert tas_diff.changed_lines == {7, 10, 12, 15, 16}
+    assert tas_diff.unchanged_lines == {0: 0, 1: 1, 2: 2, 3: 3, 4: 4, 5: 5, 6: 6, 8: 8, 9: 9, 11: 10, 13: 12, 14: 13}
+
+    # same rooms as a full diff, and the same frames as a full count
+    ehs_tokens = validation.parse_tas_cached(Path('test_tases\\expert_heartside.tas').read_bytes(), False)[1]
+    ehs_old_tokens = validation.parse_tas_cached(Path('test_tases\\expert_heartside_old.tas').read_bytes(), False)[1]
+    tas_diff = validation.diff_tas(ehs_old_tokens, ehs_tokens)
+    ehs_frames, ehs_old_frames = frame_count.count_frames(ehs_tokens).rooms, frame_count.count_frames(ehs_old_tokens).rooms
+    assert tas_diff.rooms_changed == {room: ehs_frames[room] - ehs_old_frames[room] for room in tas_diff.rooms_changed}
+    assert set(tas_diff.unchanged_lines) | tas_diff.changed_lines == set(range(len(ehs_tokens.lines)))
+    assert validation.diff_tas(ehs_tokens, ehs_tokens) == validation.TASDiff({line_num: line_num for line_num in range(len(ehs_tokens.lines))}, set(), {})
+
+
+def test_format_rooms_changed():
+    assert validation.format_rooms_changed({'a-00': -3, 'a-01': 0}) == "Rooms changed: a-00 (-3f), a-01"
+    assert validation.format_rooms_changed({'a-00': 2}, '1A.tas') == "Rooms changed in 1A.tas: a-00 (+2f)"
+    assert validation.format_rooms_changed({f'a-{i:02}': 0 for i in range(12)}) == "Rooms changed: a-00, a-01, a-02, a-03, a-04, a-05, a-06, a-07, a-08, a-09, and 2 more"
+
+
+def test_incremental_validation(setup_log):
+    test_project = {'project_id': 0, 'is_lobby': False, 'excluded_items': (), 'ensure_level': False, 'disallowed_command_exemptions': [], 'room_indexing_includes_reads': False}
+    message = validation.MessageData("-0f (1:00.000)", 0, 0)
+    old_lines = ['console load 1 2 3', 'Set,Foo,1', '#Start', '#lvl_a', 'Repeat,2', '1,R', 'EndRepeat', '#lvl_b', '5,J', 'ChapterTime: 1:00.000(3529)']
+    old_tas = '\n'.join(old_lines).encode('UTF8')
+    validation.command_check_cache.clear()
+    assert validation.validate(old_tas, 'a.tas', message, None, test_project, path_cache={}).log_text == ["no \"draft\" text in message"]
+
+    # a bad command in an unchanged room still gets caught, since moving #Start changes what's allowed
+    new_lines = ['#Start', 'console load 1 2 3', 'Set,Foo,1', '#lvl_a', 'Repeat,2', '1,R', 'EndRepeat', '#lvl_b', '4,J', 'ChapterTime: 1:00.000(3529)']
+    hits = validation.command_check_cache.hits
+    result = validation.validate('\n'.join(new_lines).encode('UTF8'), 'a.tas', message, old_tas, test_project)
+    assert validation.command_check_cache.hits == hits + 1
+    assert result.rooms_changed == {'b': -1}
+    assert result.log_text == ["incorrect command argument in a.tas: Set, Set command is not allowed"]
+
+    new_lines[4] = 'Repeat,x'
+    result = validation.validate('\n'.join(new_lines).encode('UTF8'), 'a.tas', message, old_tas, test_project)
+    assert result.rooms_changed == {'a': -1, 'b': -1}
+    assert len(result.log_text) == 2
+
+
+def test_room_labels_including_reads(setup_log, monkeypatch):
+    test_project = {'project_id': 0, 'is_lobby': False, 'excluded_items': (), 'ensure_level': False, 'disallowed_command_exemptions': [], 'room_indexing_includes_reads': True}
+    message = validation.MessageData("a draft (1:00.000)", 0, 0)
+    read_files = {'common/intro.tas': b'#lvl_a (0)\n  10\n#lvl_b (0)\n  5\n'}
+    tas = b'console load 1\n#Start\nRead,../common/intro\n#lvl_a (1)\n  20\n#lvl_c (0)\n  5\n#lvl_b\n  1\nChapterTime: 1:00.000(3529)\n'
+    path_cache = {'a.tas': 'levels/a.tas'}
+    assert validation.validate(tas, 'a.tas', message, None, test_project, path_cache=path_cache).log_text == []  # can't be checked without the read files
+    assert validation.validate(tas, 'a.tas', message, None, test_project, path_cache=path_cache, read_files={}).log_text == \
+           ["incorrect initial room label #lvl_c (0) on line 6 in a.tas"]
+    assert validation.validate(tas, 'a.tas', message, None, test_project, path_cache=path_cache, read_files=read_files).log_text == \
+           ["missing room label #lvl_b on line 8 in a.tas"]
+
+    monkeypatch.setattr(validation, 'max_tokenized_size', 0)
+    assert validation.validate(tas, 'a.tas', message, None, test_project, path_cache=path_cache, read_files=read_files).log_text == \
+           ["missing room label #lvl_b on line 8 in a.tas"]
+
+
+def test_revalidate_message(setup_log):
+    test_project = {'project_id': 0, 'is_lobby': False, 'excluded_items': (), 'ensure_level': True, 'disallowed_command_exemptions': [], 'room_indexing_includes_reads': False}
+    ehs_valid = Path('test_tases\\expert_heartside.tas').read_bytes()
+    ehs_old = Path('test_tases\\expert_heartside_old.tas').read_bytes()
+    messages = [validation.MessageData(content, 0, 0) for content in ("-229f Expert Heartside (7:54.929)", "-228f Expert Heartside (7:54.929)", "-229f (7:54.929)",
+                                                                      "Expert Heartside WIP", "-229f Expert Heartside")]
+    result = validation.validate(ehs_valid, 'expert_heartside.tas', messages[1], ehs_old, test_project, path_cache={})
+    assert not result.valid_tas and result.file_checks
+
+    for message in messages:
+        assert validation.revalidate_message(result.file_checks, 'expert_heartside.tas', message, test_project) == \
+               validation.validate(ehs_valid, 'expert_heartside.tas', message, ehs_old, test_project, path_cache={})
+
+    # only the message checks get redone
+    bad_command = ehs_valid.replace(b'#Start', b'#Start\nExitGame', 1)
+    result = validation.validate(bad_command, 'expert_heartside.tas', messages[1], ehs_old, test_project, path_cache={})
+    assert validation.revalidate_message(result.file_checks, 'expert_heartside.tas', messages[0], test_project).log_text == \
+           ["incorrect command argument in expert_heartside.tas: ExitGame, ExitGame command is not allowed"]
+
+def test_compile_command_rules():
+    compiled_command_rules = validation.compile_command_rules((('set', 'speedrunclock'), ('set', 'simplifiedgraphics')))
+    assert compiled_command_rules['set'].exemptions == ('speedrunclock', 'simplifiedgraphics')
+    assert compiled_command_rules['set'].disallowed
+    assert compiled_command_rules['read'] == validation.CompiledCommandRule(False, None, 1, 3, '1-3', (None, None, None), ())
+    assert compiled_command_rules['invoke'].disallowed_reason == "Invoke command is not allowed"
+    assert compiled_command_rules['repeat'].args_count_options == 1
+    assert validation.compile_command_rules(()) is validation.compile_command_rules(())
+
+
 def test_time_to_frames():
     assert validation.time_to_frames('2:43.659') == 9627
     assert validation.time_to_frames('47.600') == 2800
@@ -610,15 +1204,24 @@ def test_time_to_frames():
     assert validation.time_to_frames('0.000') == 0
 
 
-def test_calculate_time_difference():
-    assert validation.calculate_time_difference('4:23.160', '4:23.007') == 9
-    assert validation.calculate_time_difference(15480, 15471) == 9
-    assert validation.calculate_time_difference('4:23.160', 15471) == 9
-    assert validation.calculate_time_difference(15480, '4:23.007') == 9
-    assert validation.calculate_time_difference('4:23.007', '4:23.007') == 0
-    assert validation.calculate_time_difference(15471, 15471) == 0
-    assert validation.calculate_time_difference('19.431', '19.380') == 3
-    assert validation.calculate_time_difference('1:13.797', ' 1:13.695') == 6
+def test_frame_time():
+    finaltime = validation.FrameTime.parse('0:46.308')
+    assert finaltime == validation.FrameTime('0:46.308', 2724)
+    assert (finaltime.trimmed, finaltime.with_frames(), str(finaltime)) == ('46.308', '46.308(2724)', '0:46.308')
+    assert validation.FrameTime.parse('2:43.659').trimmed == '2:43.659'
+    assert validation.FrameTime.parse('1:02:03.456').frames == 219027
+    assert validation.FrameTime.parse('47.600').frames == 2800
+    assert validation.FrameTime.parse('4:23.160') - validation.FrameTime.parse('4:23.007') == 9
+    assert validation.FrameTime.parse('19.431') - validation.FrameTime.parse('19.380') == 3
+    assert {validation.FrameTime.parse('1:00.000')} == {validation.FrameTime.parse('1:00.000')}
+
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        finaltime.frames = 0
+
+    # the same as the old float math
+    for time_ms in range(0, 400000, 7):
+        assert validation.time_to_frames(f'{time_ms // 60000}:{time_ms // 1000 % 60:02}.{time_ms % 1000:03}') == round(time_ms / 1000 / 0.017)
+        assert validation.time_to_frames(f'{time_ms // 1000}.{time_ms % 1000:03}') == round(time_ms / 1000 / 0.017)
 
 
 def test_as_lines(setup_log):
@@ -629,6 +1232,24 @@ def test_as_lines(setup_log):
     assert validation.as_lines(Path('test_tases\\abby-cookie.tas').read_bytes()) == lines
 
 
+def test_iter_lines(setup_log, monkeypatch):
+    monkeypatch.setattr(validation, 'stream_chunk_size', 3)
+
+    for tas in (b'', b'a', b'a\r\nb\r\n', b'a\rb\nc\r\n\r\n', '\u65e5\u672c\n\u00e9,\U0001f600\r\n#'.encode('UTF8'), Path('test_tases\\abby-cookie.tas').read_bytes()):
+        assert list(validation.iter_lines(tas)) == validation.as_lines(tas)
+
+    with pytest.raises(UnicodeDecodeError):
+        list(validation.iter_lines(b'a\n\xff'))
+
+
+def test_parse_tas_streaming(setup_log):
+    for tas_path in ('test_tases\\expert_heartside.tas', 'test_tases\\invalids\\ehs_breakpoints.tas', 'test_tases\\9.tas'):
+        tas = Path(tas_path).read_bytes()
+
+        for args in ((True,), (False, False), (True, True, validation.FinalTimeTypes.File)):
+            assert validation.parse_tas_streaming(tas, *args) == validation.parse_tas_file(validation.as_lines(tas), *args)
+
+
 def test_filter_out_links(setup_log):
     message = ("-17f The [House](https://discord.com/channels/1269042133541585049/1269042134124855321/1269247598250819635) on Ash Tree Lane 0:15.742(926) -> 0:15.453(909)\n"
                "+4f [a-00-outside] Build up speed\n"
@@ -641,11 +1262,179 @@ def test_fuzz_possible_filename(setup_log):
     sj_int = ('construction_conundrum.tas', 'deep_blue.tas', 'eat_girl.tas', 'fifth_dimension.tas', 'frosted_fragments.tas', 'honeyzip_inc.tas', 'intermediate_heartside.tas',
               'in_filtration.tas', 'low-g_botany.tas', 'midnight_monsoon.tas', 'pointless_machines.tas', 'pufferfish_transportation.tas', 'sea_of_soup.tas', 'sleeping_under_stars.tas',
               'square_the_circle.tas', 'supernautica.tas', 'temple_of_a_thousand_skies.tas', 'the_tower.tas', 'vertigo.tas')
-    assert validation.fuzz_possible_filename('bointless_bachines.tas', sj_int) == 'pointless_machines.tas'
-    assert validation.fuzz_possible_filename('sleeping_under_tars.tas', sj_int) == 'sleeping_under_stars.tas'
-    assert validation.fuzz_possible_filename('eat_girls.tas', sj_int) == 'eat_girl.tas'
-    assert validation.fuzz_possible_filename('mosaic_garden.tas', sj_int) is None
-    assert validation.fuzz_possible_filename('subway_neon.tas', sj_int) is None
+    assert validation.fuzz_possible_filename('bointless_bachines.tas', sj_int, 0) == 'pointless_machines.tas'
+    assert validation.fuzz_possible_filename('sleeping_under_tars.tas', sj_int, 0) == 'sleeping_under_stars.tas'
+    assert validation.fuzz_possible_filename('eat_girls.tas', sj_int, 0) == 'eat_girl.tas'
+    assert validation.fuzz_possible_filename('mosaic_garden.tas', sj_int, 0) is None
+    assert validation.fuzz_possible_filename('subway_neon.tas', sj_int, 0) is None
+
+
+# FUZZY INDEX
+def test_fuzzy_index(setup_log):
+    names = ('construction_conundrum.tas', 'deep_blue.tas', 'eat_girl.tas', 'fifth_dimension.tas', 'pointless_machines.tas', 'sea_of_soup.tas', 'sleeping_under_stars.tas', 'vertigo.tas', 'a.tas')
+    index = fuzzy_index.FuzzyIndex(names)
+    assert index.candidates('bointless_bachines.tas') == ['pointless_machines.tas', 'a.tas']
+    assert index.candidates('eat.tas') == names
+    assert index.best_match('bointless_bachines.tas', 90) == 'pointless_machines.tas'
+    assert index.best_match('mosaic_garden.tas', 90) is None
+    assert index.matches('vertigo', limit=1) == ['vertigo.tas']
+    assert index.starting_with('s') == ['sea_of_soup.tas', 'sleeping_under_stars.tas']
+
+    project_index = fuzzy_index.project_index(1, names)
+    assert fuzzy_index.project_index(1, reversed(names)) is project_index
+    assert fuzzy_index.project_index(1, names[1:]) is not project_index
+    del fuzzy_index.project_indexes[1]
+
+
+# FRAME COUNT
+def test_count_frames(setup_log):
+    tas_tokens = validation.tokenize_tas(['console load 1', '   10', '#Start', '#lvl_a', '  5,R', 'Repeat,3', '  2,J', '  1', 'EndRepeat', '#lvl_b', 'Read,other,go,stop', '  7,L',
+                                          '#lvl_a', '  4', 'Read,missing', '#label', '  1,X'])
+    other_tokens = validation.tokenize_tas(['  100', '#go', '  20', '  30,R', '#stop', '  400'])
+    frames = frame_count.count_frames(tas_tokens, lambda path, read_path: ('other.tas', other_tokens) if read_path == 'other' else None)
+    assert frames == frame_count.FrameCount(10 + 5 + 9 + 50 + 7 + 4 + 1, {'a': 5 + 9 + 4 + 1, 'b': 50 + 7}, ['Read,missing'])
+    assert frame_count.count_frames(tas_tokens).unresolved_reads == ['Read,other,go,stop', 'Read,missing']
+    assert frame_count.find_read_line(other_tokens, 'stop') == 4
+    assert frame_count.find_read_line(other_tokens, '2') == 1
+    assert frame_count.find_read_line(other_tokens, 'nowhere') is None
+
+    # Start is the usual label for reading a file's inputs
+    start_tokens = validation.tokenize_tas(['console load 1', '  30', '#Start', '  12', '  8,J'])
+    frames = frame_count.count_frames(validation.tokenize_tas(['Read,start,Start']), lambda path, read_path: ('start.tas', start_tokens))
+    assert frames == frame_count.FrameCount(12 + 8, {}, [])
+    assert frame_count.find_read_line(start_tokens, 'Start') == 2
+
+    # reading itself shouldn't recurse forever
+    loop_tokens = validation.tokenize_tas(['  1', 'Read,loop'])
+    assert frame_count.count_frames(loop_tokens, lambda path, read_path: ('loop.tas', loop_tokens), 'loop.tas') == frame_count.FrameCount(1, {}, ['Read,loop'])
+
+    tas_tokens = validation.parse_tas_cached(Path('test_tases\\4SH0.tas').read_bytes(), True)[1]
+    frames = frame_count.count_frames(tas_tokens)
+    assert frames.total == 12995
+    assert len(frames.rooms) == 56
+    assert frames.rooms['a-05'] == 130
+
+
+# READ RESOLVER
+def test_read_resolver(setup_log):
+    files = {'1A.tas': b'console load 1\n   10\n#Start\nRead,common/menu,go,stop\n  5,R\nRead,chapters/2A\n',
+             'chapters/2A - Old Site.tas': b'#Start\n  7\nRead,../common/menu.tas\n',
+             'common/menu.tas': b'  100\n#go\n  20,J\n#stop\nRead,loop\n',
+             'common/loop.tas': b'  1\nRead,loop\n',
+             'moved/3A.tas': b'  3\n',
+             'lobby.tas': b'Read,3A\nRead,nowhere\n'}
+    resolver = read_resolver.ReadResolver(files, {'3A.tas': 'moved/3A.tas'})
+    assert resolver.resolve_path('1A.tas', 'common/menu') == 'common/menu.tas'
+    assert resolver.resolve_path('1A.tas', 'chapters/2A') == 'chapters/2A - Old Site.tas'
+    assert resolver.resolve_path('chapters/2A - Old Site.tas', '../common/menu.tas') == 'common/menu.tas'
+    assert resolver.resolve_path('lobby.tas', '3A') == 'moved/3A.tas'
+    assert resolver.resolve_path('lobby.tas', 'nowhere') is None
+    assert resolver.reads('1A.tas') == [read_resolver.Read(3, 'Read,common/menu,go,stop', 'common/menu.tas', 1, 3), read_resolver.Read(5, 'Read,chapters/2A', 'chapters/2A - Old Site.tas', 0, 2)]
+
+    assert resolver.expand('1A.tas') == ('console load 1', '   10', '#Start', '#go', '  20,J', '#stop', '  5,R', '#Start', '  7', '  100', '#go', '  20,J', '#stop',
+                                         '  1', 'Read,loop')
+    assert resolver.expand('common/loop.tas') == ('  1', 'Read,loop')
+    assert resolver.frames('1A.tas').total == 10 + 20 + 5 + 7 + 100 + 20 + 1
+
+    assert resolver.dependency_graph() == {'1A.tas': {'common/menu.tas', 'chapters/2A - Old Site.tas'}, 'chapters/2A - Old Site.tas': {'common/menu.tas'},
+                                           'common/menu.tas': {'common/loop.tas'}, 'common/loop.tas': set(), 'moved/3A.tas': set(), 'lobby.tas': {'moved/3A.tas'}}
+    assert resolver.dependents('common/loop.tas') == {'common/menu.tas', 'chapters/2A - Old Site.tas', '1A.tas'}
+    assert resolver.dependents('chapters/2A - Old Site.tas') == {'1A.tas'}
+    assert resolver.dependents('1A.tas') == frozenset()
+    assert resolver.read_closure('1A.tas') == {'common/menu.tas', 'chapters/2A - Old Site.tas', 'common/loop.tas'}
+    assert resolver.read_closure('new.tas', validation.tokenize_tas(['Read,moved/3A', 'Read,lobby'])) == {'moved/3A.tas', 'lobby.tas'}
+
+    resolver = read_resolver.ReadResolver({'fullgame.tas': b'Read,1A,Start\n', '1A.tas': b'console load 1\n   10\n#Start\n  5,R\n  3\n'}, {})
+    assert resolver.reads('fullgame.tas') == [read_resolver.Read(0, 'Read,1A,Start', '1A.tas', 2, 4)]
+    assert resolver.frames('fullgame.tas') == frame_count.FrameCount(5 + 3, {}, [])
+
+
+# REVALIDATE
+def test_revalidate_file(setup_log):
+    result = revalidate.revalidate_file('subdir/expert_heartside.tas', Path('test_tases\\expert_heartside.tas').read_bytes(), revalidate.default_project)
+    assert result['valid'] and result['finaltime'] == '7:54.929' and result['log_text'] == []
+    result = revalidate.revalidate_file('ehs_exitgame.tas', Path('test_tases\\invalids\\ehs_exitgame.tas').read_bytes(), revalidate.default_project)
+    assert not result['valid']
+    assert result['log_text'] == ["incorrect command argument in ehs_exitgame.tas: ExitGame, ExitGame command is not allowed"]
+    result = revalidate.revalidate_file('binary.tas', b'\xff\xfe', revalidate.default_project)
+    assert result['log_text'] == ["binary.tas not being UTF8"]
+
+
+def test_revalidate_is_included():
+    project = revalidate.default_project | {'subdir': 'tases', 'excluded_items': ['tases/old']}
+    assert revalidate.is_included('tases/1A.tas', project)
+    assert not revalidate.is_included('tases/old/1A.tas', project)
+    assert not revalidate.is_included('1A.tas', project)
+    assert revalidate.is_included('1A.tas', revalidate.default_project)
+
+
+# VALIDATION SERVICE
+def test_validation_service(setup_log, tmp_path):
+    ehs_valid = Path('test_tases\\expert_heartside.tas').read_bytes()
+    ehs_old = Path('test_tases\\expert_heartside_old.tas').read_bytes()
+    (tmp_path / 'subdir').mkdir()
+    (tmp_path / 'subdir' / 'expert_heartside.tas').write_bytes(ehs_old)
+    subprocess.run(['git', 'init', '-q'], cwd=tmp_path)
+    subprocess.run(['git', '-c', 'user.name=test', '-c', 'user.email=test@test', 'commit', '-q', '--allow-empty', '-m', 'empty'], cwd=tmp_path)
+    service = validation_service.ValidationService(tmp_path)
+    assert service.repo_files == {}
+    subprocess.run(['git', 'add', '.'], cwd=tmp_path)
+    subprocess.run(['git', '-c', 'user.name=test', '-c', 'user.email=test@test', 'commit', '-q', '-m', 'ehs'], cwd=tmp_path)
+    (tmp_path / 'subdir' / 'expert_heartside.tas').write_bytes(ehs_valid)  # being worked on, so the committed version is the old one
+    service.last_refresh_time = 0
+    service.refresh_repo()
+    assert service.repo_files == {'subdir/expert_heartside.tas': ehs_old} and service.path_cache == {'expert_heartside.tas': 'subdir/expert_heartside.tas'}
+
+    requests = [{'filename': 'expert_heartside.tas', 'tas': ehs_valid.decode('UTF8'), 'message': message} for message in ("-229f Expert Heartside (7:54.929)", "-228f (7:54.929)")]
+    results = service.handle(requests)
+    assert [result['valid'] for result in results] == [True, False]
+    assert results[0]['timesave'] == '-229f' and results[0]['finaltime'] == '7:54.929'
+    assert results[1]['log_text'] == validation.validate(ehs_valid, 'expert_heartside.tas', validation.MessageData("-228f (7:54.929)", 0, 0), ehs_old,
+                                                         service.project, path_cache={}).log_text
+    assert service.file_checks_cache.hits == 1  # the second request only redid the message checks
+    assert service.handle({'filename': 'expert_heartside.tas', 'tas': ehs_valid.decode('UTF8'), 'message': "Expert Heartside draft (7:54.929)", 'old_tas': None})['valid']
+    assert 'error' in service.handle({'tas': ""})
+
+    # misspelled drafts are matched against the repo's filenames, in the service's own fuzzy index
+    draft_result = service.handle({'filename': 'expert_hearstide.tas', 'tas': ehs_valid.decode('UTF8'), 'message': "Expert Heartside (7:54.929)"})
+    assert "did you mean `expert_heartside.tas`?" in draft_result['warning_text'][0]
+    assert fuzzy_index.project_indexes[str(tmp_path)].choices == ('expert_heartside.tas',)
+
+    server = validation_service.http.server.ThreadingHTTPServer(('127.0.0.1', 0), validation_service.ValidationRequestHandler)
+    server.service = service
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}/validate'
+
+    try:
+        with urllib.request.urlopen(url, orjson.dumps(requests[0])) as response:
+            assert orjson.loads(response.read())['valid']
+
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(url, b'{')
+
+        assert error.value.code == 400
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_validation_service_reads(setup_log, tmp_path):
+    # checks depend on the files that are read from, for projects that index room labels through reads
+    (tmp_path / 'common').mkdir()
+    (tmp_path / 'common' / 'intro.tas').write_bytes(b'#lvl_a (0)\n  10\n#lvl_b (0)\n  5\n')
+    (tmp_path / 'levels').mkdir()
+    (tmp_path / 'levels' / 'a.tas').write_bytes(b'')
+    service = validation_service.ValidationService(tmp_path, {'room_indexing_includes_reads': True, 'ensure_level': False})
+    request = {'filename': 'a.tas', 'message': "a draft (1:00.000)", 'old_tas': None,
+               'tas': "console load 1\n#Start\nRead,../common/intro\n#lvl_a (1)\n  20\n#lvl_c (0)\n  5\n#lvl_b\n  1\nChapterTime: 1:00.000(3529)\n"}
+    assert service.handle(request)['log_text'] == ["missing room label #lvl_b on line 8 in a.tas"]
+    assert service.handle(request)['log_text'] == ["missing room label #lvl_b on line 8 in a.tas"]
+    assert service.file_checks_cache.hits == 1
+
+    (tmp_path / 'common' / 'intro.tas').write_bytes(b'  15\n')
+    service.last_refresh_time = 0
+    assert service.handle(request)['log_text'] == ["incorrect initial room label #lvl_c (0) on line 6 in a.tas"]
+    assert service.file_checks_cache.hits == 1
 
 
 # COMMANDS
@@ -842,6 +1631,118 @@ def test_generate_environment_state():
                                  'subdir': 'sync_testing', 'sid_caches_exist': True, 'commit_any_time_saved': False, 'validate_room_labels': False}
 
 
+def test_select_changed_files(setup_log, tmp_path):
+    def git(*args: str, cwd: Path = tmp_path / 'origin') -> str:
+        return subprocess.run(['git', '-c', 'user.name=test', '-c', 'user.email=test@test', *args], cwd=cwd, capture_output=True, check=True).stdout.decode('UTF8').strip()
+
+    origin_path = tmp_path / 'origin'
+    (origin_path / 'common').mkdir(parents=True)
+    files = {'1A.tas': 'Read,common/menu\n  10\n', '2A.tas': '  20\n', '3A.tas': 'Read,2A\n', '4A.tas': '  40\n', 'common/menu.tas': '  1\n'}
+
+    for path, content in files.items():
+        (origin_path / path).write_text(content)
+
+    git('init')
+    git('add', '.')
+    git('commit', '-m', 'first')
+    old_sha = git('rev-parse', 'HEAD')
+    (origin_path / 'common' / 'menu.tas').write_text('  2\n')
+    (origin_path / '4A.tas').write_text('  41\n')
+    git('commit', '-am', 'second')
+    head_sha = git('rev-parse', 'HEAD')
+    git('clone', '--depth=1', f'file://{origin_path.as_posix()}', 'clone', cwd=tmp_path)
+
+    clone_path = tmp_path / 'clone'
+    path_cache = {Path(path).name: path for path in files}
+    resolver = read_resolver.ReadResolver.from_folder(clone_path, path_cache)
+    verified_shas = {'1A.tas': old_sha, '2A.tas': old_sha, '3A.tas': old_sha, '4A.tas': head_sha}
+    assert game_sync.git_changed_files(clone_path, old_sha, head_sha) == {'common/menu.tas', '4A.tas'}
+    assert game_sync.select_changed_files(path_cache, verified_shas, head_sha, clone_path, resolver) == {'1A.tas': '1A.tas', 'menu.tas': 'common/menu.tas'}
+    assert game_sync.select_changed_files(path_cache, verified_shas | {'2A.tas': 'f' * 40}, head_sha, clone_path, resolver) == {'1A.tas': '1A.tas', '2A.tas': '2A.tas',
+                                                                                                                                'menu.tas': 'common/menu.tas'}
+
+
+
+def test_run_sync_queue(setup_log, monkeypatch):
+    instances = [game_sync.GameInstance(number, Path(f'celeste {number}'), 32270 + number) for number in range(3)]
+    files_to_sync = [(f'{file_num}.tas', f'tases/{file_num}.tas') for file_num in range(8)]
+    played = []
+
+    def sync_file(instance: game_sync.GameInstance, tas_filename: str, file_path_repo: str, sync_context: game_sync.SyncContext):
+        time.sleep(0.01)
+        played.append((instance.number, tas_filename))
+        return None if tas_filename == '3.tas' else game_sync.FileSyncResult(tas_filename, True, filetime=instance.url(file_path_repo))
+
+    monkeypatch.setattr(game_sync, 'wait_for_game_load', lambda mods, project_name, instance: f'process {instance.number}')
+    monkeypatch.setattr(game_sync, 'sync_file', sync_file)
+    sync_context = game_sync.SyncContext({'name': "Test"}, set(), Path(), None, {}, {})
+    sync_results = game_sync.run_sync_queue(instances, files_to_sync, sync_context)
+    assert sorted(sync_results) == ['0.tas', '1.tas', '2.tas', '4.tas', '5.tas', '6.tas', '7.tas']
+    assert sorted(tas_filename for _, tas_filename in played) == [tas_filename for tas_filename, _ in files_to_sync]
+    assert {instance_number for instance_number, _ in played} == {0, 1, 2}
+    assert [instance.process for instance in instances] == ['process 0', 'process 1', 'process 2']
+    assert all(sync_result.filetime.startswith(f'http://localhost:{32270 + instance_number}/tases/') for instance_number, tas_filename in played
+               if (sync_result := sync_results.get(tas_filename)))
+
+    # a game that won't load stops the other instances from starting more, and still gets raised
+    def frozen_sync_file(instance: game_sync.GameInstance, tas_filename: str, file_path_repo: str, sync_context: game_sync.SyncContext):
+        played.append((instance.number, tas_filename))
+
+        if tas_filename == '0.tas':
+            raise TimeoutError("Game failed to load")
+
+        time.sleep(0.05)
+
+    played.clear()
+    monkeypatch.setattr(game_sync, 'sync_file', frozen_sync_file)
+
+    with pytest.raises(TimeoutError):
+        game_sync.run_sync_queue(instances, files_to_sync, sync_context)
+
+    assert len(played) < len(files_to_sync)
+
+
+def test_sync_file_frozen(setup_log, monkeypatch, tmp_path):
+    instance = game_sync.GameInstance(1, tmp_path / 'celeste 1', 32271, 'process 1')
+    (instance.path / 'CrashLogs').mkdir(parents=True)
+    (tmp_path / 'repo').mkdir()
+    (tmp_path / 'repo' / '1A.tas').write_bytes(b'  10,R\n\n#Start\n  100,J\nChapterTime: 0:01.870(110)\n')
+    restarts = []
+    polls = []
+
+    def mock_get(url: str, **kwargs):
+        polls.append(url)
+        return MockResponse(200, {}, text="Running: True<br>CurrentFrame: 5<br>TotalFrames: 110<br>")
+
+    monkeypatch.setattr(game_sync, 'freeze_timeout_min', 0)
+    monkeypatch.setattr(game_sync, 'freeze_timeout_max', 0.05)
+    monkeypatch.setattr(game_sync, 'scaled_sleep', lambda seconds: None)
+    monkeypatch.setattr(game_sync.niquests, 'post', lambda *args, **kwargs: None)
+    monkeypatch.setattr(game_sync.niquests, 'get', mock_get)
+    monkeypatch.setattr(game_sync, 'close_game', lambda instance: restarts.append('close'))
+    monkeypatch.setattr(game_sync, 'start_game', lambda validate_room_labels, instance: restarts.append('start'))
+    monkeypatch.setattr(game_sync, 'wait_for_game_load', lambda mods, project_name, instance: 'process 2')
+    resolver = read_resolver.ReadResolver({'1A.tas': (tmp_path / 'repo' / '1A.tas').read_bytes()})
+    sync_context = game_sync.SyncContext({'name': "Test", 'validate_room_labels': False}, set(), tmp_path / 'repo', resolver, {}, {})
+
+    # fails just this file and restarts the game, instead of stopping the whole sync check
+    sync_result = game_sync.sync_file(instance, '1A.tas', '1A.tas', sync_context)
+    assert sync_result.desync == ('1A.tas', "Froze after 0.0 hours")
+    assert not sync_result.timed
+    assert polls and restarts == ['close', 'start']
+    assert instance.process == 'process 2'
+
+
+def test_wait_for_game_load_no_process(setup_log, monkeypatch):
+    monkeypatch.setattr(game_sync, 'scaled_sleep', lambda seconds: None)
+    monkeypatch.setattr(game_sync, 'mod_versions', lambda mods: '')
+    monkeypatch.setattr(game_sync.niquests, 'get', lambda *args, **kwargs: None)
+    monkeypatch.setattr(game_sync, 'game_process', lambda instance: None)
+
+    with pytest.raises(game_sync.GameProcessError, match=r"instance 2 \(port 32272"):
+        game_sync.wait_for_game_load(set(), "Test", game_sync.GameInstance(2, Path('celeste 2'), 32272))
+
+
 # SPREADSHEET
 
 def test_read_sheet():
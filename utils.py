@@ -17,7 +17,7 @@ import orjson
 import db
 from constants import admin_user_id
 
-Host = namedtuple('Host', ('name', 'sleep_scale'))
+Host = namedtuple('Host', ('name', 'sleep_scale', 'sync_instances'), defaults=((),))  # sync_instances are extra game instances, see game_sync.GameInstance
 
 def plural(count: Union[int, Sized]) -> str:
     if isinstance(count, int):
@@ -112,7 +112,8 @@ def host() -> Host:
         with open('host.toml', 'rb') as host_toml:
             host_data = tomllib.load(host_toml)
             return Host(name=host_data['all']['name'],
-                        sleep_scale=host_data['game_sync']['sleep_scale'])
+                        sleep_scale=host_data['game_sync']['sleep_scale'],
+                        sync_instances=tuple(host_data['game_sync'].get('instances', ())))
     if os.path.isfile('host'):
         with open('host', 'r', encoding='UTF8') as host_file:
             return Host(name=host_file.read().strip('" \n'),
@@ -1,12 +1,21 @@
+import array
+import codecs
+import collections
 import dataclasses
+import difflib
 import enum
+import functools
+import hashlib
+import itertools
 import logging
 import re
-from typing import List, Optional, Callable, Union
+import threading
+from typing import Iterator, List, Optional, Callable, Union
 
 import discord
 
 import db
+import fuzzy_index
 import utils
 
 
@@ -20,7 +29,9 @@ class ValidationResult:
     timesave: Optional[str] = None
     wip: bool = False
     sj_data: Optional[tuple] = None
+    rooms_changed: Optional[dict[str, int]] = None  # room -> frames gained or lost
     finished: bool = True
+    file_checks: Optional['FileChecks'] = dataclasses.field(default=None, compare=False, repr=False)  # for redoing just the message checks after an edit
 
     def emit_failed_check(self, warning: str, log_message: str):
         self.valid_tas = False
@@ -41,7 +52,25 @@ class ValidationResult:
             self.finish()
 
 
-def validate(tas: bytes, filename: str, message: discord.Message, old_tas: Optional[bytes], project: dict, skip_validation: bool = False) -> ValidationResult:
+# the parts of an improvement message that validation uses, since discord messages can't be sent to other processes
+@dataclasses.dataclass(frozen=True)
+class MessageData:
+    content: str
+    author_id: int
+    channel_id: int
+
+    @classmethod
+    def from_message(cls, message: discord.Message):
+        return cls(message.content, message.author.id, message.channel.id)
+
+
+# read_files is the repo files that the file reads from (directly or not), for projects that index room labels through reads
+# possible_filename is what to suggest if the file's a draft, from draft_possible_filename
+def validate(tas: bytes, filename: str, message: Union[discord.Message, MessageData], old_tas: Optional[bytes], project: dict, skip_validation: bool = False,
+             path_cache: Optional[dict] = None, read_files: Optional[dict[str, bytes]] = None, possible_filename: Optional[str] = None) -> ValidationResult:
+    if not isinstance(message, MessageData):
+        message = MessageData.from_message(message)
+
     log.info(f"Validating{' lobby file' if project['is_lobby'] else ''} {filename}, {len(tas)} bytes, {len(message.content)} char message")
 
     if not skip_validation:
@@ -49,43 +78,26 @@ def validate(tas: bytes, filename: str, message: discord.Message, old_tas: Optio
         if not tas or tas == b'404: Not Found':
             return ValidationResult(False, [f"This TAS file is empty or couldn't be downloaded."], [f"{filename} being empty"])
 
-        if not skip_validation and len(tas) > 204800:  # 200 kb
+        if not skip_validation and len(tas) > max_tas_size:
             return ValidationResult(False, [f"This TAS file is very large ({len(tas) / 1024:.1f} KB). For safety, it won't be processed."], [f"{filename} being too long ({len(tas)} bytes)"])
 
-    tas_lines = as_lines(tas)
-    message_lowercase = message.content.lower()
-    tas_parsed = parse_tas_file(tas_lines, True)
-    dash_saves = re_dash_saves.search(message.content.partition('\n')[0])
-    is_dash_save = dash_saves is not None
-    got_timesave = False
-    wip_in_message = 'wip' in re_remove_punctuation.subn(' ', message_lowercase)[0].split()
-    rooms_found = {}
-    uses_one_indexing = None
-    found_start = False
-    room_indexing_includes_reads = project['room_indexing_includes_reads']
+    if len(tas) > max_tokenized_size or (old_tas and len(old_tas) > max_tokenized_size):
+        return validate_streaming(tas, filename, message, old_tas, project, skip_validation, path_cache, read_files, possible_filename)
+
+    tas_parsed, tas_tokens = parse_tas_cached(tas, True)
+    tas_lines = tas_tokens.lines
+    old_tas_parsed, old_tas_tokens = parse_tas_cached(old_tas, False) if old_tas else (None, None)
+    tas_diff = diff_tas(old_tas_tokens, tas_tokens) if old_tas else None
+    unchanged_lines = tas_diff.unchanged_lines if tas_diff else {}
+    rooms_changed = tas_diff.rooms_changed if tas_diff else None
+    wip_in_message = is_wip(message)
+    line_state = LineWalkState()
+    check_room_labels = not project['room_indexing_includes_reads'] or read_files is not None
+    labels_resolver = room_labels_resolver(project, read_files, path_cache)
+    file_path = file_repo_path(filename, project, path_cache)
 
     if skip_validation or wip_in_message:
-        log.info(f"Skipping validation ({wip_in_message=})")
-        # ok this is really ugly, but we do need final time and timesave
-
-        if old_tas and tas_parsed.found_finaltime:
-            old_tas_parsed = parse_tas_file(as_lines(old_tas), False)
-
-            if old_tas_parsed.found_finaltime:
-                time_saved_num = calculate_time_difference(old_tas_parsed.finaltime, tas_parsed.finaltime)
-                time_saved_text = f'-{time_saved_num}f' if time_saved_num >= 0 else f'+{abs(time_saved_num)}f'
-                got_timesave = True
-
-        if got_timesave:
-            timesave = time_saved_text
-        elif is_dash_save:
-            # techically not timesave but whatever
-            timesave = str(dash_saves[0])
-        else:
-            timesave = None
-
-        return ValidationResult(True, [], [], finaltime=tas_parsed.finaltime,
-                                finaltime_frames=tas_parsed.finaltime_frames, timesave=timesave, wip=wip_in_message)
+        return skipped_validation_result(tas_parsed, old_tas_parsed, message, wip_in_message, rooms_changed)
 
     validation_result = ValidationResult(True, [], [], finished=False)
 
@@ -97,7 +109,447 @@ def validate(tas: bytes, filename: str, message: discord.Message, old_tas: Optio
     if old_tas and tas.replace(b'\r', b'') == old_tas.replace(b'\r', b''):
         return ValidationResult(False, ["This file is identical to what's already in the repo."], [f"file {filename} is unchanged from repo"])
 
-    # validate breakpoint doesn't exist and chaptertime does
+    validate_breakpoints_and_finaltime(validation_result, tas_parsed, project, filename)
+
+    # if the old file's commands were already checked, only check lines that changed (or that were already failing)
+    start_line_num = next(iter(tas_tokens.lines_of_type(LineType.START)), None)
+    command_check_key = tuple(tuple(exemption) for exemption in project['disallowed_command_exemptions'])
+    compiled_command_rules = compile_command_rules(command_check_key)
+    commands_to_check = None
+    failed_command_lines = set()
+
+    if old_tas and (old_command_check := command_check_cache.get((old_tas_tokens.content_hash, command_check_key))):
+        old_failed_command_lines, old_start_line_num = old_command_check
+        commands_to_check = set()
+
+        for line_num in tas_tokens.commands:
+            old_line_num = unchanged_lines.get(line_num)
+
+            if old_line_num is None or old_line_num in old_failed_command_lines or is_before_start(old_line_num, old_start_line_num) != is_before_start(line_num, start_line_num):
+                commands_to_check.add(line_num)
+
+        log.info(f"Incrementally validating {len(commands_to_check)}/{len(tas_tokens.commands)} commands, changed rooms: {rooms_changed}")
+
+    for line_num, line_type in enumerate(tas_tokens.types):
+        if line_type in (LineType.EMPTY, LineType.COMMENT, LineType.INPUT):
+            continue
+
+        # validate room label indexing
+        if line_type == LineType.ROOM_LABEL and check_room_labels:
+            validate_room_label(validation_result, line_state, tas_lines[line_num], line_num, filename)
+        elif labels_resolver and line_num in tas_tokens.commands and tas_tokens.commands[line_num][0].lower() == 'read':
+            walk_read_room_labels(line_state, labels_resolver, file_path, line_num, tas_tokens.commands[line_num])
+
+        if not line_state.found_start and line_type == LineType.START:
+            line_state.found_start = True
+            continue
+
+        # validate command usage
+        if line_num not in tas_tokens.commands or (commands_to_check is not None and line_num not in commands_to_check):
+            continue
+
+        warnings_count = len(validation_result.warning_text)
+        validate_command(validation_result, tas_tokens, line_num, line_state.found_start, compiled_command_rules, filename)
+
+        if len(validation_result.warning_text) > warnings_count:
+            failed_command_lines.add(line_num)
+
+    if tas_tokens.content_hash:
+        command_check_cache.put((tas_tokens.content_hash, command_check_key), (frozenset(failed_command_lines), start_line_num))
+
+    sj_data = (tas_tokens, tas_parsed.finaltime_line_num) if message.channel_id == 1074148268407275520 else None
+    file_checks = FileChecks(validation_result, tas_parsed, old_tas_parsed, line_state.found_start, rooms_changed, sj_data)
+    return validate_with_file_checks(file_checks, message, filename, project, path_cache, possible_filename)
+
+
+def finaltime_text(tas_parsed: 'ParsedTASFile') -> Optional[str]:
+    return tas_parsed.finaltime.text if tas_parsed.finaltime else None
+
+
+def finaltime_frames(tas_parsed: 'ParsedTASFile') -> Optional[int]:
+    return tas_parsed.finaltime.frames if tas_parsed.finaltime else None
+
+
+# the results of everything about a file that doesn't depend on its message
+@dataclasses.dataclass
+class FileChecks:
+    result: ValidationResult  # unfinished, with only the file's failed checks
+    tas_parsed: 'ParsedTASFile'
+    old_tas_parsed: Optional['ParsedTASFile']
+    found_start: bool
+    rooms_changed: Optional[dict[str, int]]
+    sj_data: Optional[tuple]
+
+
+# what a file's checks depend on besides the file and old file, for keying caches of them: the project settings the file checks use, and the files it reads from
+def file_checks_context(project: dict, read_files: Optional[dict[str, bytes]]) -> tuple:
+    project_settings = tuple((key, repr(project.get(key))) for key in file_checks_project_keys)
+    read_files_hashes = tuple((path, hashlib.sha1(content).digest()) for path, content in sorted(read_files.items())) if read_files is not None else None
+    return project_settings, read_files_hashes
+
+
+# finish validating a file with the message checks, which are cheap enough to redo whenever the message is edited
+def validate_with_file_checks(file_checks: FileChecks, message: MessageData, filename: str, project: dict, path_cache: Optional[dict],
+                              possible_filename: Optional[str] = None) -> ValidationResult:
+    tas_parsed = file_checks.tas_parsed
+    validation_result = ValidationResult(file_checks.result.valid_tas, file_checks.result.warning_text.copy(), file_checks.result.log_text.copy(), finished=False)
+    timesave = validate_message(validation_result, tas_parsed, file_checks.old_tas_parsed, message, filename, project, path_cache, file_checks.found_start,
+                                file_checks.rooms_changed, possible_filename)
+    validation_result.finaltime = finaltime_text(tas_parsed)
+    validation_result.finaltime_frames = finaltime_frames(tas_parsed)
+    validation_result.timesave = timesave
+    validation_result.sj_data = file_checks.sj_data
+    validation_result.rooms_changed = file_checks.rooms_changed
+    validation_result.file_checks = file_checks
+    validation_result.finish()
+    return validation_result
+
+
+# validate an edited message using its files' cached checks
+def revalidate_message(file_checks: FileChecks, filename: str, message: MessageData, project: dict, skip_validation: bool = False,
+                       path_cache: Optional[dict] = None, possible_filename: Optional[str] = None) -> ValidationResult:
+    log.info(f"Revalidating message for {filename}, {len(message.content)} char message")
+    wip_in_message = is_wip(message)
+
+    if skip_validation or wip_in_message:
+        return skipped_validation_result(file_checks.tas_parsed, file_checks.old_tas_parsed, message, wip_in_message, file_checks.rooms_changed)
+
+    return validate_with_file_checks(file_checks, message, filename, project, path_cache, possible_filename)
+
+
+class FinalTimeTypes(enum.Enum):
+    Chapter = 0
+    MidwayChapter = 1
+    File = 2
+    MidwayFile = 3
+    Comment = 4
+
+    def as_midway(self):
+        match self:
+            case self.Chapter:
+                return self.MidwayChapter
+            case self.File:
+                return self.MidwayFile
+            case _:
+                return self
+
+
+class LineType(enum.IntEnum):
+    EMPTY = 0
+    COMMENT = 1
+    ROOM_LABEL = 2
+    START = 3
+    COMMAND = 4
+    INPUT = 5
+    BREAKPOINT = 6
+    FINAL_TIME = 7
+
+
+# every line of a TAS classified once, so that parsing, validation, and everything else don't each redo their own string checks
+@dataclasses.dataclass
+class TokenizedTAS:
+    lines: list[str]
+    stripped: list[str]
+    types: array.array  # a LineType per line
+    commands: dict[int, list[str]]  # line num -> command split into name and args, for lines that aren't comments or inputs
+    finaltimes: dict[int, FinalTimeTypes]  # line num -> type of final time the line looks like, before checking for midway
+    breakpoints: list[int]
+    content_hash: Optional[bytes] = None  # only set if tokenized through parse_tas_cached
+
+    def lines_of_type(self, line_type: LineType) -> list[int]:
+        # types are a byte per line, so searching the bytes is a lot faster than looping over them
+        types_bytes = self.types.tobytes()
+        line_type_byte = bytes((line_type,))
+        line_nums = []
+        line_num = types_bytes.find(line_type_byte)
+
+        while line_num != -1:
+            line_nums.append(line_num)
+            line_num = types_bytes.find(line_type_byte, line_num + 1)
+
+        return line_nums
+
+    # the name and args of the first command with this name (case sensitive), if any
+    def find_command(self, name: str) -> Optional[list[str]]:
+        for command_split in self.commands.values():
+            if command_split[0] == name:
+                return command_split
+
+
+def tokenize_tas(tas_lines: list[str]) -> TokenizedTAS:
+    stripped_lines = [line.strip() for line in tas_lines]
+    types = array.array('B', bytes(len(tas_lines)))
+    commands = {}
+    finaltimes = {}
+    breakpoints = []
+
+    for line_num, line in enumerate(stripped_lines):
+        if not line:
+            continue
+        elif line[0].isdigit() and '***' not in line:
+            # most lines are inputs, so skip the call
+            types[line_num] = LineType.INPUT
+            continue
+
+        line_type, command_split, finaltime_type = tokenize_line(tas_lines[line_num], line)
+        types[line_num] = line_type
+
+        if command_split:
+            commands[line_num] = command_split
+
+        if finaltime_type:
+            finaltimes[line_num] = finaltime_type
+
+        if line_type == LineType.BREAKPOINT:
+            breakpoints.append(line_num)
+
+    return TokenizedTAS(tas_lines, stripped_lines, types, commands, finaltimes, breakpoints)
+
+
+# classify a non-empty line, and split it if it's a command. returns the line type, the command split, and what type of final time it looks like
+def tokenize_line(line: str, stripped: str) -> tuple[LineType, Optional[list[str]], Optional[FinalTimeTypes]]:
+    first_char = stripped[0]
+
+    if first_char == '#':
+        if line.startswith('#lvl_'):
+            return LineType.ROOM_LABEL, None, None
+        elif stripped.lower() in ('#start', '# start'):
+            return LineType.START, None, None
+        elif re_comment_time.match(stripped):
+            return LineType.FINAL_TIME, None, FinalTimeTypes.Comment
+        else:
+            return LineType.COMMENT, None, None
+
+    if '***' in stripped:
+        line_type = LineType.BREAKPOINT
+    elif first_char.isdigit():
+        return LineType.INPUT, None, None
+    else:
+        line_type = LineType.COMMAND
+
+    command_split = stripped.split() if re_check_space_command.match(stripped) else stripped.split(',')
+    finaltime_type = None
+
+    # the regexes are slow, so only run them on lines that could match
+    if 'Time: ' in stripped:
+        if re_chapter_time.match(stripped):
+            finaltime_type = FinalTimeTypes.Chapter
+        elif re_file_time.match(stripped):
+            finaltime_type = FinalTimeTypes.File
+
+        if finaltime_type and line_type == LineType.COMMAND:
+            line_type = LineType.FINAL_TIME
+
+    return line_type, command_split, finaltime_type
+
+
+# a time as written in a TAS or message ("0:46.308", "1:02:03.456", "12.699"), parsed into frames once
+@dataclasses.dataclass(frozen=True, slots=True)
+class FrameTime:
+    text: str
+    frames: int
+
+    @classmethod
+    def parse(cls, text: str) -> 'FrameTime':
+        return cls(text, time_to_frames(trim_time(text)))
+
+    # without the leading zeros Studio writes, which is how people usually post times
+    @property
+    def trimmed(self) -> str:
+        return trim_time(self.text)
+
+    # "46.308(2724)", like Studio's ChapterTime lines
+    def with_frames(self) -> str:
+        return f'{self.trimmed}({self.frames})'
+
+    # the difference in frames, so old time - new time is the timesave
+    def __sub__(self, other: 'FrameTime') -> int:
+        return self.frames - other.frames
+
+    def __str__(self) -> str:
+        return self.text
+
+
+def trim_time(time: str) -> str:
+    return time.removeprefix('0:').removeprefix('0')
+
+
+@dataclasses.dataclass
+class ParsedTASFile:
+    breakpoints: List[str]
+    found_finaltime: bool
+    finaltime: Optional[FrameTime]
+    finaltime_line_num: Optional[int]
+    finaltime_type: Optional[FinalTimeTypes]
+
+
+# get breakpoints and final time from the tokenized lines
+# this is easily the worst code in this bot
+def parse_tas_file(tas_lines: Union[list, TokenizedTAS], find_breakpoints: bool, allow_comment_time: bool = True,
+                   required_finaltime_type: Optional[FinalTimeTypes] = None) -> ParsedTASFile:
+    tas_tokens = tas_lines if isinstance(tas_lines, TokenizedTAS) else tokenize_tas(tas_lines)
+    breakpoints = []
+    finaltime_line_num = None
+    finaltime_line = None
+    finaltime_type = None
+
+    if find_breakpoints:
+        for line_num in tas_tokens.breakpoints:
+            log.info(f"Found breakpoint at line {line_num + 1}")
+            breakpoints.append(str(line_num + 1))
+
+    for line_num, line_finaltime_type in tas_tokens.finaltimes.items():
+        line = tas_tokens.stripped[line_num]
+
+        if find_breakpoints and tas_tokens.types[line_num] == LineType.BREAKPOINT:
+            continue
+        elif line_finaltime_type == FinalTimeTypes.Comment and not allow_comment_time:
+            continue
+        elif is_allowed_finaltime_type(line, line_finaltime_type, required_finaltime_type):
+            finaltime_type = line_finaltime_type
+            finaltime_line_num = line_num
+            finaltime_line = line
+
+    return parse_finaltime(breakpoints, finaltime_line, finaltime_line_num, finaltime_type)
+
+
+def parse_finaltime(breakpoints: list[str], finaltime_line: Optional[str], finaltime_line_num: Optional[int], finaltime_type: Optional[FinalTimeTypes]) -> ParsedTASFile:
+    finaltime = None
+    found_finaltime = finaltime_line_num is not None
+
+    if found_finaltime:
+        if finaltime_type in (FinalTimeTypes.Chapter, FinalTimeTypes.File):
+            if finaltime_line.lower().startswith('midway'):
+                finaltime_type = finaltime_type.as_midway()
+
+            finaltime_text = finaltime_line.partition(' ')[2].partition('(')[0]
+        elif finaltime_type == FinalTimeTypes.Comment:
+            finaltime_text = finaltime_line.strip('#\n ').partition(' ')[0].partition('(')[0]
+        else:
+            # this seems unreachable. why does this exist
+            finaltime_text = finaltime_line.lstrip('#0:').partition('(')[0]
+
+        finaltime = FrameTime.parse(re_remove_non_digits.sub('', finaltime_text))
+
+    return ParsedTASFile(breakpoints, found_finaltime, finaltime, finaltime_line_num, finaltime_type)
+
+
+def is_allowed_finaltime_type(line: str, finaltime_type: FinalTimeTypes, required_finaltime_type: Optional[FinalTimeTypes]) -> bool:
+    if required_finaltime_type:
+        if line.lower().startswith('midway'):
+            return finaltime_type.as_midway() == required_finaltime_type
+        else:
+            return finaltime_type == required_finaltime_type
+    else:
+        return True
+
+
+# the same as parse_tas_file, but in one pass over the lines as they're decoded, keeping none of them. check_line gets called with every non-empty line
+def parse_tas_streaming(tas: bytes, find_breakpoints: bool, allow_comment_time: bool = True, required_finaltime_type: Optional[FinalTimeTypes] = None,
+                        check_line: Optional[Callable[[int, str, str, LineType, Optional[list[str]]], None]] = None) -> ParsedTASFile:
+    breakpoints = []
+    finaltime_line_num = None
+    finaltime_line = None
+    finaltime_type = None
+
+    for line_num, line in enumerate(iter_lines(tas)):
+        if not (stripped := line.strip()):
+            continue
+
+        line_type, command_split, line_finaltime_type = tokenize_line(line, stripped)
+
+        if check_line:
+            check_line(line_num, line, stripped, line_type, command_split)
+
+        if line_type == LineType.BREAKPOINT and find_breakpoints:
+            log.info(f"Found breakpoint at line {line_num + 1}")
+            breakpoints.append(str(line_num + 1))
+            continue
+
+        if not line_finaltime_type or (line_finaltime_type == FinalTimeTypes.Comment and not allow_comment_time):
+            continue
+        elif is_allowed_finaltime_type(stripped, line_finaltime_type, required_finaltime_type):
+            finaltime_type = line_finaltime_type
+            finaltime_line_num = line_num
+            finaltime_line = stripped
+
+    return parse_finaltime(breakpoints, finaltime_line, finaltime_line_num, finaltime_type)
+
+
+# for large files: the same checks, but done while walking the lines once, without holding a decoded or tokenized copy of the whole file
+# doesn't do incremental command checking, room frame changes, or SJ data, since those need the tokens
+def validate_streaming(tas: bytes, filename: str, message: MessageData, old_tas: Optional[bytes], project: dict, skip_validation: bool = False,
+                       path_cache: Optional[dict] = None, read_files: Optional[dict[str, bytes]] = None, possible_filename: Optional[str] = None) -> ValidationResult:
+    log.info(f"Validating {filename} in streaming mode")
+    wip_in_message = is_wip(message)
+    old_tas_parsed = parse_tas_streaming(old_tas, False) if old_tas else None
+
+    if skip_validation or wip_in_message:
+        return skipped_validation_result(parse_tas_streaming(tas, True), old_tas_parsed, message, wip_in_message, None)
+
+    # validate file not in excluded items
+    if filename in project['excluded_items']:
+        return ValidationResult(False, ["This filename is excluded from the project."], [f"file {filename} is excluded from project (in {project['excluded_items']})"])
+
+    # validate file has been updated
+    if old_tas and all(line == old_line for line, old_line in itertools.zip_longest(iter_lines(tas), iter_lines(old_tas))):
+        return ValidationResult(False, ["This file is identical to what's already in the repo."], [f"file {filename} is unchanged from repo"])
+
+    # line checks are found during parsing, but reported after the file-wide checks like they are normally
+    line_checks_result = ValidationResult(True, [], [], finished=False)
+    line_state = LineWalkState()
+    compiled_command_rules = compile_command_rules(tuple(tuple(exemption) for exemption in project['disallowed_command_exemptions']))
+    check_room_labels = not project['room_indexing_includes_reads'] or read_files is not None
+    labels_resolver = room_labels_resolver(project, read_files, path_cache)
+    file_path = file_repo_path(filename, project, path_cache)
+
+    def check_line(line_num: int, line: str, stripped: str, line_type: LineType, command_split: Optional[list[str]]):
+        if line_type == LineType.ROOM_LABEL and check_room_labels:
+            validate_room_label(line_checks_result, line_state, line, line_num, filename)
+        elif labels_resolver and command_split and command_split[0].lower() == 'read':
+            walk_read_room_labels(line_state, labels_resolver, file_path, line_num, command_split)
+
+        if not line_state.found_start and line_type == LineType.START:
+            line_state.found_start = True
+        elif command_split:
+            validate_command_split(line_checks_result, command_split, stripped, line_num, line_state.found_start, compiled_command_rules, filename)
+
+    tas_parsed = parse_tas_streaming(tas, True, check_line=check_line)
+    validation_result = ValidationResult(True, [], [], finished=False)
+    validate_breakpoints_and_finaltime(validation_result, tas_parsed, project, filename)
+
+    for warning, log_message in zip(line_checks_result.warning_text, line_checks_result.log_text):
+        validation_result.emit_failed_check(warning, log_message)
+
+    file_checks = FileChecks(validation_result, tas_parsed, old_tas_parsed, line_state.found_start, None, None)
+    return validate_with_file_checks(file_checks, message, filename, project, path_cache, possible_filename)
+
+
+def is_wip(message: MessageData) -> bool:
+    return 'wip' in re_remove_punctuation.subn(' ', message.content.lower())[0].split()
+
+
+def skipped_validation_result(tas_parsed: ParsedTASFile, old_tas_parsed: Optional[ParsedTASFile], message: MessageData, wip_in_message: bool,
+                              rooms_changed: Optional[dict[str, int]]) -> ValidationResult:
+    log.info(f"Skipping validation ({wip_in_message=})")
+    dash_saves = re_dash_saves.search(message.content.partition('\n')[0])
+    # ok this is really ugly, but we do need final time and timesave
+
+    if old_tas_parsed and tas_parsed.found_finaltime and old_tas_parsed.found_finaltime:
+        time_saved_num = old_tas_parsed.finaltime - tas_parsed.finaltime
+        timesave = f'-{time_saved_num}f' if time_saved_num >= 0 else f'+{abs(time_saved_num)}f'
+    elif dash_saves:
+        # techically not timesave but whatever
+        timesave = str(dash_saves[0])
+    else:
+        timesave = None
+
+    return ValidationResult(True, [], [], finaltime=finaltime_text(tas_parsed),
+                            finaltime_frames=finaltime_frames(tas_parsed), timesave=timesave, wip=wip_in_message, rooms_changed=rooms_changed)
+
+
+# validate breakpoint doesn't exist and chaptertime does
+def validate_breakpoints_and_finaltime(validation_result: ValidationResult, tas_parsed: ParsedTASFile, project: dict, filename: str):
     if len(tas_parsed.breakpoints) == 1:
         validation_result.emit_failed_check(f"Breakpoint found on line {tas_parsed.breakpoints[0]}, please remove it (Ctrl+P in Studio) and post again.", f"breakpoint in {filename}")
     elif len(tas_parsed.breakpoints) > 1:
@@ -109,103 +561,99 @@ def validate(tas: bytes, filename: str, message: discord.Message, old_tas: Optio
         else:
             validation_result.emit_failed_check("No ChapterTime found in file, please add one and post again.", f"no ChapterTime in {filename}")
 
-    for line in enumerate(tas_lines):
-        # validate room label indexing
-        if line[1].startswith('#lvl_') and not room_indexing_includes_reads:
-            line_partitioned = line[1].rstrip().rpartition('(')
-            room_name = line_partitioned[0].strip() if line_partitioned[0] else line_partitioned[2].strip()
-            room_index_str = line_partitioned[2].strip(')')
-            room_index = int(room_index_str) if room_index_str.isdigit() else None
-
-            if room_name in rooms_found:
-                if rooms_found[room_name] is None:
-                    validation_result.emit_failed_check(f"Duplicate room label `{line[1]}` found on line {line[0] + 1}, please index revisited rooms starting from zero and post again.",
-                                                        f"duplicate room label {line[1]} on line {line[0] + 1} in {filename}")
-                elif room_index is None:
-                    validation_result.emit_failed_check(f"Missing room label index `{line[1]}` found on line {line[0] + 1}, please index revisited rooms starting from zero and post again.",
-                                                        f"missing room label {line[1]} on line {line[0] + 1} in {filename}")
-                elif room_index <= rooms_found[room_name]:
-                    validation_result.emit_failed_check(f"Out of order room label index `{line[1]}` found on line {line[0] + 1}, "
-                                                        f"please index revisited rooms starting from zero and post again.",
-                                                        f"out of order room label {line[1]} on line {line[0] + 1} in {filename}")
-            else:
-                if uses_one_indexing is None:
-                    match room_index:
-                        case 0:
-                            uses_one_indexing = False
-                        case 1:
-                            uses_one_indexing = True
 
-                if room_index is not None and ((not uses_one_indexing and room_index != 0) or (uses_one_indexing and room_index != 1)):
-                    init_str = "one" if uses_one_indexing else "zero"
-                    validation_result.emit_failed_check(f"Incorrect initial room label index `{line[1]}` found on line {line[0] + 1}, please index revisited rooms "
-                                                        f"starting from {init_str} and post again.", f"incorrect initial room label {line[1]} on line {line[0] + 1} in {filename}")
+# what validation remembers while walking a file's lines
+@dataclasses.dataclass(slots=True)
+class LineWalkState:
+    rooms_found: dict[str, Optional[int]] = dataclasses.field(default_factory=dict)
+    uses_one_indexing: Optional[bool] = None
+    found_start: bool = False
 
-            rooms_found[room_name] = room_index
 
-        # validate command usage
-        line_num = line[0]
-        line_stripped = line[1].strip()
-        line_split = line_stripped.split() if re_check_space_command.match(line_stripped) else line_stripped.split(',')
-        command = line_split[0].lower()
+# with IncludeReads room label indexing (from the project's .studioconfig.toml), Studio indexes labels across the lines that files read, so those need
+# the repo files being read. None if the project doesn't use it, or if the files weren't provided
+def room_labels_resolver(project: dict, read_files: Optional[dict[str, bytes]], path_cache: Optional[dict]):
+    if project['room_indexing_includes_reads'] and read_files is not None:
+        import read_resolver
+        return read_resolver.ReadResolver(read_files, path_cache)
 
-        if not found_start and line_stripped.lower() in ('#start', '# start'):
-            found_start = True
-            continue
 
-        if command in command_rules:
-            if command in disallowed_commands and not found_start:
-                continue
+# the room labels in what a Read command reads only count towards the file's indexing. they're checked when their own files are posted
+def walk_read_room_labels(line_state: LineWalkState, resolver, path: str, line_num: int, command_split: list[str]):
+    read = resolver.resolve_read(path, line_num, command_split)
 
-            exempt_command = False
+    if not read.path or read.start_line_num is None or read.end_line_num is None:
+        return
 
-            for exemption in project['disallowed_command_exemptions']:
-                if command == exemption[0] and exemption[1] in line_stripped.lower():
-                    exempt_command = True
-                    break
+    read_checks_result = ValidationResult(True, [], [], finished=False)
 
-            if exempt_command:
-                continue
+    for read_line_num, line in enumerate(resolver.expand(read.path, read.start_line_num, read.end_line_num, (path,))):
+        if line.startswith('#lvl_'):
+            validate_room_label(read_checks_result, line_state, line, read_line_num, read.path)
 
-            rules_functions = command_rules[command]
 
-            if command in disallowed_commands and isinstance(rules_functions, str):
-                validation_result.emit_failed_check(f"Incorrect `{line_split[0]}` command usage on line {line_num + 1}: {rules_functions}.",
-                                                    f"incorrect command argument in {filename}: {line_split[0]}, {rules_functions}")
-                continue
+# where a file is or would be in the repo, the same as when it's committed
+def file_repo_path(filename: str, project: dict, path_cache: Optional[dict]) -> str:
+    if path_cache and filename in path_cache:
+        return path_cache[filename]
 
-            args = [i.strip() for i in line_split[1:] if i]
-            required_args_count = len([f for f in rules_functions if not isinstance(f, OptionalArg)])
-            args_count_options = required_args_count if required_args_count == len(rules_functions) else f"{required_args_count}-{len(rules_functions)}"
+    return f"{project['subdir']}/{filename}" if project.get('subdir') else filename
 
-            if len(args) < required_args_count or len(args) > len(rules_functions):
-                validation_result.emit_failed_check(f"Incorrect number of arguments to `{line_split[0]}` command on line {line_num + 1}: is {len(args)}, should be {args_count_options}.",
-                                                    f"incorrect command arguments count in {filename}: {line_split[0]}, {len(args)} vs {args_count_options}")
 
-            for arg in enumerate(args[:len(rules_functions)]):
-                rules_function = rules_functions[arg[0]]
+def validate_room_label(validation_result: ValidationResult, line_state: LineWalkState, line: str, line_num: int, filename: str):
+    line_partitioned = line.rstrip().rpartition('(')
+    room_name = line_partitioned[0].strip() if line_partitioned[0] else line_partitioned[2].strip()
+    room_index_str = line_partitioned[2].strip(')')
+    room_index = int(room_index_str) if room_index_str.isdigit() else None
+    rooms_found = line_state.rooms_found
 
-                if isinstance(rules_function, OptionalArg):
-                    rules_function = rules_function.validate_func
+    if room_name in rooms_found:
+        if rooms_found[room_name] is None:
+            validation_result.emit_failed_check(f"Duplicate room label `{line}` found on line {line_num + 1}, please index revisited rooms starting from zero and post again.",
+                                                f"duplicate room label {line} on line {line_num + 1} in {filename}")
+        elif room_index is None:
+            validation_result.emit_failed_check(f"Missing room label index `{line}` found on line {line_num + 1}, please index revisited rooms starting from zero and post again.",
+                                                f"missing room label {line} on line {line_num + 1} in {filename}")
+        elif room_index <= rooms_found[room_name]:
+            validation_result.emit_failed_check(f"Out of order room label index `{line}` found on line {line_num + 1}, "
+                                                f"please index revisited rooms starting from zero and post again.",
+                                                f"out of order room label {line} on line {line_num + 1} in {filename}")
+    else:
+        if line_state.uses_one_indexing is None:
+            match room_index:
+                case 0:
+                    line_state.uses_one_indexing = False
+                case 1:
+                    line_state.uses_one_indexing = True
+
+        uses_one_indexing = line_state.uses_one_indexing
 
-                if isinstance(rules_function, Callable):
-                    arg_validity = rules_function(arg[1])
+        if room_index is not None and ((not uses_one_indexing and room_index != 0) or (uses_one_indexing and room_index != 1)):
+            init_str = "one" if uses_one_indexing else "zero"
+            validation_result.emit_failed_check(f"Incorrect initial room label index `{line}` found on line {line_num + 1}, please index revisited rooms "
+                                                f"starting from {init_str} and post again.", f"incorrect initial room label {line} on line {line_num + 1} in {filename}")
 
-                    if arg_validity is not True:
-                        validation_result.emit_failed_check(f"Incorrect `{line_split[0]}` command usage on line {line_num + 1}: {arg_validity}.",
-                                                            f"incorrect command argument in {filename}: {line_split[0]}, {arg_validity}")
+    rooms_found[room_name] = room_index
 
+
+# the checks that involve the message: final time, timesave, draft, and level name. returns the timesave
+def validate_message(validation_result: ValidationResult, tas_parsed: ParsedTASFile, old_tas_parsed: Optional[ParsedTASFile], message: MessageData, filename: str,
+                     project: dict, path_cache: Optional[dict], found_start: bool, rooms_changed: Optional[dict[str, int]] = None,
+                     possible_filename: Optional[str] = None) -> Optional[str]:
+    message_lowercase = message.content.lower()
+    dash_saves = re_dash_saves.search(message.content.partition('\n')[0])
+    got_timesave = False
     time_saved_messages: Union[None, re.Match] = None
 
     # validate chaptertime is in message content
-    if tas_parsed.finaltime:
+    if finaltime := tas_parsed.finaltime:
         if project['is_lobby']:
-            if tas_parsed.finaltime not in message.content:
-                validation_result.emit_failed_check(f"The file's final time ({tas_parsed.finaltime}) is missing in your message, please add it and post again.",
-                                                    f"final time ({tas_parsed.finaltime}) missing in message content")
+            if finaltime.text not in message.content:
+                validation_result.emit_failed_check(f"The file's final time ({finaltime}) is missing in your message, please add it and post again.",
+                                                    f"final time ({finaltime}) missing in message content")
         else:
-            if tas_parsed.finaltime not in message.content and tas_parsed.finaltime_trimmed not in message.content:
-                chapter_time_notif = tas_parsed.finaltime if tas_parsed.finaltime == tas_parsed.finaltime_trimmed else tas_parsed.finaltime_trimmed
+            if finaltime.text not in message.content and finaltime.trimmed not in message.content:
+                chapter_time_notif = finaltime.trimmed
                 validation_result.emit_failed_check(f"The file's ChapterTime ({chapter_time_notif}) is missing in your message, please add it and post again.",
                                                     f"ChapterTime ({chapter_time_notif}) missing in message content")
 
@@ -214,21 +662,21 @@ def validate(tas: bytes, filename: str, message: discord.Message, old_tas: Optio
         validation_result.emit_failed_check(f"No `#Start` found in file, please add one between the console load frame and the intro frames (or first room label if none) and post again.",
                                             f"no #Start in file")
 
-    if old_tas:
+    if old_tas_parsed:
         # validate timesave frames is in message content
-        old_tas_parsed = parse_tas_file(as_lines(old_tas), False)
-
         if not old_tas_parsed.found_finaltime:
             log.info("Old file has no final time, skipping validating timesave")
         elif not tas_parsed.found_finaltime:
             log.info("New file has no final time, skipping validating timesave")
         else:
-            time_saved_num = calculate_time_difference(old_tas_parsed.finaltime, tas_parsed.finaltime)
+            time_saved_num = old_tas_parsed.finaltime - tas_parsed.finaltime
             time_saved_minus = f'-{abs(time_saved_num)}f'
             time_saved_plus = f'+{abs(time_saved_num)}f'
             time_saved_messages = re_timesave_frames.search(message.content)
             got_timesave = True
-            linn_moment = " (you suck at math lol)" if message.author.id == 238029047567876096 else ""
+            linn_moment = " (you suck at math lol)" if message.author_id == 238029047567876096 else ""
+            # where the frames went, to help figure out what's wrong
+            rooms_changed_text = f" {format_rooms_changed(rooms_changed)}." if rooms_changed else ""
             # ok this logic is weird cause it can be '-f', '+f', or in the case of 0 frames saved, either one
 
             if not time_saved_messages:
@@ -237,28 +685,31 @@ def validate(tas: bytes, filename: str, message: discord.Message, old_tas: Optio
                 else:
                     time_saved_options = time_saved_minus if time_saved_num >= 0 else time_saved_plus
 
-                validation_result.emit_failed_check(f"Please mention how many frames were saved or lost, with the text \"{time_saved_options}\" (if that's correct), and post again.",
+                validation_result.emit_failed_check(f"Please mention how many frames were saved or lost, with the text \"{time_saved_options}\" (if that's correct), and post again."
+                                                    f"{rooms_changed_text}",
                                                     f"no timesave in message (should be {time_saved_options})")
             else:
                 if time_saved_num == 0:
                     if time_saved_messages[0] not in ('-0f', '+0f', '±0f'):
                         validation_result.emit_failed_check(f"Frames saved is incorrect (you said \"{time_saved_messages[0]}\", but it seems to be \"-0f\" or \"+0f\"), "
-                                                            f"please fix and post again{linn_moment}. Make sure you updated the time and improved the latest version of the file.",
+                                                            f"please fix and post again{linn_moment}. Make sure you updated the time and improved the latest version of the file."
+                                                            f"{rooms_changed_text}",
                                                             f"incorrect time saved in message (is \"{time_saved_messages[0]}\", should be \"-0f\" or \"+0f\")")
                 else:
                     time_saved_actual = time_saved_minus if time_saved_num >= 0 else time_saved_plus
 
                     if time_saved_messages[0] != time_saved_actual:
                         validation_result.emit_failed_check(f"Frames saved is incorrect (you said \"{time_saved_messages[0]}\", but it seems to be \"{time_saved_actual}\"), "
-                                                            f"please fix and post again{linn_moment}. Make sure you updated the time and improved the latest version of the file.",
+                                                            f"please fix and post again{linn_moment}. Make sure you updated the time and improved the latest version of the file."
+                                                            f"{rooms_changed_text}",
                                                             f"incorrect time saved in message (is \"{time_saved_messages[0]}\", should be \"{time_saved_actual}\")")
     else:
         # validate draft text
         if "draft" not in message_lowercase:
-            path_cache = db.path_caches.get(message.channel.id)
+            if path_cache is None:
+                path_cache = db.path_caches.get(message.channel_id)
 
             if path_cache:
-                possible_filename = fuzz_possible_filename(filename, path_cache.keys())
                 did_you_mean_text = f" (did you mean `{possible_filename}`?)" if possible_filename else ""
                 shouldnt_be_draft_text = f" If it shouldn't be a draft, make sure your filename is exactly the same as in the repo{did_you_mean_text}."
             else:
@@ -283,129 +734,246 @@ def validate(tas: bytes, filename: str, message: discord.Message, old_tas: Optio
             validation_result.emit_failed_check("The level name is missing in your message, please add it and post again.", f"level name {filenames_level} missing in message content")
 
     if got_timesave:
-        timesave = str(time_saved_messages[0]) if time_saved_messages else None
-    elif is_dash_save:
+        return str(time_saved_messages[0]) if time_saved_messages else None
+    elif dash_saves:
         # techically not timesave but whatever
-        timesave = str(dash_saves[0])
-    else:
-        timesave = None
+        return str(dash_saves[0])
 
-    sj_data = (tas_lines, tas_parsed.finaltime_line_num) if message.channel.id == 1074148268407275520 else None
-    validation_result.finaltime = tas_parsed.finaltime
-    validation_result.finaltime_frames = tas_parsed.finaltime_frames
-    validation_result.timesave = timesave
-    validation_result.sj_data = sj_data
-    validation_result.finish()
-    return validation_result
 
+# validate a command's usage and args, if it's one that has rules
+def validate_command(validation_result: ValidationResult, tas_tokens: TokenizedTAS, line_num: int, found_start: bool, compiled_command_rules: dict, filename: str):
+    validate_command_split(validation_result, tas_tokens.commands[line_num], tas_tokens.stripped[line_num], line_num, found_start, compiled_command_rules, filename)
 
-class FinalTimeTypes(enum.Enum):
-    Chapter = 0
-    MidwayChapter = 1
-    File = 2
-    MidwayFile = 3
-    Comment = 4
 
-    def as_midway(self):
-        match self:
-            case self.Chapter:
-                return self.MidwayChapter
-            case self.File:
-                return self.MidwayFile
-            case _:
-                return self
+def validate_command_split(validation_result: ValidationResult, line_split: list[str], line_stripped: str, line_num: int, found_start: bool, compiled_command_rules: dict,
+                           filename: str):
+    command_rule: Optional[CompiledCommandRule] = compiled_command_rules.get(line_split[0].lower())
 
+    if not command_rule or (command_rule.disallowed and not found_start):
+        return
 
-@dataclasses.dataclass
-class ParsedTASFile:
-    breakpoints: List[str]
-    found_finaltime: bool
-    finaltime: Optional[str]
-    finaltime_trimmed: Optional[str]
-    finaltime_line_num: Optional[int]
-    finaltime_frames: Optional[int]
-    finaltime_type: Optional[FinalTimeTypes]
+    if command_rule.exemptions:
+        line_lower = line_stripped.lower()
 
+        if any(exemption in line_lower for exemption in command_rule.exemptions):
+            return
 
-# get breakpoints and final time in one pass
-# this is easily the worst code in this bot
-def parse_tas_file(tas_lines: list, find_breakpoints: bool, allow_comment_time: bool = True, required_finaltime_type: Optional[FinalTimeTypes] = None) -> ParsedTASFile:
-    breakpoints = []
-    finaltime_line_num = None
-    finaltime = None
-    finaltime_trimmed = None
-    finaltime_frames = None
-    finaltime_type = None
+    if command_rule.disallowed_reason:
+        validation_result.emit_failed_check(f"Incorrect `{line_split[0]}` command usage on line {line_num + 1}: {command_rule.disallowed_reason}.",
+                                            f"incorrect command argument in {filename}: {line_split[0]}, {command_rule.disallowed_reason}")
+        return
 
-    def is_allowed_finaltime_type(line_, type_) -> bool:
-        if required_finaltime_type:
-            if line_.lower().startswith('midway'):
-                return type_.as_midway() == required_finaltime_type
-            else:
-                return type_ == required_finaltime_type
-        else:
-            return True
+    args = [i.strip() for i in line_split[1:] if i]
 
-    for line_enum in enumerate(tas_lines):
-        line_num, line = line_enum[0], line_enum[1].strip()
+    if not command_rule.min_args <= len(args) <= command_rule.max_args:
+        validation_result.emit_failed_check(f"Incorrect number of arguments to `{line_split[0]}` command on line {line_num + 1}: is {len(args)}, "
+                                            f"should be {command_rule.args_count_options}.",
+                                            f"incorrect command arguments count in {filename}: {line_split[0]}, {len(args)} vs {command_rule.args_count_options}")
 
-        if find_breakpoints and '***' in line and not line.startswith('#'):
-            log.info(f"Found breakpoint at line {line_num + 1}")
-            breakpoints.append(str(line_num + 1))
+    for arg, arg_validator in zip(args, command_rule.arg_validators):
+        if arg_validator and (arg_validity := arg_validator(arg)) is not True:
+            validation_result.emit_failed_check(f"Incorrect `{line_split[0]}` command usage on line {line_num + 1}: {arg_validity}.",
+                                                f"incorrect command argument in {filename}: {line_split[0]}, {arg_validity}")
+
+
+@dataclasses.dataclass(frozen=True)
+class CompiledCommandRule:
+    disallowed: bool
+    disallowed_reason: Optional[str]
+    min_args: int
+    max_args: int
+    args_count_options: Union[int, str]
+    arg_validators: tuple[Optional[Callable], ...]
+    exemptions: tuple[str, ...]  # the command is allowed if the line contains any of these
+
+
+# command_rules with everything that doesn't change per line worked out ahead of time, for a project's exemptions
+@functools.lru_cache(maxsize=64)
+def compile_command_rules(exemptions: tuple[tuple[str, str], ...]) -> dict[str, CompiledCommandRule]:
+    compiled_command_rules = {}
+
+    for command, rules_functions in command_rules.items():
+        command_exemptions = tuple(exemption[1] for exemption in exemptions if exemption[0] == command)
+        disallowed = command in disallowed_commands
+
+        if isinstance(rules_functions, str):
+            compiled_command_rules[command] = CompiledCommandRule(disallowed, rules_functions, 0, 0, 0, (), command_exemptions)
+            continue
+
+        required_args_count = len([f for f in rules_functions if not isinstance(f, OptionalArg)])
+        args_count_options = required_args_count if required_args_count == len(rules_functions) else f"{required_args_count}-{len(rules_functions)}"
+        arg_validators = tuple(rules_function.validate_func if isinstance(rules_function, OptionalArg) else rules_function for rules_function in rules_functions)
+        arg_validators = tuple(arg_validator if isinstance(arg_validator, Callable) else None for arg_validator in arg_validators)
+        compiled_command_rules[command] = CompiledCommandRule(disallowed, None, required_args_count, len(rules_functions), args_count_options, arg_validators, command_exemptions)
+
+    return compiled_command_rules
+
+
+# returns the new file's unchanged lines mapped to their old line nums, and the new line nums where anything was changed, added, or removed
+def diff_lines(old_lines: list[str], new_lines: list[str]) -> tuple[dict[int, int], set[int]]:
+    # most improvements only touch a small part of the file, so skip the matching ends before doing a real diff
+    prefix_length = 0
+    suffix_length = 0
+    max_shared_length = min(len(old_lines), len(new_lines))
+
+    while prefix_length < max_shared_length and old_lines[prefix_length] == new_lines[prefix_length]:
+        prefix_length += 1
+
+    while suffix_length < max_shared_length - prefix_length and old_lines[-suffix_length - 1] == new_lines[-suffix_length - 1]:
+        suffix_length += 1
+
+    unchanged_lines = {line_num: line_num for line_num in range(prefix_length)}
+    unchanged_lines.update({len(new_lines) - offset: len(old_lines) - offset for offset in range(1, suffix_length + 1)})
+    changed_lines = set()
+    sequence_matcher = difflib.SequenceMatcher(None, old_lines[prefix_length:len(old_lines) - suffix_length], new_lines[prefix_length:len(new_lines) - suffix_length])
+
+    for tag, old_start, old_end, new_start, new_end in sequence_matcher.get_opcodes():
+        if tag == 'equal':
+            unchanged_lines.update({prefix_length + new_start + offset: prefix_length + old_start + offset for offset in range(new_end - new_start)})
+        elif tag == 'delete':
+            changed_lines.add(max(prefix_length + new_start - 1, 0))
         else:
-            if re_chapter_time.match(line) and is_allowed_finaltime_type(line, FinalTimeTypes.Chapter):
-                finaltime_type = FinalTimeTypes.Chapter
-                finaltime_line_num = line_num
-                finaltime_line = line
-            elif re_file_time.match(line) and is_allowed_finaltime_type(line, FinalTimeTypes.File):
-                finaltime_type = FinalTimeTypes.File
-                finaltime_line_num = line_num
-                finaltime_line = line
-            elif allow_comment_time and re_comment_time.match(line) and is_allowed_finaltime_type(line, FinalTimeTypes.Comment):
-                finaltime_type = FinalTimeTypes.Comment
-                finaltime_line_num = line_num
-                finaltime_line = line
+            changed_lines.update(range(prefix_length + new_start, prefix_length + new_end))
 
-    found_finaltime = finaltime_line_num is not None
+    return unchanged_lines, changed_lines
 
-    if found_finaltime:
-        if finaltime_type in (FinalTimeTypes.Chapter, FinalTimeTypes.File):
-            if finaltime_line.lower().startswith('midway'):
-                finaltime_type = finaltime_type.as_midway()
 
-            finaltime_components = finaltime_line.partition(' ')[2].partition('(')
-            finaltime = finaltime_components[0]
-            finaltime_trimmed = finaltime.removeprefix('0:').removeprefix('0').strip()
+@dataclasses.dataclass
+class TASDiff:
+    unchanged_lines: dict[int, int]  # new line num -> old line num
+    changed_lines: set[int]
+    rooms_changed: dict[str, int]  # room -> frames gained or lost, for rooms with any changed lines, in file order (then removed rooms)
+
+
+# compare two versions of a file room by room, matching rooms by label (and which visit to the room it is). only rooms that changed get diffed and have their
+# frames counted, so this stays fast for big files. frames from Reads aren't counted
+def diff_tas(old_tas_tokens: TokenizedTAS, tas_tokens: TokenizedTAS) -> TASDiff:
+    import frame_count
+    old_lines, new_lines = old_tas_tokens.lines, tas_tokens.lines
+    old_room_blocks = room_blocks(old_tas_tokens)
+    new_room_blocks = room_blocks(tas_tokens)
+    old_blocks = dict(zip(room_block_keys(old_room_blocks), old_room_blocks))
+    unchanged_lines = {}
+    changed_lines = set()
+    changed_blocks = []
+    changed_old_blocks = dict(old_blocks)
+
+    for key, block in zip(room_block_keys(new_room_blocks), new_room_blocks):
+        room, start_line_num, end_line_num = block
+        old_block = old_blocks.get(key)
+
+        if old_block and old_lines[old_block[1]:old_block[2]] == new_lines[start_line_num:end_line_num]:
+            unchanged_lines.update(zip(range(start_line_num, end_line_num), range(old_block[1], old_block[2])))
+            del changed_old_blocks[key]
+            continue
+
+        changed_blocks.append(block)
+
+        if old_block:
+            block_unchanged_lines, block_changed_lines = diff_lines(old_lines[old_block[1]:old_block[2]], new_lines[start_line_num:end_line_num])
+            unchanged_lines.update({start_line_num + line_num: old_block[1] + old_line_num for line_num, old_line_num in block_unchanged_lines.items()})
+            changed_lines.update(start_line_num + line_num for line_num in block_changed_lines)
         else:
-            if finaltime_type == FinalTimeTypes.Comment:
-                finaltime_components = finaltime_line.strip('#\n ').partition(' ')[0].partition('(')
-                finaltime = finaltime_components[0].rstrip()
-                finaltime_trimmed = finaltime.removeprefix('0:').removeprefix('0')
-            else:
-                # this seems unreachable. why does this exist
-                finaltime_components = finaltime_line.lstrip('#0:').partition('(')
-                finaltime = finaltime_trimmed = finaltime_components[0].strip()
+            changed_lines.update(range(start_line_num, end_line_num))
+
+    rooms_changed = {}
+
+    if changed_blocks or changed_old_blocks:
+        frames = frame_count.line_frames(tas_tokens, '', None, [], (), [block[1:] for block in changed_blocks])
+        old_frames = frame_count.line_frames(old_tas_tokens, '', None, [], (), [block[1:] for block in changed_old_blocks.values()])
+
+        for block_frames, blocks, sign in ((frames, changed_blocks, 1), (old_frames, changed_old_blocks.values(), -1)):
+            for room, start_line_num, end_line_num in blocks:
+                if room is not None:
+                    rooms_changed[room] = rooms_changed.get(room, 0) + sign * int(block_frames[start_line_num:end_line_num].sum())
+
+    return TASDiff(unchanged_lines, changed_lines, rooms_changed)
+
+
+# a file split at its room labels, as (room, start line num, end line num). lines before the first label are in room None
+def room_blocks(tas_tokens: TokenizedTAS) -> list[tuple[Optional[str], int, int]]:
+    room_label_line_nums = tas_tokens.lines_of_type(LineType.ROOM_LABEL)
+    rooms = [None] + [tas_tokens.stripped[line_num].removeprefix('#lvl_') for line_num in room_label_line_nums]
+    return list(zip(rooms, [0] + room_label_line_nums, room_label_line_nums + [len(tas_tokens.lines)]))
+
+
+# (room, visit number), so that revisits without indexes still line up
+def room_block_keys(blocks: list[tuple[Optional[str], int, int]]) -> list[tuple[Optional[str], int]]:
+    visits = collections.Counter()
+    keys = []
+
+    for room, _, _ in blocks:
+        keys.append((room, visits[room]))
+        visits[room] += 1
+
+    return keys
+
+
+def format_rooms_changed(rooms: dict[str, int], filename: Optional[str] = None) -> str:
+    rooms_formatted = [f"{room} ({'+' if frames > 0 else ''}{frames}f)" if frames else room for room, frames in rooms.items()]
+    rooms_text = ', '.join(rooms_formatted) if len(rooms) <= 10 else f"{', '.join(rooms_formatted[:10])}, and {len(rooms) - 10} more"
+    return f"Rooms changed{f' in {filename}' if filename else ''}: {rooms_text}"
+
+
+def is_before_start(line_num: int, start_line_num: Optional[int]) -> bool:
+    return start_line_num is None or line_num < start_line_num
+
 
-        finaltime = re_remove_non_digits.sub('', finaltime)
-        finaltime_trimmed = re_remove_non_digits.sub('', finaltime_trimmed)
-        finaltime_frames = time_to_frames(finaltime_trimmed)
+# the same files get parsed over and over (old repo files, reposts, sync checks), so keep recent results
+# these are shared between callers, so don't modify them
+def parse_tas_cached(tas: bytes, find_breakpoints: bool, allow_comment_time: bool = True,
+                     required_finaltime_type: Optional[FinalTimeTypes] = None) -> tuple[ParsedTASFile, TokenizedTAS]:
+    tas_hash = hashlib.blake2b(tas, digest_size=16).digest()
+    parse_key = (tas_hash, find_breakpoints, allow_comment_time, required_finaltime_type)
 
-    return ParsedTASFile(breakpoints, found_finaltime, finaltime, finaltime_trimmed, finaltime_line_num, finaltime_frames, finaltime_type)
+    if (tas_tokens := tokenized_tas_cache.get(tas_hash)) is None:
+        tas_tokens = tokenize_tas(as_lines(tas))
+        tas_tokens.content_hash = tas_hash
+        tokenized_tas_cache.put(tas_hash, tas_tokens)
 
+    if (tas_parsed := parsed_tas_cache.get(parse_key)) is None:
+        tas_parsed = parse_tas_file(tas_tokens, find_breakpoints, allow_comment_time, required_finaltime_type)
+        parsed_tas_cache.put(parse_key, tas_parsed)
 
-def calculate_time_difference(time_old: Union[str, int], time_new: Union[str, int]) -> int:
-    time_frames_old = time_old if isinstance(time_old, int) else time_to_frames(time_old)
-    time_frames_new = time_new if isinstance(time_new, int) else time_to_frames(time_new)
+    return tas_parsed, tas_tokens
 
-    if time_old == time_new:
-        return 0
 
-    return time_frames_old - time_frames_new
+class LRUCache:
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.items = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
 
+    def get(self, key):
+        with self.lock:
+            if key in self.items:
+                self.items.move_to_end(key)
+                self.hits += 1
+                return self.items[key]
 
+            self.misses += 1
+
+    def put(self, key, value):
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+
+# in integers, so that there's no float error to round away. a frame is 17 ms
 def time_to_frames(time: str) -> int:
     if ':' not in time:
-        return round(float(time) / 0.017)
+        seconds, _, fraction = time.strip().partition('.')
+        fraction_scale = 10 ** len(fraction)
+        return round_divide((int(seconds or '0') * fraction_scale + int(fraction or '0')) * 1000, 17 * fraction_scale)
 
     colon_partition = time.rpartition(':')
     dot_partition = colon_partition[2].partition('.')
@@ -413,14 +981,41 @@ def time_to_frames(time: str) -> int:
     hours = minutes.partition(':')[0] if ':' in minutes else '0'
     seconds = dot_partition[0]
     ms = dot_partition[2]
-    time_seconds = (int(hours) * 3600) + (int(minutes[-2:]) * 60) + int(seconds) + (int(ms) / 1000)
-    return round(time_seconds / 0.017)
+    time_ms = ((int(hours) * 3600) + (int(minutes[-2:]) * 60) + int(seconds)) * 1000 + int(ms)
+    return round_divide(time_ms, 17)
+
+
+# same as round(numerator / denominator), ties to even included
+def round_divide(numerator: int, denominator: int) -> int:
+    quotient, remainder = divmod(numerator, denominator)
+
+    if remainder * 2 > denominator or (remainder * 2 == denominator and quotient % 2):
+        quotient += 1
+
+    return quotient
 
 
 def as_lines(tas: bytes) -> List[str]:
     return tas.decode('UTF8').splitlines()
 
 
+# the same lines as as_lines, but decoded a chunk at a time, so a large file never has a full decoded copy
+def iter_lines(tas: bytes) -> Iterator[str]:
+    decoder = codecs.getincrementaldecoder('UTF8')()
+    tas_view = memoryview(tas)
+    partial_line = ''
+
+    for chunk_start in range(0, len(tas_view), stream_chunk_size):
+        lines = (partial_line + decoder.decode(tas_view[chunk_start:chunk_start + stream_chunk_size])).splitlines(keepends=True)
+        # the last line might continue in the next chunk, including a \r that's half of a \r\n
+        partial_line = lines.pop() if lines and (lines[-1].endswith('\r') or len(lines[-1].splitlines()[0]) == len(lines[-1])) else ''
+
+        for line in lines:
+            yield line[:-2] if line.endswith('\r\n') else line[:-1]
+
+    yield from (partial_line + decoder.decode(b'', final=True)).splitlines()
+
+
 def filter_out_links(text: str):
     def replace_link(match):
         return match.group(1)
@@ -433,10 +1028,17 @@ def filter_out_links(text: str):
     return text_filtered
 
 
-def fuzz_possible_filename(filename: str, path_cache_filenames):
-    from rapidfuzz import process as fuzzy_process
-    fuzzes = fuzzy_process.extract(filename, path_cache_filenames)
-    return fuzzes[0][0] if fuzzes[0][1] >= 90 else None
+def fuzz_possible_filename(filename: str, path_cache_filenames, project_id: Union[int, str]) -> Optional[str]:
+    return fuzzy_index.project_index(project_id, path_cache_filenames).best_match(filename, 90)
+
+
+# the filename to suggest for a file that isn't in the repo, found before validating since the bot's fuzzy indexes are only kept in its main process
+def draft_possible_filename(filename: str, path_cache: Optional[dict], project_id: Union[int, str]) -> Optional[str]:
+    if path_cache is None:
+        path_cache = db.path_caches.get(project_id)
+
+    if path_cache and filename not in path_cache:
+        return fuzz_possible_filename(filename, path_cache.keys(), project_id)
 
 
 class OptionalArg:
@@ -454,6 +1056,13 @@ re_remove_non_digits = re.compile(r'[^\d.:]')
 re_check_space_command = re.compile(r'^[^,]+?\s+[^,]')
 re_markdown_link = re.compile(r'\[([^]]+)]\([^)]+\)')
 log: Union[logging.Logger, utils.LogPlaceholder] = utils.LogPlaceholder()
+parsed_tas_cache = LRUCache(256)
+tokenized_tas_cache = LRUCache(128)
+max_tas_size = 4 * 1048576
+max_tokenized_size = 204800  # larger files are validated in streaming mode
+stream_chunk_size = 65536
+file_checks_project_keys = ('disallowed_command_exemptions', 'excluded_items', 'is_lobby', 'room_indexing_includes_reads', 'subdir')
+command_check_cache = LRUCache(128)  # (content hash, project's command exemptions) -> (lines with failed commands, #Start line)
 
 analog_modes = (('ignore', 'circle', 'square', 'precise'), "Ignore, Circle, Square, or Precise")
 assert_conditions = (('equal', 'notequal', 'contain', 'notcontain', 'startwith', 'notstartwith', 'endwith', 'notendwith'),
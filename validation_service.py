@@ -0,0 +1,267 @@
+import argparse
+import http.server
+import logging
+import subprocess
+import sys
+import threading
+import time
+import tomllib
+from pathlib import Path
+from typing import Optional, Union
+
+import orjson
+
+import blob_cache
+import read_resolver
+import revalidate
+import utils
+import validation
+
+
+# check files the same way the bot does before they get posted, for Studio and other local tools. runs as a local HTTP server, or once from the command line
+# requests are JSON, and can be batched by sending a list of them:
+# {"filename": "1A.tas", "tas": "file text", "message": "-10f 1A (1:23.456)", "old_tas": "optional, otherwise found in --repo", "project": {optional project settings}}
+def run_service():
+    global log
+    log = logging.getLogger('validation_service')
+    log.setLevel(logging.INFO)
+    log.addHandler(logging.StreamHandler())
+    validation.log = logging.getLogger('validation_service_validation')
+    validation.log.setLevel(logging.WARNING)
+    validation.log.addHandler(logging.StreamHandler())
+
+    parser = argparse.ArgumentParser(description="Validate TAS files before posting them, as a local HTTP server or from the command line")
+    parser.add_argument('--repo', help="Local clone of the project's repo, for old versions of files and Read commands")
+    parser.add_argument('--project', help="JSON file of project settings to use by default")
+    subparsers = parser.add_subparsers(dest='mode', required=True)
+    serve_parser = subparsers.add_parser('serve', help="Run an HTTP server that takes POST requests to /validate")
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8470)
+    check_parser = subparsers.add_parser('check', help="Validate files and print the results as JSON")
+    check_parser.add_argument('files', help="TAS files to check, or \"-\" to read JSON requests from stdin", nargs='+')
+    check_parser.add_argument('--message', help="The text the files will be posted with", default='')
+    check_parser.add_argument('--old', help="Old version of the file, instead of finding it in --repo")
+    args = parser.parse_args()
+
+    project = orjson.loads(Path(args.project).read_bytes()) if args.project else {}
+    service = ValidationService(Path(args.repo) if args.repo else None, project)
+
+    if args.mode == 'serve':
+        server = http.server.ThreadingHTTPServer((args.host, args.port), ValidationRequestHandler)
+        server.service = service
+        log.info(f"Serving on http://{args.host}:{server.server_port}/validate")
+        server.serve_forever()
+    elif args.files == ['-']:
+        sys.stdout.buffer.write(orjson.dumps(service.handle(orjson.loads(sys.stdin.buffer.read())), option=orjson.OPT_INDENT_2))
+    else:
+        if args.old and len(args.files) > 1:
+            parser.error("--old only works with one file")
+
+        requests = [{'filename': Path(file).name, 'tas': Path(file).read_text('UTF8'), 'message': args.message} for file in args.files]
+
+        if args.old:
+            requests[0]['old_tas'] = Path(args.old).read_text('UTF8')
+
+        sys.stdout.buffer.write(orjson.dumps(service.handle(requests), option=orjson.OPT_INDENT_2))
+
+
+class ValidationService:
+    def __init__(self, repo_folder: Optional[Path] = None, project: Optional[dict] = None):
+        self.repo_folder = repo_folder
+        self.project = revalidate.default_project | (project if project else {})
+        self.repo_files: dict[str, bytes] = {}
+        self.blobs: dict[str, bytes] = {}  # blob SHA -> content, so that refreshing only reads what changed
+        self.head_sha: Optional[str] = None
+        self.path_cache: dict[str, str] = {}
+        self.resolver: Optional[read_resolver.ReadResolver] = None
+        self.last_refresh_time = 0.0
+        self.file_checks_cache = validation.LRUCache(64)  # (file blob SHA, old file blob SHA, validation.file_checks_context) -> validation.FileChecks
+        self.lock = threading.Lock()
+
+        if repo_folder:
+            self.refresh_repo()
+
+    # old files are the repo's committed versions, since those are what the bot compares against (and the working copy is probably what's being checked)
+    # they're all parsed ahead of time so that they're warm
+    def refresh_repo(self):
+        if not self.repo_folder or time.monotonic() - self.last_refresh_time < repo_refresh_interval:
+            return
+
+        self.last_refresh_time = time.monotonic()
+        start_time = time.perf_counter()
+        head = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=self.repo_folder, capture_output=True)
+        head_sha = head.stdout.decode('UTF8').strip() if head.returncode == 0 else None
+
+        if head_sha and head_sha == self.head_sha:
+            return
+        elif head_sha:
+            blob_shas = committed_blob_shas(self.repo_folder, head_sha)
+            committed_shas = set(blob_shas.values())
+            self.blobs = {sha: content for sha, content in self.blobs.items() if sha in committed_shas}
+            self.blobs.update(read_blobs(self.repo_folder, sorted(committed_shas - self.blobs.keys())))
+            repo_files = {path: self.blobs[sha] for path, sha in blob_shas.items()}
+        else:
+            # not a git repo, so just use the files as they are
+            repo_files = {tas_path.relative_to(self.repo_folder).as_posix(): tas_path.read_bytes() for tas_path in self.repo_folder.rglob('*.tas')}
+
+        repo_files = {path: content for path, content in sorted(repo_files.items()) if revalidate.is_included(path, self.project)}
+        self.head_sha = head_sha
+
+        if repo_files == self.repo_files:
+            return
+
+        self.repo_files = repo_files
+        self.path_cache = {path.rpartition('/')[2]: path for path in repo_files}
+        self.resolver = read_resolver.ReadResolver(repo_files, self.path_cache)
+
+        for content in list(repo_files.values())[:validation.parsed_tas_cache.max_size]:
+            try:
+                validation.parse_tas_cached(content, False)
+            except UnicodeDecodeError:
+                pass
+
+        studioconfig_path = self.repo_folder / self.project['subdir'] / '.studioconfig.toml'
+
+        if studioconfig_path.is_file():
+            with open(studioconfig_path, 'rb') as studioconfig_file:
+                self.project['room_indexing_includes_reads'] = tomllib.load(studioconfig_file).get('RoomLabelIndexing') == 'IncludeReads'
+
+        log.info(f"Loaded {len(repo_files)} files from {self.repo_folder}{f' at {head_sha[:7]}' if head_sha else ''} in {time.perf_counter() - start_time:.3f}s")
+
+    # a request or a list of them. validation is CPU bound anyway, so requests from multiple connections just take turns
+    def handle(self, requests: Union[dict, list]) -> Union[dict, list]:
+        with self.lock:
+            self.refresh_repo()
+
+            if isinstance(requests, list):
+                return [self.validate_request(request) for request in requests]
+            else:
+                return self.validate_request(requests)
+
+    def validate_request(self, request: dict) -> dict:
+        start_time = time.perf_counter()
+
+        try:
+            filename = request['filename']
+            tas = request['tas'].encode('UTF8')
+            message = validation.MessageData(request.get('message', ''), 0, 0)
+            project = self.project | request.get('project', {})
+        except (KeyError, TypeError, AttributeError) as error:
+            return {'error': f"Bad request: {error!r}"}
+
+        if 'old_tas' in request:
+            old_tas = request['old_tas'].encode('UTF8') if request['old_tas'] is not None else None
+        else:
+            old_tas = self.repo_files[self.path_cache[filename]] if filename in self.path_cache else None
+
+        possible_filename = validation.draft_possible_filename(filename, self.path_cache, str(self.repo_folder)) if old_tas is None else None
+
+        try:
+            read_files = self.read_files(filename, tas, project)
+            file_checks_key = (blob_cache.blob_sha(tas), blob_cache.blob_sha(old_tas) if old_tas else None, validation.file_checks_context(project, read_files))
+
+            if file_checks := self.file_checks_cache.get(file_checks_key):
+                validation_result = validation.revalidate_message(file_checks, filename, message, project, path_cache=self.path_cache, possible_filename=possible_filename)
+            else:
+                validation_result = validation.validate(tas, filename, message, old_tas, project, path_cache=self.path_cache, read_files=read_files,
+                                                        possible_filename=possible_filename)
+
+                if validation_result.file_checks:
+                    self.file_checks_cache.put(file_checks_key, validation_result.file_checks)
+        except UnicodeDecodeError as error:
+            validation_result = validation.ValidationResult(False, [f"Couldn't decode file: {error}"], [f"{filename} not being UTF8"])
+
+        validation_time = time.perf_counter() - start_time
+        log.info(f"Validated {filename} in {validation_time * 1000:.1f} ms: {'valid' if validation_result.valid_tas else ', '.join(validation_result.log_text)}")
+        return result_json(validation_result, validation_time)
+
+    def read_files(self, filename: str, tas: bytes, project: dict) -> Optional[dict[str, bytes]]:
+        if project['room_indexing_includes_reads'] and self.resolver:
+            file_path = validation.file_repo_path(filename, project, self.path_cache)
+            tas_tokens = validation.parse_tas_cached(tas, False, False)[1]
+            return {read_path: self.resolver.files[read_path] for read_path in self.resolver.read_closure(file_path, tas_tokens)}
+
+
+# repo path -> blob SHA of the TAS files in a commit
+def committed_blob_shas(repo_folder: Path, commit_sha: str) -> dict[str, str]:
+    tree = subprocess.run(['git', 'ls-tree', '-r', '-z', commit_sha], cwd=repo_folder, capture_output=True).stdout.decode('UTF8')
+    blob_shas = {}
+
+    for entry in tree.split('\0'):
+        info, _, path = entry.partition('\t')
+        info_split = info.split()
+
+        if path.endswith('.tas') and len(info_split) == 3 and info_split[1] == 'blob':
+            blob_shas[path] = info_split[2]
+
+    return blob_shas
+
+
+# read many blobs with one git process
+def read_blobs(repo_folder: Path, blob_shas: list[str]) -> dict[str, bytes]:
+    if not blob_shas:
+        return {}
+
+    output = subprocess.run(['git', 'cat-file', '--batch'], cwd=repo_folder, input='\n'.join(blob_shas).encode('UTF8'), capture_output=True).stdout
+    blobs = {}
+    position = 0
+
+    for sha in blob_shas:
+        header_end = output.index(b'\n', position)
+        size = int(output[position:header_end].split()[2])
+        blobs[sha] = output[header_end + 1:header_end + 1 + size]
+        position = header_end + size + 2  # content is followed by a newline
+
+    return blobs
+
+
+def result_json(validation_result: validation.ValidationResult, validation_time: float) -> dict:
+    return {'valid': validation_result.valid_tas,
+            'warning_text': validation_result.warning_text,
+            'log_text': validation_result.log_text,
+            'finaltime': validation_result.finaltime,
+            'finaltime_frames': validation_result.finaltime_frames,
+            'timesave': validation_result.timesave,
+            'wip': validation_result.wip,
+            'rooms_changed': validation_result.rooms_changed,
+            'validation_time': validation_time}
+
+
+class ValidationRequestHandler(http.server.BaseHTTPRequestHandler):
+    def do_POST(self):
+        if self.path != '/validate':
+            self.send_json(404, {'error': "Not found, use /validate"})
+            return
+
+        content_length = int(self.headers.get('Content-Length', 0))
+
+        if content_length > max_request_size:
+            self.send_json(413, {'error': f"Request is too large ({content_length / 1048576:.1f} MB)"})
+            return
+
+        try:
+            requests = orjson.loads(self.rfile.read(content_length))
+        except orjson.JSONDecodeError as error:
+            self.send_json(400, {'error': f"Couldn't parse JSON: {error}"})
+            return
+
+        self.send_json(200, self.server.service.handle(requests))
+
+    def send_json(self, status: int, data: Union[dict, list]):
+        response = orjson.dumps(data)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format: str, *args):
+        pass  # requests are already logged when validated
+
+
+log: Union[logging.Logger, utils.LogPlaceholder] = utils.LogPlaceholder()
+repo_refresh_interval = 1.0
+max_request_size = 64 * 1048576
+
+if __name__ == '__main__':
+    run_service()